@@ -37,7 +37,7 @@ vstr = h5py.special_dtype(vlen=str)
 
 
 def create(hdf5, name, dtype, shape=(None,), compression=None,
-           fillvalue=0, attrs=None):
+           fillvalue=0, attrs=None, chunks=None):
     """
     :param hdf5: a h5py.File object
     :param name: an hdf5 key string
@@ -45,15 +45,17 @@ def create(hdf5, name, dtype, shape=(None,), compression=None,
     :param shape: shape of the dataset (can be extendable)
     :param compression: None or 'gzip' are recommended
     :param attrs: dictionary of attributes of the dataset
+    :param chunks: chunk shape of the dataset (default automatic for
+                   extendable datasets and contiguous for fixed-shape ones)
     :returns: a HDF5 dataset
     """
     if shape[0] is None:  # extendable dataset
         dset = hdf5.create_dataset(
-            name, (0,) + shape[1:], dtype, chunks=True, maxshape=shape,
-            compression=compression)
+            name, (0,) + shape[1:], dtype, chunks=chunks or True,
+            maxshape=shape, compression=compression)
     else:  # fixed-shape dataset
         dset = hdf5.create_dataset(name, shape, dtype, fillvalue=fillvalue,
-                                   compression=compression)
+                                   compression=compression, chunks=chunks)
     if attrs:
         for k, v in attrs.items():
             dset.attrs[k] = v
@@ -92,6 +94,22 @@ def extend3(hdf5path, key, array, **attrs):
     return length
 
 
+def read_rows(dset, idxs):
+    """
+    Read the rows of a dataset with the given ordered indices. A single
+    hyperslab is read if the rows are dense enough, otherwise the
+    rows are read with a single fancy indexing call.
+
+    :param dset: an HDF5 dataset
+    :param idxs: an ordered array of indices
+    :returns: an array with the requested rows
+    """
+    start, stop = int(idxs[0]), int(idxs[-1]) + 1
+    if stop - start <= 2 * len(idxs):  # dense indices
+        return dset[start:stop][idxs - start]
+    return dset[list(idxs)]
+
+
 class LiteralAttrs(object):
     """
     A class to serialize a set of parameters in HDF5 format. The goal is to
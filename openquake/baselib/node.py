@@ -774,6 +774,7 @@ class ValidatingXmlParser(object):
     def __init__(self, validators, stop=None):
         self.validators = validators
         self.stop = stop
+        self.lazytags = ()
 
     @contextmanager
     def _context(self):
@@ -827,6 +828,36 @@ class ValidatingXmlParser(object):
                     self.p.ParseFile(f)
         return self._root
 
+    def parse_lazy(self, file_or_fname, lazytags, bufsize=1024 * 1024):
+        """
+        Parse a file or a filename in chunks of `bufsize` bytes and yield
+        the validated nodes with the given tags as soon as they are
+        complete. Such nodes are not attached to their parent, so that
+        the full tree is never kept in memory.
+        """
+        self.lazytags = set(lazytags)
+        self._lazy = []
+        with self._context():
+            if hasattr(file_or_fname, 'read'):
+                self.filename = getattr(
+                    file_or_fname, 'name', file_or_fname.__class__.__name__)
+                f = file_or_fname
+            else:
+                self.filename = file_or_fname
+                f = open(file_or_fname, 'rb')
+            try:
+                while True:
+                    data = f.read(bufsize)
+                    self.p.Parse(data, not data)
+                    for node in self._lazy:
+                        yield node
+                    del self._lazy[:]
+                    if not data:
+                        break
+            finally:
+                if f is not file_or_fname:
+                    f.close()
+
     def _start_element(self, longname, attrs):
         try:
             xmlns, name = longname.split('}')
@@ -846,7 +877,9 @@ class ValidatingXmlParser(object):
         with context(self.filename, node):
             self._root = self._literalnode(node)
         del self._ancestors[-1]
-        if self._ancestors:
+        if self.lazytags and striptag(node.tag) in self.lazytags:
+            self._lazy.append(self._root)
+        elif self._ancestors:
             self._ancestors[-1].append(self._root)
 
     def _char_data(self, data):
@@ -133,6 +133,15 @@ having finished all the short tasks, but you have to wait for days for
 the single core processing the slow task). The OpenQuake engine does
 a great deal of work trying to split slow sources in more manageable
 fast sources.
+
+When the weights are not reliable it is possible to call `Starmap.apply`
+with `dynamic=True`: then the chunks are not generated upfront, but only
+when a worker becomes free, with decreasing sizes and with weights
+corrected by the durations of the tasks already completed (see
+:class:`DynamicScheduler`).
+
+>>> res4 = Starmap.apply(Counter, (text,), dynamic=True).reduce()
+>>> assert res4 == res
 """
 from __future__ import print_function
 import os
@@ -145,23 +154,27 @@ import logging
 import operator
 import traceback
 import functools
+import tempfile
 import subprocess
 import multiprocessing.dummy
 from multiprocessing.connection import Client, Listener
-from concurrent.futures import as_completed, ProcessPoolExecutor, Future
+from concurrent.futures import (
+    as_completed, wait, FIRST_COMPLETED, ProcessPoolExecutor, Future)
+from io import BytesIO
 import numpy
 from openquake.baselib import hdf5
 from openquake.baselib.python3compat import pickle
 from openquake.baselib.performance import Monitor, virtual_memory
 from openquake.baselib.general import (
-    block_splitter, split_in_blocks, AccumDict, humansize)
+    block_splitter, split_in_blocks, AccumDict, WeightedSequence, humansize)
 
 executor = ProcessPoolExecutor()
 executor.pids = ()  # set by wakeup_pool
 # the num_tasks_hint is chosen to be 5 times bigger than the name of
 # cores; it is a heuristic number to get a good distribution;
 # it has no more significance than that
-executor.num_tasks_hint = executor._max_workers * 5
+TASKS_PER_CORE = 5
+executor.num_tasks_hint = executor._max_workers * TASKS_PER_CORE
 
 OQ_DISTRIBUTE = os.environ.get('OQ_DISTRIBUTE', 'futures').lower()
 
@@ -175,6 +188,24 @@ if OQ_DISTRIBUTE == 'celery':
 elif OQ_DISTRIBUTE == 'ipython':
     import ipyparallel as ipp
 
+# directory of the scratch files used to transfer big arrays, see
+# the environment variable OQ_SHARED_ARRAYS and the Pickled class
+SCRATCH_DIR = ('/dev/shm' if os.path.isdir('/dev/shm')
+               else tempfile.gettempdir())
+
+
+def shared_min_bytes():
+    """
+    :returns:
+        the minimum size in bytes of the arrays transferred via scratch
+        files instead of being pickled, as set by the environment variable
+        OQ_SHARED_ARRAYS; 0 (the default) means that the feature is
+        disabled, as it is for distributions not running on a single machine
+    """
+    if oq_distribute() not in ('futures', 'no'):
+        return 0
+    return int(os.environ.get('OQ_SHARED_ARRAYS', 0))
+
 
 def oq_distribute(task=None):
     """
@@ -211,7 +242,7 @@ def check_mem_usage(monitor=Monitor(),
                      used_mem_percent, hostname)
 
 
-def safely_call(func, args, pickle=False, conn=None):
+def safely_call(func, args, pickle=False, conn=None, min_bytes=0):
     """
     Call the given function with the given arguments safely, i.e.
     by trapping the exceptions. Return a pair (result, exc_type)
@@ -224,6 +255,10 @@ def safely_call(func, args, pickle=False, conn=None):
     :param pickle:
         if set, the input arguments are unpickled and the return value
         is pickled; otherwise they are left unchanged
+    :param conn: if given, a connection used to send the result
+    :param min_bytes:
+        if positive, the arrays in the return value bigger than that
+        are transferred via scratch files (see :class:`Pickled`)
     """
     with Monitor('total ' + func.__name__, measuremem=True) as child:
         if pickle:  # measure the unpickling time too
@@ -251,7 +286,7 @@ def safely_call(func, args, pickle=False, conn=None):
             mon._flush = True
 
     if pickle:  # it is impossible to measure the pickling time :-(
-        res = Pickled(res)
+        res = Pickled(res, min_bytes)
     if conn:  # send the result via the connection
         conn.send(res)
         conn.close()
@@ -273,12 +308,40 @@ class Pickled(object):
     have a nice string representation and length giving the size
     of the pickled bytestring.
 
+    If `min_bytes` is positive, the numpy arrays bigger than `min_bytes`
+    are not pickled: they are saved in scratch files in SCRATCH_DIR and
+    only the file names are pickled; at unpickling time the arrays are
+    memory-mapped in copy-on-write mode. The scratch files must be removed
+    with `.remove_scratch()` when all the copies have been unpickled.
+
     :param obj: the object to pickle
+    :param min_bytes: the minimum size of the arrays to share (0 = never)
     """
-    def __init__(self, obj):
+    def __init__(self, obj, min_bytes=0):
         self.clsname = obj.__class__.__name__
         self.calc_id = str(getattr(obj, 'calc_id', ''))  # for monitors
-        self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        self.paths = []  # scratch files
+        self.shared = 0  # number of bytes not pickled
+        if min_bytes:
+            io = BytesIO()
+            pickler = pickle.Pickler(io, pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = functools.partial(
+                self._save_array, min_bytes=min_bytes)
+            pickler.dump(obj)
+            self.pik = io.getvalue()
+        else:
+            self.pik = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+
+    def _save_array(self, obj, min_bytes):
+        # save big arrays in a scratch file and return the file name
+        if (type(obj) is numpy.ndarray and obj.nbytes >= min_bytes and
+                not obj.dtype.hasobject):
+            fd, path = tempfile.mkstemp(suffix='.npy', dir=SCRATCH_DIR)
+            with os.fdopen(fd, 'wb') as f:
+                numpy.save(f, obj)
+            self.paths.append(path)
+            self.shared += obj.nbytes
+            return path
 
     def __repr__(self):
         """String representation of the pickled object"""
@@ -291,7 +354,36 @@ class Pickled(object):
 
     def unpickle(self):
         """Unpickle the underlying object"""
-        return pickle.loads(self.pik)
+        if not self.paths:
+            return pickle.loads(self.pik)
+        unpickler = pickle.Unpickler(BytesIO(self.pik))
+        unpickler.persistent_load = _load_array
+        return unpickler.load()
+
+    def remove_scratch(self):
+        """Remove the scratch files, if any"""
+        for path in self.paths:
+            try:
+                os.remove(path)
+            except OSError:  # already removed
+                pass
+        self.paths = []
+
+
+def _remove_result_scratch(fut):
+    # done callback removing the scratch files of a result never read
+    try:
+        result = fut.result()
+    except Exception:  # cancelled or broken future
+        return
+    if hasattr(result, 'remove_scratch'):
+        result.remove_scratch()
+
+
+def _load_array(path):
+    # memory map an array saved by Pickled._save_array; the mapping
+    # is still valid after the removal of the file
+    return numpy.load(path, mmap_mode='c').view(numpy.ndarray)
 
 
 def get_pickled_sizes(obj):
@@ -316,7 +408,7 @@ def get_pickled_sizes(obj):
         sizes, key=lambda pair: pair[1], reverse=True)
 
 
-def pickle_sequence(objects):
+def pickle_sequence(objects, min_bytes=0):
     """
     Convert an iterable of objects into a list of pickled objects.
     If the iterable contains copies, the pickling will be done only once.
@@ -324,6 +416,7 @@ def pickle_sequence(objects):
     pickled again.
 
     :param objects: a sequence of objects to pickle
+    :param min_bytes: the minimum size of the arrays to share (0 = never)
     """
     cache = {}
     out = []
@@ -333,7 +426,7 @@ def pickle_sequence(objects):
             if isinstance(obj, Pickled):  # already pickled
                 cache[obj_id] = obj
             else:  # pickle the object
-                cache[obj_id] = Pickled(obj)
+                cache[obj_id] = Pickled(obj, min_bytes)
         out.append(cache[obj_id])
     return out
 
@@ -363,10 +456,16 @@ class IterResult(object):
         else:
             self.progress = progress
         self.sent = 0  # set in Starmap.submit_all
+        self.shared = 0  # set at the end of the iteration
+        self.scratch = []  # Pickled arguments, set in Starmap.submit_all
+        self.scheduler = None  # set in Starmap.submit_all
+        self.pending = []  # futures of the tasks, set in Starmap.submit_all
         self.received = []
+        self.received_shared = 0
         if self.num_tasks:
             self.log_percent = self._log_percent()
             next(self.log_percent)
+        self.prev_percent = 0
 
     def _log_percent(self):
         yield 0
@@ -384,39 +483,71 @@ class IterResult(object):
 
     def __iter__(self):
         self.received = []
-        for fut in self.futures:
-            check_mem_usage()  # log a warning if too much memory is used
-            if hasattr(fut, 'result'):
-                result = fut.result()
-            else:
-                result = fut
-            if isinstance(result, BaseException):
-                # this happens for instance with WorkerLostError with celery
-                raise result
-            elif hasattr(result, 'unpickle'):
-                self.received.append(len(result))
-                val, etype, mon = result.unpickle()
-            else:
-                val, etype, mon = result
-                self.received.append(len(Pickled(result)))
-            if etype:
-                raise RuntimeError(val)
-            if self.num_tasks:
-                next(self.log_percent)
-            if not self.name.startswith('_'):  # no info for private tasks
-                self.save_task_data(mon)
-            yield val
+        try:
+            for fut in self.futures:
+                check_mem_usage()  # log a warning if too much memory is used
+                if hasattr(fut, 'result'):
+                    result = fut.result()
+                else:
+                    result = fut
+                if isinstance(result, BaseException):
+                    # this happens for instance with WorkerLostError with
+                    # celery
+                    raise result
+                elif hasattr(result, 'unpickle'):
+                    self.received.append(len(result))
+                    self.received_shared += result.shared
+                    try:
+                        val, etype, mon = result.unpickle()
+                    finally:
+                        result.remove_scratch()
+                else:
+                    val, etype, mon = result
+                    self.received.append(len(Pickled(result)))
+                if etype:
+                    raise RuntimeError(val)
+                if self.num_tasks:
+                    next(self.log_percent)
+                elif self.scheduler:  # the number of tasks is not known
+                    self.scheduler.update(mon)
+                    self._log_weight_percent()
+                if not self.name.startswith('_'):  # no info for private tasks
+                    self.save_task_data(mon)
+                yield val
+        finally:
+            # remove the scratch files even if a task failed or the
+            # caller stopped iterating; the files of the results which
+            # were not read are removed as soon as the tasks end
+            self.shared = sum(pik.shared for pik in self.scratch)
+            for pik in self.scratch:
+                pik.remove_scratch()
+            for fut in self.pending:
+                if hasattr(fut, 'add_done_callback'):
+                    fut.add_done_callback(_remove_result_scratch)
 
         if self.received:
             tot = sum(self.received)
             max_per_task = max(self.received)
             self.progress('Received %s of data, maximum per task %s',
                           humansize(tot), humansize(max_per_task))
+            if self.received_shared:
+                self.progress('Received %s of arrays via scratch files',
+                              humansize(self.received_shared))
             received = {'max_per_task': max_per_task, 'tot': tot}
             tname = self.name
             dic = {tname: {'sent': self.sent, 'received': received}}
+            if self.shared or self.received_shared:
+                dic[tname]['shared'] = {'sent': self.shared,
+                                        'received': self.received_shared}
             mon.save_info(dic)
 
+    def _log_weight_percent(self):
+        # log the progress according to the fraction of the weight done
+        percent = self.scheduler.percent
+        if percent > self.prev_percent:
+            self.progress('%s %3d%%', self.name, percent)
+            self.prev_percent = percent
+
     def save_task_data(self, mon):
         if mon.hdf5path and hasattr(mon, 'weight'):
             duration = mon.children[0].duration  # the task is the first child
@@ -440,9 +571,13 @@ class IterResult(object):
         res = object.__new__(cls)
         res.received = []
         res.sent = 0
+        res.shared = 0
+        res.received_shared = 0
         for iresult in iresults:
             res.received.extend(iresult.received)
             res.sent += iresult.sent
+            res.shared += iresult.shared
+            res.received_shared += iresult.received_shared
             name = iresult.name.split('#', 1)[0]
             if hasattr(res, 'name'):
                 assert res.name.split('#', 1)[0] == name, (res.name, name)
@@ -451,6 +586,115 @@ class IterResult(object):
         return res
 
 
+def num_workers(concurrent_tasks):
+    """
+    :param concurrent_tasks: the concurrent_tasks parameter
+    :returns: the number of workers corresponding to it (at least 1)
+
+    >>> num_workers(40)
+    8
+    >>> num_workers(0)
+    1
+    """
+    return max(-(-(concurrent_tasks or 0) // TASKS_PER_CORE), 1)
+
+
+class DynamicScheduler(object):
+    """
+    Split a sequence of weighted items in chunks of homogeneous kind while
+    the tasks are running. The items are sorted by decreasing weight and
+    each chunk has a target weight equal to the remaining weight divided
+    by twice the number of workers, so that the first chunks are big and
+    the last ones are small and there is little risk of stragglers.
+    Moreover, the durations of the completed tasks are used to estimate
+    the seconds per unit of weight for each kind of items, so that the
+    heuristic weights of the remaining items are corrected. Items with
+    weight zero are ignored, items with the same weight are kept in order.
+
+    >>> sched = DynamicScheduler('ABCDE', num_workers=1)
+    >>> [list(chunk) for chunk in sched]
+    [['A', 'B', 'C'], ['D'], ['E']]
+
+    :param items: a sequence of items
+    :param num_workers: the number of workers
+    :param weight: function returning the weight of an item
+    :param key: function returning the kind of an item
+    """
+    def __init__(self, items, num_workers, weight=lambda item: 1,
+                 key=lambda item: 'Unspecified'):
+        self.num_workers = num_workers
+        self.weight = weight
+        self.items = {}  # kind -> items sorted by increasing weight
+        self.remaining = AccumDict()  # kind -> remaining weight
+        for item in items:
+            w = weight(item)
+            if w < 0:  # error
+                raise ValueError('The item %r got a negative weight %s!' %
+                                 (item, w))
+            elif w > 0:  # ignore items with weight zero
+                kind = key(item)
+                self.items.setdefault(kind, []).append(item)
+                self.remaining += {kind: w}
+        for kind, items in self.items.items():
+            # reversing first so that items with the same weight are popped
+            # in input order, i.e. are contiguous in the generated chunks
+            self.items[kind] = sorted(reversed(items), key=weight)
+        self.total_weight = sum(self.remaining.values())
+        self.kinds = []  # the kind of each generated chunk
+        self.duration = AccumDict()  # kind -> seconds spent
+        self.measured = AccumDict()  # kind -> weight processed
+
+    def speed(self, kind):
+        """
+        :returns: the estimated seconds per unit of weight for the given kind
+        """
+        if self.measured.get(kind):
+            return self.duration[kind] / self.measured[kind]
+        measured = sum(self.measured.values())
+        if measured:  # use the average speed of the known kinds
+            return sum(self.duration.values()) / measured
+        return 1.
+
+    def update(self, mon):
+        """
+        Update the speed estimates with the duration of a completed task
+
+        :param mon: the monitor returned by the task
+        """
+        weight = getattr(mon, 'weight', 0)
+        try:
+            kind = self.kinds[mon.task_no - 1]
+            duration = mon.children[0].duration
+        except (AttributeError, IndexError):  # the task had no monitor
+            return
+        self.duration += {kind: duration}
+        self.measured += {kind: weight}
+
+    @property
+    def percent(self):
+        """The percentage of the total weight already processed"""
+        return int(100. * sum(self.measured.values()) / self.total_weight)
+
+    def __iter__(self):
+        while self.items:
+            speed = {kind: self.speed(kind) for kind in self.items}
+            eff = {kind: self.remaining[kind] * speed[kind]
+                   for kind in self.items}
+            target = sum(eff.values()) / (2. * self.num_workers)
+            kind = max(eff, key=eff.get)  # the slowest kind
+            items = self.items[kind]
+            chunk = WeightedSequence()
+            while items and (
+                    not chunk or chunk.weight * speed[kind] < target):
+                item = items.pop()  # the heaviest remaining item
+                chunk.append((item, self.weight(item)))
+            self.remaining[kind] -= chunk.weight
+            if not items:
+                del self.items[kind]
+            self.kinds.append(kind)
+            yield chunk
+
+
 class Starmap(object):
     """
     A manager to submit several tasks of the same type.
@@ -477,12 +721,14 @@ class Starmap(object):
               maxweight=None,
               weight=lambda item: 1,
               key=lambda item: 'Unspecified',
-              name=None):
+              name=None, dynamic=False):
         """
         Apply a task to a tuple of the form (sequence, \*other_args)
         by first splitting the sequence in chunks, according to the weight
         of the elements and possibly to a key (see :func:
-        `openquake.baselib.general.split_in_blocks`).
+        `openquake.baselib.general.split_in_blocks`). If `dynamic` is true,
+        the chunks are generated while the tasks are running, by a
+        :class:`DynamicScheduler` instance.
 
         :param task: a task to run in parallel
         :param task_args: the arguments to be passed to the task function
@@ -492,10 +738,20 @@ class Starmap(object):
         :param maxweight: if not None, used to split the tasks
         :param weight: function to extract the weight of an item in arg0
         :param key: function to extract the kind of an item in arg0
+        :param name: the name of the task (default the function name)
+        :param dynamic:
+            if True, split the sequence dynamically, assuming
+            `concurrent_tasks / TASKS_PER_CORE` workers
         """
         arg0 = task_args[0]  # this is assumed to be a sequence
         args = task_args[1:]
-        if maxweight:
+        if dynamic:
+            scheduler = DynamicScheduler(
+                arg0, num_workers(concurrent_tasks), weight, key)
+            self = cls(task, ((chunk,) + args for chunk in scheduler), name)
+            self.scheduler = scheduler
+            return self
+        elif maxweight:
             chunks = block_splitter(arg0, maxweight, weight, key)
         else:
             chunks = split_in_blocks(arg0, concurrent_tasks or 1, weight, key)
@@ -507,6 +763,8 @@ class Starmap(object):
         self.name = name or oqtask.__name__
         self.results = []
         self.sent = AccumDict()
+        self.scratch = []  # Pickled arguments with scratch files
+        self.scheduler = None  # set by Starmap.apply(..., dynamic=True)
         self.distribute = oq_distribute(oqtask)
         # a task can be a function, a class or an instance with a __call__
         if inspect.isfunction(oqtask):
@@ -542,8 +800,11 @@ class Starmap(object):
             sent = {}
             res = safely_call(self.task_func, args)
         else:
-            piks = pickle_sequence(args)
+            piks = pickle_sequence(args, shared_min_bytes())
             sent = {arg: len(p) for arg, p in zip(self.argnames, piks)}
+            for pik in set(piks):
+                if pik.paths and pik not in self.scratch:
+                    self.scratch.append(pik)
             res = self._submit(piks)
         self.sent += sent
         self.results.append(res)
@@ -556,7 +817,8 @@ class Starmap(object):
             return res
         else:  # submit tasks by using the ProcessPoolExecutor or ipyparallel
             return self.executor.submit(
-                safely_call, self.task_func, piks, True)
+                safely_call, self.task_func, piks, True, None,
+                shared_min_bytes())
 
     def _iterfutures(self):
         # compatibility wrapper for different concurrency frameworks
@@ -621,28 +883,74 @@ class Starmap(object):
             return IterResult(qsub(self.task_func, allargs),
                               self.name, len(allargs), self.progress)
 
+        self.scratch = []
+        if self.scheduler and self.distribute == 'futures':
+            self.progress('Submitting "%s" tasks dynamically', self.name)
+            ir = IterResult(self._iterdynamic(), self.name, None,
+                            self.progress)
+            ir.sent = self.sent  # updated while submitting
+            ir.scratch = self.scratch  # removed after receiving the results
+            ir.pending = self.results
+            ir.scheduler = self.scheduler
+            return ir
+
         task_no = 0
         for args in self.task_args:
             task_no += 1
             if task_no == 1:  # first time
                 self.progress('Submitting %s "%s" tasks', nargs, self.name)
-            if isinstance(args[-1], Monitor):
-                # add incremental task number and task weight
-                args[-1].task_no = task_no
-                args[-1].weight = getattr(args[0], 'weight', 1.)
-            self.submit(*args)
+            self._submit_task(task_no, args)
         if not task_no:
             self.progress('No %s tasks were submitted', self.name)
         # NB: keep self._iterfutures() an iterator, especially with celery!
         ir = IterResult(self._iterfutures(), self.name, task_no,
                         self.progress)
         ir.sent = self.sent  # for information purposes
+        ir.scratch = self.scratch  # removed after receiving the results
+        ir.pending = self.results
+        shared = sum(pik.shared for pik in self.scratch)
         if self.sent:
             self.progress('Sent %s of data in %d task(s)',
                           humansize(sum(self.sent.values())),
                           ir.num_tasks)
+        if shared:
+            self.progress('Sent %s of arrays via scratch files',
+                          humansize(shared))
         return ir
 
+    def _submit_task(self, task_no, args):
+        if isinstance(args[-1], Monitor):
+            # add incremental task number and task weight
+            args[-1].task_no = task_no
+            args[-1].weight = getattr(args[0], 'weight', 1.)
+        self.submit(*args)
+
+    def _iterdynamic(self):
+        # submit a new task only when a worker is free; the next chunk
+        # is generated by the scheduler after the completed tasks have
+        # been processed by the IterResult, so that their durations
+        # can be taken into account
+        allargs = iter(self.task_args)
+        task_no = 0
+        exhausted = False
+        while True:
+            while not exhausted and (
+                    len(self.results) < self.scheduler.num_workers):
+                try:
+                    args = next(allargs)
+                except StopIteration:
+                    exhausted = True
+                else:
+                    task_no += 1
+                    self._submit_task(task_no, args)
+            if not self.results:
+                break
+            done, pending = wait(self.results, return_when=FIRST_COMPLETED)
+            # update in place, the list is shared with the IterResult
+            self.results[:] = pending
+            for fut in done:
+                yield fut
+
     def __iter__(self):
         return iter(self.submit_all())
 
@@ -691,9 +999,15 @@ class BaseStarmap(object):
     poolfactory = staticmethod(lambda size: multiprocessing.Pool(size))
 
     @classmethod
-    def apply(cls, func, args, concurrent_tasks=executor._max_workers * 5,
-              weight=lambda item: 1, key=lambda item: 'Unspecified'):
-        chunks = split_in_blocks(args[0], concurrent_tasks or 1, weight, key)
+    def apply(cls, func, args, concurrent_tasks=executor.num_tasks_hint,
+              weight=lambda item: 1, key=lambda item: 'Unspecified',
+              dynamic=False):
+        if dynamic:  # the chunks are generated upfront, with no feedback
+            chunks = DynamicScheduler(
+                args[0], num_workers(concurrent_tasks), weight, key)
+        else:
+            chunks = split_in_blocks(
+                args[0], concurrent_tasks or 1, weight, key)
         if concurrent_tasks == 0:
             cls = Sequential
         return cls(func, (((chunk,) + args[1:]) for chunk in chunks))
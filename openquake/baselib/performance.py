@@ -108,6 +108,7 @@ class Monitor(object):
         self.counts = 0
         self.address = None
         self._flush = True
+        self._incr = 1
 
     @property
     def dt(self):
@@ -158,9 +159,24 @@ class Monitor(object):
             self.mem += self.stop_mem - self.start_mem
         self._stop_time = time.time()
         self.duration += self._stop_time - self._start_time
-        self.counts += 1
+        self.counts += self._incr
+        self._incr = 1
         self.on_exit()
 
+    def counting(self, n):
+        """
+        Make the next measurement count as `n` operations, for instance
+        when a block of ruptures is processed at once:
+
+        >>> mon = Monitor()
+        >>> with mon.counting(3):
+        ...     pass
+        >>> mon.counts
+        3
+        """
+        self._incr = n
+        return self
+
     def on_exit(self):
         "To be overridden in subclasses"
         if self.autoflush:
@@ -176,3 +176,20 @@ param=yyy
     def test_can_pickle(self):
         node = n.Node('tag')
         self.assertEqual(pickle.loads(pickle.dumps(node)), node)
+
+    def test_parse_lazy(self):
+        # the lazy nodes are validated and not attached to their parent
+        xmlfile = io.BytesIO(b"""\
+<root>
+<assets>
+<asset id="a1" number="1" />
+<asset id="a2" number="2" />
+<asset id="a3" number="3" />
+</assets>
+</root>
+""")
+        parser = n.ValidatingXmlParser({'number': int})
+        assets = list(parser.parse_lazy(xmlfile, ['asset'], bufsize=16))
+        self.assertEqual([a['number'] for a in assets], [1, 2, 3])
+        self.assertEqual([a.lineno for a in assets], [3, 4, 5])
+        self.assertEqual(len(parser._root.assets), 0)  # no children
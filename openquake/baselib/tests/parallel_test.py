@@ -16,6 +16,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import glob
+import time
 import mock
 import unittest
 import numpy
@@ -38,6 +41,33 @@ def get_len(data, monitor):
     return result
 
 
+def get_len_mon(data, monitor):
+    with monitor:
+        return {'n': len(data)}
+
+
+def double(array):
+    return array * 2
+
+
+def double_or_fail(array):
+    if array[0] == 1:
+        raise ValueError('failing task')
+    return array * 2
+
+
+def scratch_files():
+    return set(glob.glob(os.path.join(parallel.SCRATCH_DIR, '*.npy')))
+
+
+def wait_removal(files, timeout=10):
+    # the scratch files of the unread results are removed by callbacks
+    t0 = time.time()
+    while scratch_files() - files and time.time() - t0 < timeout:
+        time.sleep(.1)
+    return scratch_files() - files
+
+
 class StarmapTestCase(unittest.TestCase):
     monitor = parallel.Monitor()
 
@@ -64,6 +94,62 @@ class StarmapTestCase(unittest.TestCase):
         partial_sums = sorted(dic['n'] for dic in res)
         self.assertEqual(partial_sums, [1, 2, 2])
 
+    def test_apply_dynamic(self):
+        res = parallel.Starmap.apply(
+            get_len_mon, (numpy.arange(100), self.monitor),
+            weight=lambda item: item % 3, dynamic=True).submit_all()
+        self.assertEqual(sum(dic['n'] for dic in res), 66)  # zeros ignored
+        self.assertEqual(res.scheduler.percent, 100)
+
+    def test_dynamic_scheduler(self):
+        # the measured durations are used to correct the weights
+        sched = parallel.DynamicScheduler(
+            'aaaabbbb', 2, key=lambda char: char)
+        chunks = iter(sched)
+        self.assertEqual(list(next(chunks)), ['a', 'a'])
+        mon = parallel.Monitor()
+        mon.task_no, mon.weight = 1, 2
+        child = parallel.Monitor()
+        child.duration = 20.  # the 'a' items are 10 times slower
+        mon.children.append(child)
+        sched.update(mon)
+        self.assertEqual(sched.speed('a'), 10.)
+        self.assertEqual(sched.speed('b'), 10.)  # unknown, use the average
+        self.assertEqual(sched.percent, 25)
+        # now the target weight is (2 + 4) * 10 / 4 = 15 seconds
+        self.assertEqual(list(next(chunks)), ['b', 'b'])
+
+    def test_dynamic_rebalancing(self):
+        def done(task_no, weight, duration):
+            mon = parallel.Monitor()
+            mon.task_no, mon.weight = task_no, weight
+            child = parallel.Monitor()
+            child.duration = duration
+            mon.children.append(child)
+            sched.update(mon)
+        sched = parallel.DynamicScheduler(
+            'aaaaaaabbbbbb', 2, key=lambda char: char)
+        chunks = iter(sched)
+        self.assertEqual(''.join(next(chunks)), 'aaaa')
+        done(1, 4, 40.)
+        self.assertEqual(''.join(next(chunks)), 'bbb')
+        done(2, 3, 3.)
+        # the 'a' items are 10 times slower than the 'b' items, so they
+        # are sent first and one per task, to avoid stragglers
+        self.assertEqual([''.join(chunk) for chunk in chunks],
+                         ['a', 'a', 'a', 'b', 'b', 'b'])
+
+    def test_dynamic_num_workers(self):
+        # the number of workers is inferred from concurrent_tasks
+        smap = parallel.Starmap.apply(
+            get_len_mon, (numpy.arange(100), self.monitor),
+            concurrent_tasks=10, dynamic=True)
+        self.assertEqual(smap.scheduler.num_workers, 2)
+        smap = parallel.Sequential.apply(
+            get_len_mon, (numpy.arange(100), self.monitor),
+            concurrent_tasks=10, dynamic=True)
+        self.assertEqual(sum(dic['n'] for dic in smap), 100)
+
     def test_spawn(self):
         all_data = [
             ('a', list(range(10))), ('b', list(range(20))),
@@ -83,6 +169,52 @@ class StarmapTestCase(unittest.TestCase):
         self.assertEqual(res[1], RuntimeError)
         self.assertEqual(res[2].operation, mon.operation)
 
+    def test_pickled_shared(self):
+        array = numpy.arange(1000)
+        pik = parallel.Pickled(dict(big=array, small=array[:10]), 1000)
+        self.assertEqual(pik.shared, array.nbytes)  # the big array
+        [path] = pik.paths
+        self.assertLess(len(pik), array.nbytes)
+        dic = pik.unpickle()
+        numpy.testing.assert_equal(dic['big'], array)
+        numpy.testing.assert_equal(dic['small'], array[:10])
+        pik.remove_scratch()
+        self.assertFalse(os.path.exists(path))
+        dic['big'][0] = 1  # copy-on-write, the array is writeable
+        self.assertEqual(dic['big'][0], 1)
+
+    def test_shared_arrays(self):
+        array = numpy.arange(100000)
+        with mock.patch.dict(os.environ, OQ_SHARED_ARRAYS='100000'):
+            res = parallel.Starmap(
+                double, [(array,), (array + 1,)]).submit_all()
+            total = sum(res)
+        numpy.testing.assert_equal(total, 4 * array + 2)
+        self.assertEqual(res.shared, 2 * array.nbytes)
+        self.assertEqual(res.received_shared, 2 * array.nbytes)
+
+    def test_shared_arrays_failing_task(self):
+        array = numpy.arange(100000)
+        before = scratch_files()
+        with mock.patch.dict(os.environ, OQ_SHARED_ARRAYS='100000'):
+            res = parallel.Starmap(
+                double_or_fail, [(array,), (array + 1,), (array + 2,)])
+            with self.assertRaises(RuntimeError) as ctx:
+                list(res.submit_all())
+        self.assertIn('failing task', str(ctx.exception))
+        self.assertEqual(wait_removal(before), set())
+
+    def test_shared_arrays_stop_iteration(self):
+        array = numpy.arange(100000)
+        before = scratch_files()
+        with mock.patch.dict(os.environ, OQ_SHARED_ARRAYS='100000'):
+            ir = parallel.Starmap(
+                double, [(array,), (array + 2,), (array + 4,)]).submit_all()
+            it = iter(ir)
+            next(it)  # read only the first result
+            it.close()
+        self.assertEqual(wait_removal(before), set())
+
     if celery:
         def test_received(self):
             with mock.patch('os.environ', OQ_DISTRIBUTE='celery'):
@@ -343,13 +343,15 @@ class HazardCalculator(BaseCalculator):
         siteobjects = geo.utils.GeographicObjects(
             Site(sid, lon, lat) for sid, lon, lat in
             zip(sitecol.sids, sitecol.lons, sitecol.lats))
+        assets_by_loc = [assets for assets in self.assetcol.assets_by_site()
+                         if len(assets)]
+        lons, lats = numpy.array(
+            [assets[0].location for assets in assets_by_loc]).reshape(-1, 2).T
+        idxs, _ = siteobjects.get_closest_many(lons, lats, maximum_distance)
         assets_by_sid = general.AccumDict()
-        for assets in self.assetcol.assets_by_site():
-            if len(assets):
-                lon, lat = assets[0].location
-                site, _ = siteobjects.get_closest(lon, lat, maximum_distance)
-                if site:
-                    assets_by_sid += {site.sid: list(assets)}
+        for idx, assets in zip(idxs, assets_by_loc):
+            if idx != -1:
+                assets_by_sid += {siteobjects.objects[idx].sid: list(assets)}
         if not assets_by_sid:
             raise AssetSiteAssociationError(
                 'Could not associate any site to any assets within the '
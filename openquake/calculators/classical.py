@@ -29,8 +29,8 @@ from openquake.baselib.general import AccumDict
 from openquake.hazardlib.geo.utils import get_spherical_bounding_box
 from openquake.hazardlib.geo.utils import get_longitudinal_extent
 from openquake.hazardlib.geo.geodetic import npoints_between
-from openquake.hazardlib.calc.hazard_curve import (
-    pmap_from_grp, ProbabilityMap)
+from openquake.hazardlib.calc.hazard_curve import pmap_from_grp
+from openquake.hazardlib.probability_map import ArrayProbabilityMap
 from openquake.hazardlib.stats import compute_pmap_stats
 from openquake.hazardlib.calc.filters import SourceFilter
 from openquake.commonlib import datastore, source, calc, util
@@ -40,6 +40,7 @@ U16 = numpy.uint16
 F32 = numpy.float32
 F64 = numpy.float64
 weight = operator.attrgetter('weight')
+MAX_CHUNK_BYTES = 1024 ** 2  # maximum size of the chunks of the hcurves
 
 
 class BBdict(AccumDict):
@@ -181,7 +182,8 @@ def classical(sources, src_filter, gsims, param, monitor):
     :param monitor:
         a monitor instance
     :returns:
-        an AccumDict rlz -> curves
+        an ArrayProbabilityMap with attributes .calc_times, .grp_id,
+        .eff_ruptures and .bbs
     """
     truncation_level = param['truncation_level']
     imtls = param['imtls']
@@ -199,7 +201,8 @@ def classical(sources, src_filter, gsims, param, monitor):
         sources, src_filter, imtls, gsims, truncation_level,
         bbs=bbs, monitor=monitor)
     pmap.bbs = bbs
-    return pmap
+    # the array-backed map is transferred without per-site objects
+    return ArrayProbabilityMap.from_pmap(pmap)
 
 
 def saving_sources_by_task(iterargs, dstore):
@@ -226,7 +229,7 @@ class PSHACalculator(base.HazardCalculator):
         Aggregate dictionaries of hazard curves by updating the accumulator.
 
         :param acc: accumulator dictionary
-        :param pmap: a ProbabilityMap
+        :param pmap: a ProbabilityMap or ArrayProbabilityMap
         """
         with self.monitor('aggregate curves', autoflush=True):
             for src_id, nsites, calc_time in pmap.calc_times:
@@ -254,13 +257,13 @@ class PSHACalculator(base.HazardCalculator):
 
     def zerodict(self):
         """
-        Initial accumulator, a dict grp_id -> ProbabilityMap(L, G)
+        Initial accumulator, a dict grp_id -> ArrayProbabilityMap(L, G)
         """
         zd = AccumDict()
         num_levels = len(self.oqparam.imtls.array)
         for grp in self.csm.src_groups:
             num_gsims = len(self.rlzs_assoc.gsims_by_grp_id[grp.id])
-            zd[grp.id] = ProbabilityMap(num_levels, num_gsims)
+            zd[grp.id] = ArrayProbabilityMap(num_levels, num_gsims)
         zd.calc_times = []
         zd.eff_ruptures = AccumDict()  # grp_id -> eff_ruptures
         zd.bb_dict = BBdict()
@@ -409,21 +412,20 @@ def build_hcurves_and_stats(pgetter, hstats, monitor):
     :param pgetter: an :class:`openquake.commonlib.calc.PmapGetter`
     :param hstats: a list of pairs (statname, statfunc)
     :param monitor: instance of Monitor
-    :returns: a dictionary kind -> ProbabilityMap
+    :returns: a dictionary kind -> ArrayProbabilityMap
 
     The "kind" is a string of the form 'rlz-XXX' or 'mean' of 'quantile-XXX'
-    used to specify the kind of output.
+    used to specify the kind of output. All the statistics are computed
+    in a single pass over the dense (R, N, L) array of the tile.
     """
     with monitor('combine pmaps'), pgetter:
         pmaps = pgetter.get_pmaps(pgetter.sids)
     if sum(len(pmap) for pmap in pmaps) == 0:  # no data
         return {}
-    pmap_by_kind = {}
-    for kind, stat in hstats:
-        with monitor('compute ' + kind):
-            pmap = compute_pmap_stats(pmaps, [stat], pgetter.weights)
-        pmap_by_kind[kind] = pmap
-    return pmap_by_kind
+    with monitor('compute stats'):
+        pmap = ArrayProbabilityMap.from_pmap(compute_pmap_stats(
+            pmaps, [stat for kind, stat in hstats], pgetter.weights))
+    return {kind: pmap.extract(i) for i, (kind, stat) in enumerate(hstats)}
 
 
 @base.calculators.add('classical')
@@ -464,10 +466,16 @@ class ClassicalCalculator(PSHACalculator):
             sids=numpy.arange(N, dtype=numpy.uint32))
         nbytes = N * L * 4  # bytes per realization (32 bit floats)
         totbytes = 0
+        # one chunk per tile, consistently with the tiles in gen_args,
+        # but with at most 1 MB of rows, since HDF5 cannot store chunks
+        # bigger than 4 GB and big chunks are inefficient anyway
+        tilesize = int(math.ceil(N / (oq.concurrent_tasks or 1)))
+        chunksize = max(min(tilesize, MAX_CHUNK_BYTES // (L * 4)), 1)
         if len(rlzs) > 1:
             for name, stat in oq.hazard_stats():
                 self.datastore.create_dset(
-                    'hcurves/' + name, F32, (N, L, 1), attrs=attrs)
+                    'hcurves/' + name, F32, (N, L, 1), attrs=attrs,
+                    chunks=(chunksize, L, 1))
                 totbytes += nbytes
         if 'hcurves' in self.datastore:
             self.datastore.set_attrs('hcurves', nbytes=totbytes)
@@ -497,16 +505,20 @@ class ClassicalCalculator(PSHACalculator):
         datastore; the accumulator stores the number of bytes saved.
 
         :param acc: dictionary kind -> nbytes
-        :param pmap_by_kind: a dictionary of ProbabilityMaps
+        :param pmap_by_kind: a dictionary of ArrayProbabilityMaps
         """
         with self.monitor('saving statistical hcurves', autoflush=True):
             for kind in pmap_by_kind:
-                pmap = pmap_by_kind[kind]
+                pmap = ArrayProbabilityMap.from_pmap(pmap_by_kind[kind])
                 if pmap:
                     key = 'hcurves/' + kind
                     dset = self.datastore.getitem(key)
-                    for sid in pmap:
-                        dset[sid] = pmap[sid].array
+                    sids = pmap.sids  # sorted
+                    start, stop = sids[0], sids[-1] + 1
+                    if stop - start == len(sids):  # a single hyperslab
+                        dset[start:stop] = pmap.array
+                    else:  # h5py wants a list of indices
+                        dset[list(sids)] = pmap.array
                     # in the datastore we save 4 byte floats, thus we
                     # divide the memory consumption by 2: pmap.nbytes / 2
                     acc += {kind: pmap.nbytes // 2}
@@ -71,33 +71,30 @@ def compute_disagg(src_filter, sources, src_group_id, rlzs_assoc,
     collecting_mon = monitor('collecting bins')
     arranging_mon = monitor('arranging bins')
 
-    for site, sid in zip(sitecol, sitecol.sids):
-        # edges as wanted by disagg._arrange_data_in_bins
-        try:
-            edges = bin_edges[sid]
-        except KeyError:
-            # bin_edges for a given site are missing if the site is far away
-            continue
+    # bin_edges for a given site are missing if the site is far away
+    sites = sitecol.filter(numpy.array([sid in bin_edges
+                                        for sid in sitecol.sids]))
+    if sites is None:
+        return result
 
-        # generate source, rupture, sites once per site
-        with collecting_mon:
-            bdata = disagg._collect_bins_data(
-                trt_num, sources, site, curves_dict[sid],
-                src_group_id, rlzs_assoc, gsims, oqparam.imtls,
-                oqparam.poes_disagg, oqparam.truncation_level,
-                oqparam.num_epsilon_bins, oqparam.iml_disagg,
-                monitor)
+    # generate source, rupture, sites once for all sites
+    with collecting_mon:
+        bdata = disagg._collect_bins_data(
+            trt_num, sources, sites, curves_dict,
+            src_group_id, rlzs_assoc, gsims, oqparam.imtls,
+            oqparam.poes_disagg, oqparam.truncation_level,
+            oqparam.num_epsilon_bins, oqparam.iml_disagg,
+            monitor)
 
-        for (rlzi, poe, imt), iml_pne_pairs in bdata.pnes.items():
-            # extract the probabilities of non-exceedance for the
+    for sid, bd in bdata.items():
+        # edges as wanted by disagg._arrange_data_in_bins
+        edges = bin_edges[sid]
+        for (rlzi, poe, imt), (iml, probs) in bd.pnes.items():
+            # probs are the probabilities of non-exceedance for the
             # given realization, disaggregation PoE, and IMT
-            iml = iml_pne_pairs[0][0]
-            probs = numpy.array([p for (i, p) in iml_pne_pairs], float)
 
             # bins in a format handy for hazardlib
-            bins = [bdata.mags, bdata.dists,
-                    bdata.lons, bdata.lats,
-                    bdata.trts, None, probs]
+            bins = [bd.mags, bd.dists, bd.lons, bd.lats, bd.trts, None, probs]
 
             # call disagg._arrange_data_in_bins
             with arranging_mon:
@@ -18,22 +18,19 @@
 
 import time
 import os.path
-import operator
 import logging
-import collections
-import mock
 
 import numpy
 
-from openquake.baselib import hdf5
 from openquake.baselib.python3compat import zip
 from openquake.baselib.general import AccumDict, block_splitter, humansize
 from openquake.hazardlib.calc.filters import FarAwayRupture
+from openquake.hazardlib.calc.stochastic import random_numbers
 from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.hazardlib.stats import compute_pmap_stats
 from openquake.risklib.riskinput import GmfGetter, str2rsi, rsi2str
 from openquake.baselib import parallel
-from openquake.commonlib import calc, util
+from openquake.commonlib import calc, util, config
 from openquake.calculators import base
 from openquake.calculators.classical import ClassicalCalculator, PSHACalculator
 
@@ -46,6 +43,7 @@ F64 = numpy.float64
 TWO16 = 2 ** 16  # 65,536
 TWO32 = 2 ** 32  # 4,294,967,296
 TWO48 = 2 ** 48  # 281,474,976,710,656
+MAX_RANDOM_NUMBERS = 10 ** 6  # generated at once in sample_ruptures
 
 # ######################## rupture calculator ############################ #
 
@@ -115,14 +113,14 @@ def compute_ruptures(sources, src_filter, gsims, param, monitor):
         if s_sites is None:
             continue
         num_ruptures += src.num_ruptures
-        num_occ_by_rup = sample_ruptures(
+        rup_occs = sample_ruptures(
             src, param['ses_per_logic_tree_path'], param['samples'],
             param['seed'])
         # NB: the number of occurrences is very low, << 1, so it is
         # more efficient to filter only the ruptures that occur, i.e.
         # to call sample_ruptures *before* the filtering
         for ebr in _build_eb_ruptures(
-                src, num_occ_by_rup, src_filter.integration_distance,
+                src, rup_occs, src_filter.integration_distance,
                 s_sites, param['seed'], rup_mon):
             eb_ruptures.append(ebr)
         dt = time.time() - t0
@@ -136,60 +134,64 @@ def compute_ruptures(sources, src_filter, gsims, param, monitor):
 
 def sample_ruptures(src, num_ses, num_samples, seed):
     """
-    Sample the ruptures contained in the given source.
+    Sample the ruptures contained in the given source. Each rupture has
+    its own stream of random numbers, depending on its serial number, so
+    that the result does not depend on how the sources are split in tasks;
+    the streams of a block of ruptures are generated with a single call.
 
     :param src: a hazardlib source object
     :param num_ses: the number of Stochastic Event Sets to generate
     :param num_samples: how many samples for the given source
     :param seed: master seed from the job.ini file
-    :returns: a dictionary of dictionaries rupture -> {ses_id: num_occurrences}
+    :returns:
+        a list of pairs (rupture, occurrences) for the occurring ruptures,
+        where occurrences is an array of shape (num_samples, num_ses)
     """
-    # the dictionary `num_occ_by_rup` contains a dictionary
-    # ses_id -> num_occurrences for each occurring rupture
-    num_occ_by_rup = collections.defaultdict(AccumDict)
-    # generating ruptures for the given source
-    for rup_no, rup in enumerate(src.iter_ruptures()):
-        rup.seed = src.serial[rup_no] + seed
-        numpy.random.seed(rup.seed)
-        for sampleid in range(num_samples):
-            for ses_idx in range(1, num_ses + 1):
-                num_occurrences = rup.sample_number_of_occurrences()
-                if num_occurrences:
-                    num_occ_by_rup[rup] += {
-                        (sampleid, ses_idx): num_occurrences}
-        rup.rup_no = rup_no + 1
-    return num_occ_by_rup
-
-
-def _build_eb_ruptures(
-        src, num_occ_by_rup, idist, s_sites, random_seed, rup_mon):
+    rup_occs = []
+    shape = (num_samples, num_ses)
+    blocksize = max(MAX_RANDOM_NUMBERS // (num_samples * num_ses), 1)
+    start = 0
+    for rups in block_splitter(src.iter_ruptures(), blocksize):
+        seeds = src.serial[start:start + len(rups)].astype(int) + seed
+        start += len(rups)
+        probs = random_numbers(seeds, shape)
+        if hasattr(rups[0], 'pmf'):  # nonparametric ruptures
+            all_occs = [rup.get_number_of_occurrences(p)
+                        for rup, p in zip(rups, probs)]
+        else:  # all the ruptures of a source have the same TOM
+            rates = numpy.array([rup.occurrence_rate for rup in rups])
+            tom = rups[0].temporal_occurrence_model
+            all_occs = tom.get_number_of_occurrences(rates, probs)
+        for rup, rup_seed, occs in zip(rups, seeds, all_occs):
+            if occs.any():
+                rup.seed = rup_seed
+                rup_occs.append((rup, occs))
+    return rup_occs
+
+
+def _build_eb_ruptures(src, rup_occs, idist, s_sites, random_seed, rup_mon):
     """
-    Filter the ruptures stored in the dictionary num_occ_by_rup and
-    yield pairs (rupture, <list of associated EBRuptures>)
+    Filter the ruptures returned by sample_ruptures and yield EBRuptures
     """
-    for rup in sorted(num_occ_by_rup, key=operator.attrgetter('rup_no')):
+    for rup, occs in rup_occs:
         with rup_mon:
             try:
                 r_sites, dists = idist.get_closest(s_sites, rup)
             except FarAwayRupture:
                 # ignore ruptures which are far away
-                del num_occ_by_rup[rup]  # save memory
                 continue
 
         # creating EBRuptures
         serial = rup.seed - random_seed + 1
-        events = []
-        for (sampleid, ses_idx), num_occ in sorted(
-                num_occ_by_rup[rup].items()):
-            for _ in range(num_occ):
-                # NB: the 0 below is a placeholder; the right eid will be
-                # set a bit later, in set_eids
-                events.append((0, ses_idx, sampleid))
-        if events:
-            yield calc.EBRupture(
-                rup, r_sites.indices,
-                numpy.array(events, calc.event_dt),
-                src.src_group_id, serial)
+        sampleids, ses_idxs = occs.nonzero()
+        num_occs = occs[sampleids, ses_idxs]
+        # NB: the eid is a placeholder; the right eid will be
+        # set a bit later, in set_eids
+        events = numpy.zeros(num_occs.sum(), calc.event_dt)
+        events['ses'] = numpy.repeat(ses_idxs + 1, num_occs)
+        events['sample'] = numpy.repeat(sampleids, num_occs)
+        yield calc.EBRupture(
+            rup, r_sites.indices, events, src.src_group_id, serial)
 
 
 def _count(ruptures):
@@ -331,8 +333,7 @@ def compute_gmfs_and_curves(getter, oq, monitor):
         hc_mon = monitor('building hazard curves', measuremem=False)
         duration = oq.investigation_time * oq.ses_per_logic_tree_path
         with monitor('building hazard', measuremem=True):
-            gmfcoll[grp_id] = data = numpy.fromiter(
-                getter.gen_gmv(), getter.gmf_data_dt)
+            gmfcoll[grp_id] = data = getter.get_gmfdata()
             hazard = sorted(getter.get_hazard(data).items())
         for rlzi, hazardr in hazard:
             for sid in getter.sids:
@@ -348,8 +349,7 @@ def compute_gmfs_and_curves(getter, oq, monitor):
                         hcurves[rsi2str(rlzi, sid, imt)] = poes
     else:  # fast lane
         with monitor('building hazard', measuremem=True):
-            gmfcoll[grp_id] = numpy.fromiter(
-                getter.gen_gmv(), getter.gmf_data_dt)
+            gmfcoll[grp_id] = getter.get_gmfdata()
     return dict(gmfcoll=gmfcoll if oq.ground_motion_fields else None,
                 hcurves=hcurves, gmdata=getter.gmdata)
 
@@ -362,14 +362,10 @@ def get_ruptures_by_grp(dstore):
     for grp in dstore['ruptures']:
         n += len(dstore['ruptures/' + grp])
     logging.info('Reading %d ruptures from the datastore', n)
-    # disable check on PlaceSurface to support UCERF ruptures
-    with mock.patch(
-            'openquake.hazardlib.geo.surface.PlanarSurface.'
-            'IMPERFECT_RECTANGLE_TOLERANCE', numpy.inf):
-        ruptures_by_grp = AccumDict(accum=[])
-        for grp in dstore['ruptures']:
-            grp_id = int(grp[4:])  # strip 'grp-'
-            ruptures_by_grp[grp_id] = list(calc.get_ruptures(dstore, grp_id))
+    ruptures_by_grp = AccumDict(accum=[])
+    for grp in dstore['ruptures']:
+        grp_id = int(grp[4:])  # strip 'grp-'
+        ruptures_by_grp[grp_id] = list(calc.get_ruptures(dstore, grp_id))
     return ruptures_by_grp
 
 
@@ -394,6 +390,42 @@ def save_gmdata(calc, n_rlzs):
     logging.info('Generated %s of GMFs', humansize(array['nbytes'].sum()))
 
 
+def save_eid_index(dstore, key, blocksize=1000000):
+    """
+    Save the datasets `gmf_data_idx/<key>/rows`, containing the indices of
+    the records of `gmf_data/<key>` sorted by event ID block by block, and
+    `gmf_data_idx/<key>/eid`, containing records (eid, start, stop) sorted
+    by event ID, pointing to the rows. An event spanning several blocks
+    has several records. The eid column is read one block at the time,
+    so the memory occupation does not depend on the size of the dataset.
+
+    :param dstore: a DataStore instance
+    :param key: a string of the form grp-XX
+    :param blocksize: number of records read at the time
+    """
+    dset = dstore['gmf_data/' + key]
+    index_dt = [('eid', U64), ('start', U64), ('stop', U64)]
+    rowskey = 'gmf_data_idx/%s/rows' % key
+    dstore.create_dset(rowskey, U64)
+    indices = []
+    for offset in range(0, len(dset), blocksize):
+        eids = dset[offset:offset + blocksize]['eid']
+        rows = numpy.argsort(eids, kind='mergesort')  # stable sort
+        eids = eids[rows]
+        idxs = numpy.concatenate(
+            [[0], (eids[1:] != eids[:-1]).nonzero()[0] + 1, [len(eids)]])
+        index = numpy.zeros(len(idxs) - 1, index_dt)
+        index['eid'] = eids[idxs[:-1]]
+        index['start'] = idxs[:-1] + offset
+        index['stop'] = idxs[1:] + offset
+        indices.append(index)
+        dstore.extend(rowskey, (rows + offset).astype(U64))
+    index = (numpy.concatenate(indices) if indices
+             else numpy.zeros(0, index_dt))
+    dstore['gmf_data_idx/%s/eid' % key] = index[
+        numpy.argsort(index['eid'], kind='mergesort')]
+
+
 @base.calculators.add('event_based')
 class EventBasedCalculator(ClassicalCalculator):
     """
@@ -422,8 +454,7 @@ class EventBasedCalculator(ClassicalCalculator):
             with sav_mon:
                 for grp_id, array in res['gmfcoll'].items():
                     if len(array):
-                        key = 'gmf_data/grp-%02d' % grp_id
-                        hdf5.extend3(self.datastore.hdf5path, key, array)
+                        self.get_gmf_buffer(grp_id).append(array)
         slicedic = self.oqparam.imtls.slicedic
         with agg_mon:
             for key, poes in res['hcurves'].items():
@@ -438,6 +469,18 @@ class EventBasedCalculator(ClassicalCalculator):
                 self, res['ruptures'])
         return acc
 
+    def get_gmf_buffer(self, grp_id):
+        """
+        :param grp_id: source group ID
+        :returns: the buffer of the dataset gmf_data/grp-XX
+        """
+        key = 'grp-%02d' % grp_id
+        maxbytes = int(config.get('hazard', 'gmf_buffer_mb') or 100)
+        return self.datastore.buffer(
+            'gmf_data/' + key, maxbytes * 1024 ** 2,
+            config.get('hazard', 'gmf_compression') or None,
+            sortby=('rlzi', 'sid'), indexkey='gmf_data_idx/%s/rlzi_sid' % key)
+
     def gen_args(self, ruptures_by_grp):
         """
         :param ruptures_by_grp: a dictionary of EBRupture objects
@@ -487,6 +530,11 @@ class EventBasedCalculator(ClassicalCalculator):
         self.gmdata = {}
         acc = res.reduce(self.combine_pmaps_and_save_gmfs, {
             rlz.ordinal: ProbabilityMap(L, 1) for rlz in rlzs})
+        with self.monitor('saving gmfs', autoflush=True):
+            self.datastore.flush_buffers()
+            if 'gmf_data' in self.datastore:
+                for key in self.datastore['gmf_data']:
+                    save_eid_index(self.datastore, key)
         save_gmdata(self, len(rlzs))
         return acc
 
@@ -18,7 +18,6 @@
 from __future__ import division
 import logging
 import operator
-import itertools
 import collections
 import numpy
 
@@ -72,60 +71,67 @@ def _aggregate(outputs, compositemodel, taxid, agg, idx, result, param):
     L = len(compositemodel.lti)
     I = param['insured_losses'] + 1
     losses_by_taxon = result['losses_by_taxon']
-    ass = result['assratios']
+    ass = []  # list of arrays (aid, rlzi, eid, li, ratio)
     for outs in outputs:
         r = outs.r
         aggr = agg[r]  # array of zeros of shape (E, L, I)
+        aids = numpy.array([asset.ordinal for asset in outs.assets])
+        tids = numpy.array([taxid[asset.taxonomy] for asset in outs.assets])
         for l, out in enumerate(outs):
             if out is None:  # for GMFs below the minimum_intensity
                 continue
-            loss_ratios, eids = out
+            loss_ratios, eids = out  # shape (A, E, I), E
             loss_type = compositemodel.loss_types[l]
-            indices = numpy.array([idx[eid] for eid in eids])
-            for aid, asset in enumerate(outs.assets):
-                ratios = loss_ratios[aid]
-                aid = asset.ordinal
-                losses = ratios * asset.value(loss_type)  # shape (E, I)
-
-                # average losses
-                if param['avg_losses']:
-                    rat = ratios.sum(axis=0) * param['ses_ratio']
-                    for i in range(I):
-                        result['avglosses'][l + L * i, r][aid] += rat[i]
-
-                # agglosses
-                aggr[indices, l] += losses
-
-                # losses by taxonomy
-                t = taxid[asset.taxonomy]
+            indices = idx(eids)
+            values = numpy.array(
+                [asset.value(loss_type) for asset in outs.assets], F32)
+            losses = loss_ratios * values[:, None, None]  # shape (A, E, I)
+
+            # average losses
+            if param['avg_losses']:
+                rat = loss_ratios.sum(axis=1) * param['ses_ratio']
                 for i in range(I):
-                    losses_by_taxon[t, r, l + L * i] += losses[:, i].sum()
+                    result['avglosses'][l + L * i, r][aids] += rat[:, i]
 
-                if param['asset_loss_table']:
-                    for i in range(I):
-                        li = l + L * i
-                        for eid, ratio in zip(eids, ratios[:, i]):
-                            if ratio > 0:
-                                ass.append((aid, r, eid, li, ratio))
+            # agglosses; the sum along the first axis is sequential,
+            # so the losses are accumulated asset by asset
+            aggr[indices, l] = numpy.concatenate(
+                [aggr[indices, l][None], losses]).sum(axis=0)
+
+            # losses by taxonomy
+            sums = losses.transpose(0, 2, 1).copy().sum(axis=2)  # (A, I)
+            for i in range(I):
+                numpy.add.at(losses_by_taxon[:, r, l + L * i], tids,
+                             sums[:, i])
+
+            if param['asset_loss_table']:
+                for i in range(I):
+                    a, e = (loss_ratios[:, :, i] > 0).nonzero()
+                    ass.append((aids[a], numpy.repeat(r, len(a)), eids[e],
+                                numpy.repeat(l + L * i, len(a)),
+                                loss_ratios[a, e, i]))
 
     # when there are asset loss ratios, group them in a composite array
     # of dtype lrs_dt, i.e. (rlzi, ratios)
-    data = sorted(ass)  # sort by aid, r
     lrs_idx = result['lrs_idx']  # shape (A, 2)
-    n = 0
-    all_ratios = []
-    for aid, agroup in itertools.groupby(data, operator.itemgetter(0)):
-        for r, rgroup in itertools.groupby(agroup, operator.itemgetter(1)):
-            for e, egroup in itertools.groupby(
-                    rgroup, operator.itemgetter(2)):
-                ratios = numpy.zeros(L * I, F32)
-                for rec in egroup:
-                    ratios[rec[3]] = rec[4]
-                all_ratios.append((r, ratios))
-        n1 = len(all_ratios)
-        lrs_idx[aid] = [n, n1]
-        n = n1
-    result['assratios'] = numpy.array(all_ratios, param['lrs_dt'])
+    if not ass:
+        result['assratios'] = numpy.zeros(0, param['lrs_dt'])
+        return
+    aid, rlzi, eid, li, ratio = map(numpy.concatenate, zip(*ass))
+    order = numpy.lexsort((ratio, li, eid, rlzi, aid))
+    aid, rlzi, eid, li, ratio = (
+        aid[order], rlzi[order], eid[order], li[order], ratio[order])
+    new = numpy.ones(len(aid), bool)  # start of a new (aid, r, eid) group
+    new[1:] = ((aid[1:] != aid[:-1]) | (rlzi[1:] != rlzi[:-1]) |
+               (eid[1:] != eid[:-1]))
+    group = new.cumsum() - 1
+    all_ratios = numpy.zeros(group[-1] + 1, param['lrs_dt'])
+    all_ratios['rlzi'] = rlzi[new]
+    all_ratios['ratios'][group, li] = ratio
+    uaids, start = numpy.unique(aid[new], return_index=True)
+    lrs_idx[uaids, 0] = start
+    lrs_idx[uaids, 1] = numpy.append(start[1:], len(all_ratios))
+    result['assratios'] = all_ratios
 
 
 def event_based_risk(riskinput, riskmodel, param, monitor):
@@ -153,9 +159,12 @@ def event_based_risk(riskinput, riskmodel, param, monitor):
     R = sum(len(rlzs)
             for gsim, rlzs in riskinput.hazard_getter.rlzs_by_gsim.items())
     param['lrs_dt'] = numpy.dtype([('rlzi', U16), ('ratios', (F32, (L * I,)))])
-    idx = dict(zip(eids, range(E)))
+    sorter = numpy.argsort(eids)
+
+    def idx(some_eids):  # indices of the given event IDs in eids
+        return sorter[numpy.searchsorted(eids, some_eids, sorter=sorter)]
     agg = AccumDict(accum=numpy.zeros((E, L, I), F32))  # r -> array
-    result = dict(agglosses=AccumDict(), assratios=[],
+    result = dict(agglosses=AccumDict(), assratios=None,
                   lrs_idx=numpy.zeros((A, 2), U32),
                   losses_by_taxon=numpy.zeros((T, R, L * I), F32),
                   aids=None)
@@ -252,7 +261,7 @@ class EbrPostCalculator(base.RiskCalculator):
             Starmap.apply(
                 build_loss_maps,
                 (assetcol, builder, lrgetter, rlzs, stats, mon),
-                self.oqparam.concurrent_tasks
+                self.oqparam.concurrent_tasks, dynamic=True
             ).reduce(self.save_loss_maps)
             if self.oqparam.hazard_calculation_id:
                 self.datastore.parent.open()
@@ -729,7 +729,8 @@ def export_gmf_data_csv(ekey, dstore):
         return writer.getsaved()
     else:  # event based
         eid = int(ekey[0].split('/')[1]) if '/' in ekey[0] else None
-        gmfa = GmfDataGetter.gen_gmfs(dstore['gmf_data'], rlzs_assoc, eid)
+        gmfa = GmfDataGetter.gen_gmfs(dstore['gmf_data'], rlzs_assoc, eid,
+                                      dstore.get('gmf_data_idx', None))
         if eid is None:  # new format
             fname = dstore.build_fname('gmf', 'data', 'csv')
             gmfa.sort(order=['rlzi', 'sid', 'eid'])
@@ -60,8 +60,10 @@ class ScenarioCalculator(base.HazardCalculator):
         rupture.eidx2 = len(events)
         self.datastore['sids'] = self.sitecol.sids
         self.datastore['events/grp-00'] = events
-        array, nbytes = calc.RuptureSerializer.get_array_nbytes([rupture])
+        array, points, nbytes = calc.RuptureSerializer.get_array_nbytes(
+            [rupture])
         self.datastore.extend('ruptures/grp-00', array, nbytes=nbytes)
+        self.datastore.extend('rupgeoms/grp-00', points)
         self.computer = GmfComputer(
             rupture, self.sitecol, oq.imtls, self.gsims,
             trunc_level, correl_model)
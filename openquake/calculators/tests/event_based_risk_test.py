@@ -162,9 +162,9 @@ class EventBasedRiskTestCase(CalculatorTestCase):
         grp00 = self.calc.datastore.get_attr('ruptures/grp-00', 'nbytes')
         grp02 = self.calc.datastore.get_attr('ruptures/grp-02', 'nbytes')
         grp03 = self.calc.datastore.get_attr('ruptures/grp-03', 'nbytes')
-        self.assertEqual(grp00, 545)
-        self.assertEqual(grp02, 545)
-        self.assertEqual(grp03, 218)
+        self.assertEqual(grp00, 315)
+        self.assertEqual(grp02, 315)
+        self.assertEqual(grp03, 420)
 
         hc_id = self.calc.datastore.calc_id
         self.run_calc(case_3.__file__, 'job.ini',
@@ -20,18 +20,25 @@ from __future__ import division
 import os
 import re
 import math
+import unittest
 from nose.plugins.attrib import attr
 
 import numpy.testing
 
 from openquake.baselib.general import group_array, writetmp
-from openquake.hazardlib import nrml
+from openquake.hazardlib import nrml, geo, mfd, pmf, scalerel, source
+from openquake.hazardlib.tom import PoissonTOM
+from openquake.hazardlib.sourceconverter import split_source
+from openquake.hazardlib.geo.mesh import surface_to_mesh
 from openquake.hazardlib.sourceconverter import RuptureConverter
 from openquake.commonlib.datastore import read
+from openquake.commonlib.calc import get_ruptures
 from openquake.commonlib.util import max_rel_diff_index
 from openquake.calculators.views import rst_table
 from openquake.calculators.export import export
-from openquake.calculators.event_based import get_mean_curves
+from openquake.calculators.event_based import (
+    get_mean_curves, save_eid_index, sample_ruptures)
+from openquake.risklib.riskinput import GmfDataGetter
 from openquake.calculators.tests import CalculatorTestCase, REFERENCE_OS
 from openquake.qa_tests_data.event_based import (
     blocksize, case_1, case_2, case_3, case_4, case_5, case_6, case_7,
@@ -45,6 +52,15 @@ def strip_calc_id(fname):
     return re.sub('_\d+\.', '.', name)
 
 
+def read_gmvs(fname):
+    # the rows (rlzi, sid, gmv) of an exported gmf-data.csv file, sorted
+    # and without the event IDs, which depend on the task numbers
+    with open(fname) as f:
+        next(f)  # skip the header
+        return sorted((rlzi, sid, gmv) for rlzi, sid, _eid, gmv in
+                      (line.strip().split(',') for line in f))
+
+
 def joint_prob_of_occurrence(gmvs_site_1, gmvs_site_2, gmv, time_span,
                              num_ses, delta_gmv=0.1):
     """
@@ -115,11 +131,15 @@ class EventBasedTestCase(CalculatorTestCase):
         [fname] = out['gmf_data', 'csv']
         self.assertEqualFiles('expected/gmf-data.csv', fname)
 
-        # here the <AreaSource 1> is heavy and split
+        # here the <AreaSource 1> is heavy and split; the ground motion
+        # values are the same, but the event IDs are not, since they
+        # contain the number of the task generating the events
         out = self.run_calc(blocksize.__file__, 'job.ini',
                             concurrent_tasks='4', exports='csv')
         [fname] = out['gmf_data', 'csv']
-        self.assertEqualFiles('expected/gmf-data.csv', fname)
+        expected = os.path.join(os.path.dirname(blocksize.__file__),
+                                'expected', 'gmf-data.csv')
+        self.assertEqual(read_gmvs(fname), read_gmvs(expected))
 
     @attr('qa', 'hazard', 'event_based')
     def test_case_1(self):
@@ -143,6 +163,37 @@ class EventBasedTestCase(CalculatorTestCase):
         self.assertEqualFiles(
             'expected/hazard_curve-smltp_b1-gsimltp_b1-PGA.xml', fname)
 
+        # test the indexed access to the GMFs
+        dstore = self.calc.datastore
+        rlzs_by_gsim = dstore['csm_info'].get_rlzs_assoc().get_rlzs_by_gsim(0)
+        getter = GmfDataGetter(dstore['gmf_data'], 0, rlzs_by_gsim,
+                               gmf_idx=dstore['gmf_data_idx'])
+        data = getter.get_gmfdata()
+        for eid in numpy.unique(data['eid'])[:10]:
+            numpy.testing.assert_equal(
+                getter.get_gmfdata(eid=eid), data[data['eid'] == eid])
+        for sid in numpy.unique(data['sid']):
+            numpy.testing.assert_equal(
+                getter.get_gmfdata(sid=sid, rlzi=0),
+                data[(data['sid'] == sid) & (data['rlzi'] == 0)])
+
+        # rebuild the event index in small blocks
+        del dstore['gmf_data_idx/grp-00/rows']
+        del dstore['gmf_data_idx/grp-00/eid']
+        save_eid_index(dstore, 'grp-00', blocksize=7)
+        for eid in numpy.unique(data['eid'])[:10]:
+            numpy.testing.assert_equal(
+                getter.get_gmfdata(eid=eid), data[data['eid'] == eid])
+
+        # test the lazy reconstruction of the stored ruptures
+        ruptures = list(get_ruptures(dstore, 0))
+        self.assertEqual(len(ruptures), len(dstore['ruptures/grp-00']))
+        ebr = ruptures[0]
+        self.assertNotIn('_rupture', vars(ebr))
+        npoints = len(surface_to_mesh(ebr.rupture.surface).flatten())
+        self.assertEqual(npoints, len(ebr.points))
+        self.assertIn('_rupture', vars(ebr))
+
     @attr('qa', 'hazard', 'event_based')
     def test_minimum_intensity(self):
         out = self.run_calc(case_2.__file__, 'job.ini', exports='csv',
@@ -307,3 +358,45 @@ class EventBasedTestCase(CalculatorTestCase):
         self.assertEqual(str(ctx.exception),
                          'The event based calculator is restricted '
                          'to 256 imts, got 900')
+
+
+class SampleRupturesTestCase(unittest.TestCase):
+    def test_split_source(self):
+        # the occurrences of the ruptures do not change when the source
+        # is split, since they depend only on the serials of the ruptures
+        npd = pmf.PMF([(1., geo.NodalPlane(strike=0.0, dip=90.0, rake=0.0))])
+        polygon = geo.Polygon(
+            [geo.Point(-122.5, 37.5), geo.Point(-121.5, 37.5),
+             geo.Point(-121.5, 38.5), geo.Point(-122.5, 38.5)])
+        area = source.AreaSource(
+            source_id='1', name='source A',
+            tectonic_region_type='Active Shallow Crust',
+            mfd=mfd.TruncatedGRMFD(a_val=4, b_val=1, bin_width=0.1,
+                                   min_mag=5, max_mag=6),
+            rupture_mesh_spacing=5,
+            magnitude_scaling_relationship=scalerel.PeerMSR(),
+            rupture_aspect_ratio=1.0,
+            upper_seismogenic_depth=0.0,
+            lower_seismogenic_depth=10.0,
+            nodal_plane_distribution=npd,
+            hypocenter_distribution=pmf.PMF([(1., 5.0)]),
+            polygon=polygon,
+            area_discretization=20,
+            temporal_occurrence_model=PoissonTOM(50.))
+        area.serial = numpy.arange(area.count_ruptures(),
+                                   dtype=numpy.uint32) + 100
+        rup_occs = sample_ruptures(area, 5, 2, 42)
+        self.assertGreater(len(rup_occs), 0)
+        start = 0
+        split_occs = []
+        for split in split_source(area):
+            nr = split.num_ruptures
+            split.serial = area.serial[start:start + nr]
+            start += nr
+            split_occs.extend(sample_ruptures(split, 5, 2, 42))
+        self.assertGreater(len(list(split_source(area))), 1)
+        self.assertEqual([rup.seed for rup, occs in split_occs],
+                         [rup.seed for rup, occs in rup_occs])
+        for (_, occs1), (_, occs2) in zip(split_occs, rup_occs):
+            self.assertEqual(occs1.shape, (2, 5))
+            numpy.testing.assert_equal(occs1, occs2)
@@ -23,6 +23,7 @@ import numpy
 import h5py
 
 from openquake.baselib import hdf5
+from openquake.baselib.hdf5 import read_rows
 from openquake.baselib.python3compat import decode
 from openquake.hazardlib.geo.mesh import (
     surface_to_mesh, point3d, RectangularMesh)
@@ -33,6 +34,7 @@ from openquake.hazardlib import geo, calc, probability_map
 from openquake.commonlib import readinput
 
 TWO16 = 2 ** 16
+TWO32 = 2 ** 32
 MAX_INT = 2 ** 31 - 1  # this is used in the random number generator
 # in this way even on 32 bit machines Python will not have to convert
 # the generated seed into a long integer
@@ -101,14 +103,32 @@ class PmapGetter(object):
         :param pmap_by_grp: dictionary group string -> probability map
         :returns: a list of probability maps, one per realization
         """
-        pmaps = [probability_map.ProbabilityMap(self.num_levels, 1)
-                 for _ in self.weights]
+        R, L = len(self.weights), self.num_levels
+        pmaps = [probability_map.ArrayProbabilityMap(L, 1) for _ in range(R)]
+        if not pmap_by_grp:
+            return pmaps
+        sids = numpy.unique(numpy.concatenate(
+            [pmap.sids for pmap in pmap_by_grp.values()]))
+        # the curves for all realizations are combined on a dense array
+        # of shape (R, S, L); `present` flags the curves already set
+        poes = numpy.zeros((R, len(sids), L))
+        present = numpy.zeros((R, len(sids)), bool)
         for rec in self.assoc_by_grp:
             grp = 'grp-%02d' % rec['grp_id']
             if grp in pmap_by_grp:
-                pmap = pmap_by_grp[grp].extract(rec['gsim_idx'])
+                pmap = pmap_by_grp[grp]
+                idx = numpy.searchsorted(sids, pmap.sids)
+                array = pmap.array[:, :, rec['gsim_idx']]
                 for rlzi in rec['rlzis']:
-                    pmaps[rlzi] |= pmap
+                    new = ~present[rlzi, idx]
+                    old = idx[~new]
+                    poes[rlzi, old] = 1. - (1. - poes[rlzi, old]) * (
+                        1. - array[~new])
+                    poes[rlzi, idx[new]] = array[new]
+                    present[rlzi, idx] = True
+        for rlzi, pmap in enumerate(pmaps):
+            pmap.sids = sids[present[rlzi]]
+            pmap.array = poes[rlzi, present[rlzi], :, None]
         return pmaps
 
     def get(self, sids, rlzi):
@@ -118,7 +138,7 @@ class PmapGetter(object):
         :returns: the hazard curves for the given realization
         """
         pmap_by_grp = self.get_pmap_by_grp(sids)
-        pmap = probability_map.ProbabilityMap(self.num_levels, 1)
+        pmap = probability_map.ArrayProbabilityMap(self.num_levels, 1)
         for rec in self.assoc_by_grp:
             grp = 'grp-%02d' % rec['grp_id']
             if grp in pmap_by_grp:
@@ -138,21 +158,21 @@ class PmapGetter(object):
     def get_pmap_by_grp(self, sids=None):
         """
         :param sids: an array of site IDs
-        :returns: a dictionary of probability maps by source group
+        :returns: a dictionary of ArrayProbabilityMaps by source group
         """
         if self._pmap_by_grp is None:  # populate the cache
             self._pmap_by_grp = {}
+            usids = numpy.unique(sids).astype(numpy.uint32)
             for grp, dset in self.dstore['poes'].items():
-                sid2idx = {sid: i for i, sid in enumerate(dset.attrs['sids'])}
-                L, I = dset.shape[1:]
-                pmap = probability_map.ProbabilityMap(L, I)
-                for sid in sids:
-                    try:
-                        idx = sid2idx[sid]
-                    except KeyError:
-                        continue
-                    else:
-                        pmap[sid] = probability_map.ProbabilityCurve(dset[idx])
+                pmap = probability_map.ArrayProbabilityMap(*dset.shape[1:])
+                # the site IDs in the dataset are ordered
+                dsids = dset.attrs['sids']
+                idxs = numpy.searchsorted(dsids, usids)
+                ok = idxs < len(dsids)
+                ok[ok] = dsids[idxs[ok]] == usids[ok]
+                if ok.any():
+                    pmap.sids = usids[ok]
+                    pmap.array = read_rows(dset, idxs[ok])
                 self._pmap_by_grp[grp] = pmap
                 self.sids = sids  # store the sids used in the cache
                 self.nbytes += pmap.nbytes
@@ -527,14 +547,17 @@ class RuptureData(object):
 class RuptureSerializer(object):
     """
     Serialize event based ruptures on an HDF5 files. Populate the datasets
-    `ruptures` and `sids`.
+    `ruptures`, `rupgeoms` and `sids`. The ruptures are stored in a columnar
+    format with fixed-width records; the points of the rupture meshes are
+    stored in a flat array and each record contains the offset `pidx` of
+    its points, which are sx * sy * sz.
     """
     rupture_dt = numpy.dtype([
         ('serial', U32), ('code', U8), ('sidx', U32),
         ('eidx1', U32), ('eidx2', U32), ('pmfx', I32), ('seed', U32),
         ('mag', F32), ('rake', F32), ('occurrence_rate', F32),
         ('hypo', point3d), ('sx', U16), ('sy', U8), ('sz', U8),
-        ('points', h5py.special_dtype(vlen=point3d)),
+        ('pidx', U32),
         ])
 
     pmfs_dt = numpy.dtype([
@@ -542,31 +565,41 @@ class RuptureSerializer(object):
     ])
 
     @classmethod
-    def get_array_nbytes(cls, ebruptures):
+    def get_array_nbytes(cls, ebruptures, offset=0):
         """
-        Convert a list of EBRuptures into a numpy composite array
+        Convert a list of EBRuptures into a numpy composite array and
+        a flat array of points.
+
+        :param ebruptures: a list of EBRuptures
+        :param offset: the number of points already stored
+        :returns: (rupture array, points array, nbytes)
         """
         lst = []
+        meshes = []
         nbytes = 0
         for ebrupture in ebruptures:
             rup = ebrupture.rupture
             mesh = surface_to_mesh(rup.surface)
             sx, sy, sz = mesh.shape
-            points = mesh.flatten()
             # sanity checks
             assert sx < TWO16, 'Too many multisurfaces: %d' % sx
             assert sy < 256, 'The rupture mesh spacing is too small'
             assert sz < 256, 'The rupture mesh spacing is too small'
+            assert offset + mesh.size < TWO32, 'Too many rupture points'
             hypo = rup.hypocenter.x, rup.hypocenter.y, rup.hypocenter.z
             rate = getattr(rup, 'occurrence_rate', numpy.nan)
             tup = (ebrupture.serial, rup.code, ebrupture.sidx,
                    ebrupture.eidx1, ebrupture.eidx2,
                    getattr(ebrupture, 'pmfx', -1),
                    rup.seed, rup.mag, rup.rake, rate, hypo,
-                   sx, sy, sz, points)
+                   sx, sy, sz, offset)
             lst.append(tup)
+            meshes.append(mesh.flatten())
+            offset += mesh.size
             nbytes += cls.rupture_dt.itemsize + mesh.nbytes
-        return numpy.array(lst, cls.rupture_dt), nbytes
+        points = (numpy.concatenate(meshes) if meshes
+                  else numpy.zeros(0, point3d))
+        return numpy.array(lst, cls.rupture_dt), points, nbytes
 
     def __init__(self, datastore):
         self.datastore = datastore
@@ -604,8 +637,13 @@ class RuptureSerializer(object):
                 pmfbytes += self.pmfs_dt.itemsize + rup.pmf.nbytes
 
         # store the ruptures in a compact format
-        array, nbytes = self.get_array_nbytes(ebruptures)
-        key = 'ruptures/grp-%02d' % ebr.grp_id
+        grp = 'grp-%02d' % ebr.grp_id
+        try:
+            offset = len(self.datastore.getitem('rupgeoms/' + grp))
+        except KeyError:  # not created yet
+            offset = 0
+        array, points, nbytes = self.get_array_nbytes(ebruptures, offset)
+        key = 'ruptures/' + grp
         try:
             dset = self.datastore.getitem(key)
         except KeyError:  # not created yet
@@ -613,6 +651,7 @@ class RuptureSerializer(object):
         else:
             previous = dset.attrs['nbytes']
         self.datastore.extend(key, array, nbytes=previous + nbytes)
+        self.datastore.extend('rupgeoms/' + grp, points)
 
         # save nbytes occupied by the PMFs
         if pmfbytes:
@@ -638,53 +677,130 @@ class RuptureSerializer(object):
         del self.data[:]
 
 
+def build_rupture(rec, points, trt, mesh_spacing, pmf=None):
+    """
+    Build a hazardlib rupture from its stored representation.
+
+    :param rec: a record of dtype RuptureSerializer.rupture_dt
+    :param points: the flat array of the points of the rupture mesh
+    :param trt: the tectonic region type of the rupture
+    :param mesh_spacing: the mesh spacing of the rupture surface
+    :param pmf: the PMF of a nonparametric rupture or None
+    :returns: a hazardlib rupture instance
+    """
+    mesh = points.reshape(rec['sx'], rec['sy'], rec['sz'])
+    rupture_cls, surface_cls, source_cls = BaseRupture.types[rec['code']]
+    rupture = object.__new__(rupture_cls)
+    rupture.source_typology = source_cls
+    rupture.mag = rec['mag']
+    rupture.rake = rec['rake']
+    rupture.seed = rec['seed']
+    rupture.hypocenter = geo.Point(*rec['hypo'])
+    rupture.occurrence_rate = rec['occurrence_rate']
+    rupture.tectonic_region_type = trt
+    if pmf is not None:
+        rupture.pmf = pmf
+    # the corners come from a valid surface, so the check on the imperfect
+    # rectangle is skipped; this is needed for the UCERF ruptures
+    if surface_cls is geo.PlanarSurface:
+        rupture.surface = geo.PlanarSurface.from_array(
+            mesh_spacing, points, check=False)
+    elif surface_cls.__name__.endswith('MultiSurface'):
+        rupture.surface = object.__new__(surface_cls)
+        rupture.surface.__init__([
+            geo.PlanarSurface.from_array(mesh_spacing, m1.flatten(), False)
+            for m1 in mesh])
+    else:  # fault surface, strike and dip will be computed
+        rupture.surface = object.__new__(surface_cls)
+        rupture.surface.strike = rupture.surface.dip = None
+        m = mesh[0]
+        rupture.surface.mesh = RectangularMesh(
+            m['lon'], m['lat'], m['depth'])
+    # not implemented: rupture_slip_direction
+    return rupture
+
+
+class LazyEBRupture(EBRupture):
+    """
+    An EBRupture read from the datastore. The underlying hazardlib rupture,
+    and in particular its surface, is built only when the attribute
+    `.rupture` is accessed, i.e. typically inside a GmfComputer; before
+    that, the object contains only a record and an array of points and
+    it is cheap to transfer to the workers.
+
+    :param rec: a record of dtype RuptureSerializer.rupture_dt
+    :param points: the flat array of the points of the rupture mesh
+    :param trt: the tectonic region type of the rupture
+    :param mesh_spacing: the mesh spacing of the rupture surface
+    :param pmf: the PMF of a nonparametric rupture or None
+    :param sids: the IDs of the sites affected by the rupture
+    :param events: the events generated by the rupture
+    :param grp_id: the source group ID
+    """
+    def __init__(self, rec, points, trt, mesh_spacing, pmf,
+                 sids, events, grp_id):
+        self.rec = rec
+        self.points = points
+        self.trt = trt
+        self.mesh_spacing = mesh_spacing
+        self.pmf = pmf
+        self.sids = sids
+        self.events = events
+        self.grp_id = grp_id
+        self.serial = rec['serial']
+        self.sidx = rec['sidx']
+        self.eidx1 = rec['eidx1']
+        self.eidx2 = rec['eidx2']
+
+    @property
+    def rupture(self):
+        """
+        The underlying hazardlib rupture, built at the first access
+        """
+        try:
+            return self._rupture
+        except AttributeError:
+            self._rupture = build_rupture(
+                self.rec, self.points, self.trt, self.mesh_spacing, self.pmf)
+            return self._rupture
+
+
 def get_ruptures(dstore, grp_id):
     """
-    Extracts the ruptures of the given grp_id
+    Extracts the ruptures of the given grp_id as LazyEBRupture instances.
+    The rupture records, the points, the events and the site IDs of the
+    group are read with a few calls, not one rupture at the time.
     """
     oq = dstore['oqparam']
     trt = dstore['csm_info'].grp_trt()[grp_id]
     grp = 'grp-%02d' % grp_id
     if grp not in dstore['events']:
         return
-    events = dstore['events/' + grp]
-    for rec in dstore['ruptures/' + grp]:
-        mesh = rec['points'].reshape(rec['sx'], rec['sy'], rec['sz'])
-        rupture_cls, surface_cls, source_cls = BaseRupture.types[rec['code']]
-        rupture = object.__new__(rupture_cls)
-        rupture.surface = object.__new__(surface_cls)
+    events = dstore['events/' + grp].value
+    ruptures = dstore['ruptures/' + grp].value
+    if len(ruptures) == 0:
+        return
+    if 'rupgeoms' not in dstore:  # the points are in the ruptures
+        raise ValueError(
+            'The ruptures in %s are stored in an old format which is not '
+            'supported anymore: please regenerate them' % dstore.hdf5path)
+    points = dstore['rupgeoms/' + grp].value
+    sidxs = numpy.unique(ruptures['sidx'])
+    allsids = read_rows(dstore['sids'], sidxs)
+    pmfs = (dstore['pmfs/' + grp].value if (ruptures['pmfx'] != -1).any()
+            else ())
+    for rec in ruptures:
+        surface_cls = BaseRupture.types[rec['code']][1]
         # MISSING: test with complex_fault_mesh_spacing != rupture_mesh_spacing
         if 'Complex' in surface_cls.__name__:
             mesh_spacing = oq.complex_fault_mesh_spacing
         else:
             mesh_spacing = oq.rupture_mesh_spacing
-        rupture.source_typology = source_cls
-        rupture.mag = rec['mag']
-        rupture.rake = rec['rake']
-        rupture.seed = rec['seed']
-        rupture.hypocenter = geo.Point(*rec['hypo'])
-        rupture.occurrence_rate = rec['occurrence_rate']
-        rupture.tectonic_region_type = trt
+        pidx = rec['pidx']
+        npoints = int(rec['sx']) * int(rec['sy']) * int(rec['sz'])
         pmfx = rec['pmfx']
-        if pmfx != -1:
-            rupture.pmf = dstore['pmfs/' + grp][pmfx]
-        if surface_cls is geo.PlanarSurface:
-            rupture.surface = geo.PlanarSurface.from_array(
-                mesh_spacing, rec['points'])
-        elif surface_cls.__name__.endswith('MultiSurface'):
-            rupture.surface.__init__([
-                geo.PlanarSurface.from_array(mesh_spacing, m1.flatten())
-                for m1 in mesh])
-        else:  # fault surface, strike and dip will be computed
-            rupture.surface.strike = rupture.surface.dip = None
-            m = mesh[0]
-            rupture.surface.mesh = RectangularMesh(
-                m['lon'], m['lat'], m['depth'])
-        sids = dstore['sids'][rec['sidx']]
-        evs = events[rec['eidx1']:rec['eidx2']]
-        ebr = EBRupture(rupture, sids, evs, grp_id, rec['serial'])
-        ebr.eidx1 = rec['eidx1']
-        ebr.eidx2 = rec['eidx2']
-        ebr.sidx = rec['sidx']
-        # not implemented: rupture_slip_direction
-        yield ebr
+        pmf = None if pmfx == -1 else pmfs[pmfx]
+        sids = allsids[numpy.searchsorted(sidxs, rec['sidx'])]
+        yield LazyEBRupture(
+            rec, points[pidx:pidx + npoints], trt, mesh_spacing, pmf,
+            sids, events[rec['eidx1']:rec['eidx2']], grp_id)
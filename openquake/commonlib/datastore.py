@@ -122,6 +122,91 @@ def read(calc_id, mode='r', datadir=DATADIR):
     return dstore
 
 
+class DatasetBuffer(object):
+    """
+    A buffer for an extendable dataset: the arrays are accumulated in memory
+    and written in a single operation when their size exceeds `maxbytes`.
+    The chunks of the dataset are as big as the buffer, up to
+    `chunkbytes`. If the fields `sortby` are given, the rows of each block
+    are sorted by them before writing (the sorting is stable) and the
+    dataset `indexkey` is extended with records (<fields>, start, stop),
+    the row ranges of each combination of values of the fields.
+
+    :param dstore: a DataStore instance
+    :param key: the name of the dataset
+    :param maxbytes: the size of the buffer
+    :param compression: None or 'gzip'
+    :param sortby: a tuple of field names
+    :param indexkey: the name of the index dataset, if sortby is given
+    """
+    chunkbytes = 1024 ** 2
+
+    def __init__(self, dstore, key, maxbytes, compression=None, sortby=(),
+                 indexkey=None):
+        self.dstore = dstore
+        self.key = key
+        self.maxbytes = maxbytes
+        self.compression = compression
+        self.sortby = sortby
+        self.indexkey = indexkey
+        self.arrays = []
+        self.nbytes = 0
+
+    def append(self, array):
+        """
+        Add an array to the buffer, and write the buffer if it is full
+
+        :param array: an array of the same dtype of the dataset
+        """
+        self.arrays.append(array)
+        self.nbytes += array.nbytes
+        if self.nbytes >= self.maxbytes:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the content of the buffer on the dataset and empty it
+        """
+        if not self.arrays:
+            return
+        array = numpy.concatenate(self.arrays)
+        self.arrays = []
+        self.nbytes = 0
+        if self.sortby:  # numpy.lexsort wants the primary key as last
+            array = array[numpy.lexsort(
+                [array[field] for field in reversed(self.sortby)])]
+        h5 = self.dstore.hdf5
+        try:
+            dset = h5[self.key]
+        except KeyError:
+            itemsize = array.dtype.itemsize * int(numpy.prod(array.shape[1:]))
+            nrows = max(min(self.maxbytes, self.chunkbytes) // itemsize, 1)
+            dset = hdf5.create(h5, self.key, array.dtype,
+                               (None,) + array.shape[1:], self.compression,
+                               chunks=(nrows,) + array.shape[1:])
+        start = len(dset)
+        hdf5.extend(dset, array)
+        if self.sortby and self.indexkey:
+            self.dstore.extend(self.indexkey, self._build_index(array, start))
+
+    def _build_index(self, array, start):
+        # the row ranges of the sorted array, shifted by start
+        change = numpy.zeros(len(array) - 1, bool)
+        for field in self.sortby:
+            values = array[field]
+            change |= values[1:] != values[:-1]
+        idxs = numpy.concatenate(
+            [[0], change.nonzero()[0] + 1, [len(array)]])
+        dt = [(field, array.dtype[field]) for field in self.sortby] + [
+            ('start', numpy.uint64), ('stop', numpy.uint64)]
+        index = numpy.zeros(len(idxs) - 1, dt)
+        for field in self.sortby:
+            index[field] = array[field][idxs[:-1]]
+        index['start'] = idxs[:-1] + start
+        index['stop'] = idxs[1:] + start
+        return index
+
+
 class DataStore(collections.MutableMapping):
     """
     DataStore class to store the inputs/outputs of a calculation on the
@@ -167,6 +252,7 @@ class DataStore(collections.MutableMapping):
         if mode == 'r' and not os.path.exists(self.hdf5path):
             raise IOError('File not found: %s' % self.hdf5path)
         self.hdf5 = None
+        self.buffers = {}  # key -> DatasetBuffer
         self.open()
 
     def open(self):
@@ -253,7 +339,7 @@ class DataStore(collections.MutableMapping):
             return default
 
     def create_dset(self, key, dtype, shape=(None,), compression=None,
-                    fillvalue=0, attrs=None):
+                    fillvalue=0, attrs=None, chunks=None):
         """
         Create a one-dimensional HDF5 dataset.
 
@@ -262,10 +348,12 @@ class DataStore(collections.MutableMapping):
         :param shape: shape of the dataset, possibly extendable
         :param compression: the kind of HDF5 compression to use
         :param attrs: dictionary of attributes of the dataset
+        :param chunks: chunk shape of the dataset (default automatic)
         :returns: a HDF5 dataset
         """
         return hdf5.create(
-            self.hdf5, key, dtype, shape, compression, fillvalue, attrs)
+            self.hdf5, key, dtype, shape, compression, fillvalue, attrs,
+            chunks)
 
     def extend(self, key, array, **attrs):
         """
@@ -285,6 +373,31 @@ class DataStore(collections.MutableMapping):
             dset.attrs[k] = v
         return dset
 
+    def buffer(self, key, maxbytes, compression=None, sortby=(),
+               indexkey=None):
+        """
+        Return the :class:`DatasetBuffer` associated to the given key,
+        creating it if needed. The buffers are written when the datastore
+        is closed, or by calling :meth:`flush_buffers`.
+
+        :param key: name of the dataset
+        :param maxbytes: the size of the buffer
+        :param compression: None or 'gzip'
+        :param sortby: fields used to sort and index the rows of each block
+        :param indexkey: name of the index dataset
+        """
+        try:
+            return self.buffers[key]
+        except KeyError:
+            buf = self.buffers[key] = DatasetBuffer(
+                self, key, maxbytes, compression, sortby, indexkey)
+            return buf
+
+    def flush_buffers(self):
+        """Write the content of all the buffers"""
+        for key in sorted(self.buffers):
+            self.buffers[key].flush()
+
     def save(self, key, kw):
         """
         Update the object associated to `key` with the `kw` dictionary;
@@ -348,6 +461,7 @@ class DataStore(collections.MutableMapping):
             self.parent.flush()
             self.parent.close()
         if self.hdf5:  # is open
+            self.flush_buffers()
             self.hdf5.flush()
             self.hdf5.close()
             self.hdf5 = None
@@ -435,7 +549,8 @@ class DataStore(collections.MutableMapping):
                     parent=self.parent,
                     calc_id=self.calc_id,
                     hdf5=None,
-                    hdf5path=self.hdf5path)
+                    hdf5path=self.hdf5path,
+                    buffers={})
 
     def __iter__(self):
         if not self.hdf5:
@@ -20,10 +20,19 @@ Set up some system-wide loggers
 """
 
 import os.path
+import sys
+import time
 import logging
+import threading
+import traceback
+import multiprocessing.util
 from datetime import datetime
 from contextlib import contextmanager
 from multiprocessing.connection import Client
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
 
 from openquake.commonlib import config
 
@@ -46,15 +55,34 @@ def dbcmd(action, *args):
     :param action: database action to perform
     :param args: arguments
     """
+    client = connect()
     try:
-        client = Client(config.DBS_ADDRESS, authkey=config.DBS_AUTHKEY)
-    except:
-        raise RuntimeError('Cannot connect on %s:%s' % config.DBS_ADDRESS)
-    try:
-        client.send((action,) + args)
-        res, etype = client.recv()
+        return send(client, action, *args)
     finally:
         client.close()
+
+
+def connect():
+    """
+    :returns: a connection to the database server
+    """
+    try:
+        return Client(config.DBS_ADDRESS, authkey=config.DBS_AUTHKEY)
+    except:
+        raise RuntimeError('Cannot connect on %s:%s' % config.DBS_ADDRESS)
+
+
+def send(client, action, *args):
+    """
+    Send a command to the database server on an open connection and
+    wait for the result. The connection can be reused for other commands.
+
+    :param client: a connection returned by :func:`connect`
+    :param action: database action to perform
+    :param args: arguments
+    """
+    client.send((action,) + args)
+    res, etype = client.recv()
     if etype:
         raise etype(res)
     return res
@@ -118,17 +146,128 @@ class LogFileHandler(logging.FileHandler):
 
 class LogDatabaseHandler(logging.Handler):
     """
-    Log stream handler
+    Log handler storing the records in the database. The records are
+    queued and sent to the DbServer by a background thread, on a persistent
+    connection, in batches of at most `batch_size` records; a batch is
+    sent as soon as it is full or `flush_interval` seconds after its first
+    record, so that logging never blocks on the database. If a batch
+    cannot be sent, it is retried on a new connection and then record by
+    record with :func:`dbcmd`. The handler works also in forked processes,
+    where a new thread is started. If the records are not stored within
+    `flush_timeout` seconds when flushing, they are dropped.
     """
+    batch_size = 100
+    flush_interval = 1.  # seconds
+    flush_timeout = 10.  # seconds
+
     def __init__(self, job_id):
         super(LogDatabaseHandler, self).__init__()
         self.job_id = job_id
+        self.pid = None
+
+    def _start(self):
+        # start the thread shipping the records, once per process
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._ship)
+        self.thread.daemon = True
+        self.thread.start()
+        # make sure the records are sent when a worker process exits
+        multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+
+    def _ship(self):
+        # collect the records from the queue and send them in batches
+        client = None
+        records = []
+        deadline = None
+        while True:
+            timeout = max(deadline - time.time(), 0) if records else None
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:  # the flush interval has elapsed
+                item = 'timeout'
+            if isinstance(item, tuple):  # a log record
+                if not records:
+                    deadline = time.time() + self.flush_interval
+                records.append(item)
+                if len(records) < self.batch_size:
+                    continue
+            if records:
+                client = self._send(client, records)
+                records = []
+            if isinstance(item, threading.Event):  # flush requested
+                item.set()
+            elif item is None:  # close requested
+                if client is not None:
+                    client.close()
+                return
+
+    def _send(self, client, records):
+        # send a batch of records on the given connection (or on a new one
+        # if the connection is broken) and return the connection to reuse;
+        # if the batch cannot be sent, the records are sent one by one with
+        # dbcmd, so that a single bad record does not lose the others
+        for _ in range(2):
+            try:
+                if client is None:
+                    client = connect()
+                send(client, 'log_batch', self.job_id, records)
+                return client
+            except Exception:
+                if client is not None:
+                    try:
+                        client.close()
+                    except Exception:
+                        pass
+                    client = None
+        for record in records:
+            try:
+                dbcmd('log', self.job_id, *record)
+            except Exception:
+                traceback.print_exc()
+        return client
 
     def emit(self, record):  # pylint: disable=E0202
         if record.levelno >= logging.INFO:
-            dbcmd('log', self.job_id, datetime.utcnow(), record.levelname,
-                  '%s/%s' % (record.processName, record.process),
-                  record.getMessage())
+            if self.pid != os.getpid():
+                self._start()
+            self.queue.put((datetime.utcnow(), record.levelname,
+                            '%s/%s' % (record.processName, record.process),
+                            record.getMessage()))
+
+    def flush(self):
+        """
+        Send the queued records and wait until they are stored
+        """
+        if self.pid != os.getpid():
+            return
+        if self.thread.is_alive():
+            done = threading.Event()
+            self.queue.put(done)
+            if done.wait(self.flush_timeout):
+                return
+        # the thread is dead or blocked, for instance by a DbServer
+        # not answering: drop the queued records instead of hanging
+        dropped = 0
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            dropped += isinstance(item, tuple)
+        if dropped:
+            sys.stderr.write('Could not store %d log record(s) of job %s\n'
+                             % (dropped, self.job_id))
+
+    def close(self):
+        """
+        Send the queued records and stop the background thread
+        """
+        self.flush()
+        if self.pid == os.getpid() and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(self.flush_timeout)
+        super(LogDatabaseHandler, self).close()
 
 
 @contextmanager
@@ -162,3 +301,4 @@ def handle(job_id, log_level='info', log_file=None):
             logging.root.warn('The log file %s is empty!?' % log_file)
         for handler in handlers:
             logging.root.removeHandler(handler)
+            handler.close()
@@ -26,9 +26,9 @@ import operator
 import tempfile
 import collections
 import numpy
-from shapely import wkt, geometry
+from shapely import wkt
 
-from openquake.baselib.general import groupby, AccumDict, writetmp
+from openquake.baselib.general import AccumDict, writetmp, block_splitter
 from openquake.baselib.python3compat import configparser, encode, decode
 from openquake.baselib.node import Node, context
 from openquake.baselib import hdf5
@@ -49,6 +49,9 @@ read_nrml.update_validators()
 NORMALIZATION_FACTOR = 1E-2
 TWO16 = 2 ** 16  # 65,536
 F32 = numpy.float32
+F64 = numpy.float64
+U32 = numpy.uint32
+ASSET_BLOCKSIZE = 10000  # number of asset nodes processed together
 
 
 class DuplicatedPoint(Exception):
@@ -255,22 +258,31 @@ def get_site_collection(oqparam, mesh=None):
                     param.z1pt0, param.z2pt5, param.backarc))
             return site.SiteCollection(sitecol)
         # read the parameters directly from their file
-        site_model_params = geo.utils.GeographicObjects(
-            get_site_model(oqparam))
-        for pt in mesh:
-            # attach the closest site model params to each site
-            param, dist = site_model_params.get_closest(
-                pt.longitude, pt.latitude)
-            if dist >= oqparam.max_site_model_distance:
-                logging.warn('The site parameter associated to %s came from a '
-                             'distance of %d km!' % (pt, dist))
-            sitecol.append(
-                site.Site(pt, param.vs30, param.measured,
-                          param.z1pt0, param.z2pt5, param.backarc))
+        params = list(get_site_model(oqparam))
+        site_model_params = geo.utils.GeographicObjects(params)
+        # attach the closest site model params to each site
+        idxs, dists = site_model_params.get_closest_many(
+            mesh.lons, mesh.lats)
+        depths = (numpy.zeros(len(mesh)) if mesh.depths is None
+                  else mesh.depths)
+        for i in numpy.where(dists >= oqparam.max_site_model_distance)[0]:
+            pt = geo.Point(mesh.lons[i], mesh.lats[i], depths[i])
+            logging.warn('The site parameter associated to %s came from a '
+                         'distance of %d km!' % (pt, dists[i]))
+        sitecol = numpy.zeros(len(mesh), site.SiteCollection.dtype)
+        sitecol['sids'] = numpy.arange(len(mesh))
+        sitecol['lons'] = mesh.lons
+        sitecol['lats'] = mesh.lats
+        sitecol['depths'] = depths
+        for field, name in [('_vs30', 'vs30'), ('_vs30measured', 'measured'),
+                            ('_z1pt0', 'z1pt0'), ('_z2pt5', 'z2pt5'),
+                            ('_backarc', 'backarc')]:
+            values = numpy.array([getattr(param, name) for param in params])
+            sitecol[field] = values[idxs]
         if len(sitecol) == 1 and oqparam.hazard_maps:
             logging.warn('There is a single site, hazard_maps=true '
                          'has little sense')
-        return site.SiteCollection(sitecol)
+        return site.SiteCollection.from_array(sitecol)
 
     # else use the default site params
     return site.SiteCollection.from_points(
@@ -575,9 +587,11 @@ def _get_exposure(fname, ok_cost_types, stop=None):
     :param stop:
         node at which to stop parsing (or None)
     :returns:
-        a pair (Exposure instance, list of asset nodes)
+        a pair (Exposure instance, iterator over the asset nodes)
     """
-    [exposure] = nrml.read(fname, stop=stop)
+    # the metadata are read by stopping the parsing at the assets node;
+    # the asset nodes are then read lazily, without building the tree
+    [exposure] = nrml.read(fname, stop=stop or 'assets')
     if not exposure.tag.endswith('exposureModel'):
         raise InvalidFile('%s: expected exposureModel, got %s' %
                           (fname, exposure.tag))
@@ -630,6 +644,8 @@ def _get_exposure(fname, ok_cost_types, stop=None):
         insurance_limit_is_absolute,
         deductible_is_absolute,
         area.attrib, [], set(), [], cc)
+    if stop is None:
+        return exp, nrml.read_lazy(fname, ['asset'])
     return exp, exposure.assets
 
 
@@ -644,13 +660,17 @@ def get_cost_calculator(oqparam):
 
 def get_exposure(oqparam):
     """
-    Read the full exposure in memory and build a list of
-    :class:`openquake.risklib.riskmodels.Asset` instances.
+    Read the exposure by streaming the asset nodes and build a composite
+    array of assets, without instantiating
+    :class:`openquake.risklib.riskmodels.Asset` objects.
 
     :param oqparam:
         an :class:`openquake.commonlib.oqvalidation.OqParam` instance
     :returns:
-        an :class:`Exposure` instance
+        an :class:`Exposure` instance; its `.assets` attribute is a
+        composite array with fields idx, lon, lat, taxonomy_id, number,
+        area and value-XXX, occupants, deductible-XXX, insurance_limit-XXX,
+        retrofitted-XXX, where XXX is a cost type
     """
     out_of_region = 0
     if oqparam.region_constraint:
@@ -659,103 +679,182 @@ def get_exposure(oqparam):
         region = None
     all_cost_types = set(oqparam.all_cost_types)
     fname = oqparam.inputs['exposure']
-    exposure, assets_node = _get_exposure(fname, all_cost_types)
+    exposure, asset_nodes = _get_exposure(fname, all_cost_types)
     relevant_cost_types = all_cost_types - set(['occupants'])
     asset_refs = set()
     ignore_missing_costs = set(oqparam.ignore_missing_costs)
-
-    for idx, asset in enumerate(assets_node):
-        values = {}
-        deductibles = {}
-        insurance_limits = {}
-        retrofitteds = {}
-        with context(fname, asset):
-            asset_id = asset['id'].encode('utf8')
-            if asset_id in asset_refs:
-                raise read_nrml.DuplicatedID(asset_id)
-            asset_refs.add(asset_id)
-            exposure.asset_refs.append(asset_id)
-            taxonomy = asset['taxonomy']
-            if 'damage' in oqparam.calculation_mode:
-                # calculators of 'damage' kind require the 'number'
-                # if it is missing a KeyError is raised
-                number = asset.attrib['number']
-            else:
-                # some calculators ignore the 'number' attribute;
-                # if it is missing it is considered 1, since we are going
-                # to multiply by it
-                try:
-                    number = asset['number']
-                except KeyError:
-                    number = 1
+    time_event = oqparam.time_event
+    cost_types = sorted(relevant_cost_types)
+    float_fields = ['value-' + ct for ct in cost_types] + ['occupants']
+    if oqparam.insured_losses:
+        float_fields.extend('deductible-' + ct for ct in cost_types)
+        float_fields.extend('insurance_limit-' + ct for ct in cost_types)
+    float_fields.extend('retrofitted-' + ct for ct in cost_types)
+    asset_dt = numpy.dtype(
+        [('idx', U32), ('lon', F64), ('lat', F64), ('taxonomy_id', U32),
+         ('number', F64), ('area', F64)] +
+        [(str(field), F64) for field in float_fields])
+    taxonomy_ids = {}  # taxonomy -> taxonomy ID, in order of appearance
+    the_occupants = 'occupants_%s' % time_event
+    field_orders = {}  # float fields in the order of an asset -> order ID
+    order_ids = []  # one per asset within the region
+    arrays = []
+    for block in block_splitter(enumerate(asset_nodes), ASSET_BLOCKSIZE):
+        # read the locations of the assets in the block
+        records = []  # (idx, asset node, taxonomy, number, explicit number)
+        lons, lats = [], []
+        for idx, asset in block:
+            with context(fname, asset):
+                asset_id = asset['id'].encode('utf8')
+                if asset_id in asset_refs:
+                    raise read_nrml.DuplicatedID(asset_id)
+                asset_refs.add(asset_id)
+                exposure.asset_refs.append(asset_id)
+                taxonomy = asset['taxonomy']
+                if 'damage' in oqparam.calculation_mode:
+                    # calculators of 'damage' kind require the 'number'
+                    # if it is missing a KeyError is raised
+                    number, explicit = asset.attrib['number'], False
                 else:
-                    if 'occupants' in all_cost_types:
-                        values['occupants_None'] = number
-            location = asset.location['lon'], asset.location['lat']
-            if region and not geometry.Point(*location).within(region):
-                out_of_region += 1
+                    # some calculators ignore the 'number' attribute;
+                    # if it is missing it is considered 1, since we are
+                    # going to multiply by it
+                    try:
+                        number, explicit = asset['number'], True
+                    except KeyError:
+                        number, explicit = 1, False
+                lons.append(asset.location['lon'])
+                lats.append(asset.location['lat'])
+            records.append((idx, asset, taxonomy, number, explicit))
+
+        # discard the assets outside the region, all at once
+        if region:
+            within = geo.utils.points_within(region, lons, lats)
+            out_of_region += len(within) - within.sum()
+        else:
+            within = numpy.ones(len(records), bool)
+        array = numpy.zeros(within.sum(), asset_dt)
+        array['lon'] = numpy.array(lons)[within]
+        array['lat'] = numpy.array(lats)[within]
+        for field in float_fields:
+            array[field] = numpy.nan
+
+        # fill the array with the costs and the occupants
+        i = 0
+        for (idx, asset, taxonomy, number, explicit), ok in zip(
+                records, within):
+            if not ok:
                 continue
-        try:
-            costs = asset.costs
-        except AttributeError:
-            costs = Node('costs', [])
-        try:
-            occupancies = asset.occupancies
-        except AttributeError:
-            occupancies = Node('occupancies', [])
-        for cost in costs:
-            with context(fname, cost):
-                cost_type = cost['type']
-                if cost_type in relevant_cost_types:
-                    values[cost_type] = cost['value']
-                    retrovalue = cost.attrib.get('retrofitted')
-                    if retrovalue is not None:
-                        retrofitteds[cost_type] = retrovalue
-                    if oqparam.insured_losses:
-                        deductibles[cost_type] = cost['deductible']
-                        insurance_limits[cost_type] = cost['insuranceLimit']
-
-        # check we are not missing a cost type
-        missing = relevant_cost_types - set(values)
-        if missing and missing <= ignore_missing_costs:
-            logging.warn(
-                'Ignoring asset %s, missing cost type(s): %s',
-                asset_id, ', '.join(missing))
-            for cost_type in missing:
-                values[cost_type] = None
-        elif missing and 'damage' not in oqparam.calculation_mode:
-            # missing the costs is okay for damage calculators
-            with context(fname, asset):
-                raise ValueError("Invalid Exposure. "
-                                 "Missing cost %s for asset %s" % (
-                                     missing, asset_id))
-        tot_occupants = 0
-        for occupancy in occupancies:
-            with context(fname, occupancy):
-                exposure.time_events.add(occupancy['period'])
-                occupants = 'occupants_%s' % occupancy['period']
-                values[occupants] = occupancy['occupants']
-                tot_occupants += values[occupants]
-        if occupancies:  # store average occupants
-            values['occupants_None'] = tot_occupants / len(occupancies)
-        area = float(asset.attrib.get('area', 1))
-        ass = riskmodels.Asset(
-            idx, taxonomy, number, location, values, area,
-            deductibles, insurance_limits, retrofitteds,
-            exposure.cost_calculator)
-        exposure.assets.append(ass)
-        exposure.taxonomies.add(taxonomy)
+            rec = array[i]
+            i += 1
+            rec['idx'] = idx
+            rec['taxonomy_id'] = taxonomy_ids.setdefault(
+                taxonomy, len(taxonomy_ids))
+            rec['number'] = number
+            rec['area'] = float(asset.attrib.get('area', 1))
+            if explicit and 'occupants' in all_cost_types:
+                rec['occupants'] = number
+            try:
+                costs = asset.costs
+            except AttributeError:
+                costs = Node('costs', [])
+            try:
+                occupancies = asset.occupancies
+            except AttributeError:
+                occupancies = Node('occupancies', [])
+            # the values in the order of the asset node, with the
+            # same names as the keys of riskmodels.Asset.values
+            keys = ['occupants_None'] if (
+                explicit and 'occupants' in all_cost_types) else []
+            found = []
+            retrofitted = []
+            for cost in costs:
+                with context(fname, cost):
+                    cost_type = cost['type']
+                    if cost_type in relevant_cost_types:
+                        found.append(cost_type)
+                        rec['value-' + cost_type] = cost['value']
+                        retrovalue = cost.attrib.get('retrofitted')
+                        if retrovalue is not None:
+                            retrofitted.append(cost_type)
+                            rec['retrofitted-' + cost_type] = retrovalue
+                        if oqparam.insured_losses:
+                            rec['deductible-' + cost_type] = cost[
+                                'deductible']
+                            rec['insurance_limit-' + cost_type] = cost[
+                                'insuranceLimit']
+
+            # check we are not missing a cost type
+            keys.extend(found)
+            missing = relevant_cost_types - set(found)
+            if missing and missing <= ignore_missing_costs:
+                logging.warn(
+                    'Ignoring asset %s, missing cost type(s): %s',
+                    exposure.asset_refs[idx], ', '.join(missing))
+                keys.extend(sorted(missing))
+            elif missing and 'damage' not in oqparam.calculation_mode:
+                # missing the costs is okay for damage calculators
+                with context(fname, asset):
+                    raise ValueError("Invalid Exposure. "
+                                     "Missing cost %s for asset %s" % (
+                                         missing, exposure.asset_refs[idx]))
+            tot_occupants = 0
+            for occupancy in occupancies:
+                with context(fname, occupancy):
+                    exposure.time_events.add(occupancy['period'])
+                    keys.append('occupants_%s' % occupancy['period'])
+                    if occupancy['period'] == time_event:
+                        rec['occupants'] = occupancy['occupants']
+                    tot_occupants += occupancy['occupants']
+            if occupancies and time_event is None:  # average occupants
+                rec['occupants'] = tot_occupants / len(occupancies)
+            if occupancies and 'occupants_None' not in keys:
+                keys.append('occupants_None')
+            order = ['occupants' if key == the_occupants else 'value-' + key
+                     for key in keys if not key.startswith('occupants') or
+                     key == the_occupants]
+            if oqparam.insured_losses:
+                order.extend('deductible-' + ct for ct in found)
+                order.extend('insurance_limit-' + ct for ct in found)
+            order.extend('retrofitted-' + ct for ct in retrofitted)
+            order_ids.append(
+                field_orders.setdefault(tuple(order), len(field_orders)))
+        arrays.append(array)
+    array = numpy.concatenate(arrays) if arrays else numpy.zeros(0, asset_dt)
     if region:
         logging.info('Read %d assets within the region_constraint '
                      'and discarded %d assets outside the region',
-                     len(exposure.assets), out_of_region)
-        if len(exposure.assets) == 0:
+                     len(array), out_of_region)
+        if len(array) == 0:
             raise RuntimeError('Could not find any asset within the region!')
 
     # sanity check
-    values = any(len(ass.values) + ass.number for ass in exposure.assets)
-    assert values, 'Could not find any value??'
-    return exposure
+    assert len(array), 'Could not find any value??'
+
+    # discard the float fields which are missing for all assets; the
+    # others are ordered as in the first asset of the first site, which
+    # determined the fields when the assets were riskmodels.Asset objects
+    first = numpy.lexsort((array['idx'], array['lat'], array['lon']))[0]
+    orders = {order_id: order for order, order_id in field_orders.items()}
+    first_order = {field: i for i, field in enumerate(
+        orders[order_ids[first]])}
+    fields = [field for field in asset_dt.names if field not in float_fields
+              or not numpy.isnan(array[field]).all()]
+    fields = [field for i, field in sorted(
+        enumerate(fields), key=lambda pair: (
+            pair[1] in float_fields,
+            first_order.get(pair[1], len(float_fields) + pair[0])))]
+    assets = numpy.zeros(len(array), [(f, asset_dt[f]) for f in fields])
+    for field in fields:
+        assets[field] = array[field]
+
+    # renumber the taxonomies in sorted order
+    taxonomies = sorted(taxonomy_ids)
+    renumber = numpy.zeros(len(taxonomies), U32)
+    for taxonomy, taxonomy_id in taxonomy_ids.items():
+        renumber[taxonomy_id] = taxonomies.index(taxonomy)
+    assets['taxonomy_id'] = renumber[assets['taxonomy_id']]
+    return exposure._replace(assets=assets, taxonomies=taxonomies)
 
 
 Exposure = collections.namedtuple(
@@ -772,16 +871,16 @@ def get_sitecol_assetcol(oqparam, exposure):
     :returns:
         the site collection and the asset collection
     """
-    assets_by_loc = groupby(exposure.assets, key=lambda a: a.location)
-    lons, lats = zip(*sorted(assets_by_loc))
-    mesh = geo.Mesh(numpy.array(lons), numpy.array(lats))
+    array = exposure.assets
+    locations = numpy.zeros(len(array), [('lon', F64), ('lat', F64)])
+    locations['lon'] = array['lon']
+    locations['lat'] = array['lat']
+    # the sites are the distinct asset locations, sorted by lon, lat
+    locations, site_ids = numpy.unique(locations, return_inverse=True)
+    mesh = geo.Mesh(locations['lon'], locations['lat'])
     sitecol = get_site_collection(oqparam, mesh)
-    assets_by_site = []
-    for lonlat in zip(sitecol.lons, sitecol.lats):
-        assets = assets_by_loc[lonlat]
-        assets_by_site.append(sorted(assets, key=operator.attrgetter('idx')))
-    assetcol = riskinput.AssetCollection(
-        assets_by_site, exposure.cost_calculator,
+    assetcol = riskinput.AssetCollection.from_array(
+        array, site_ids, exposure.taxonomies, exposure.cost_calculator,
         oqparam.time_event, time_events=hdf5.array_of_vstr(
             sorted(exposure.time_events)))
     return sitecol, assetcol
@@ -21,20 +21,26 @@ import os
 import re
 import copy
 import math
+import time
+import hashlib
 import logging
 import operator
 import collections
 import random
+try:
+    import fcntl
+except ImportError:  # on Windows
+    fcntl = None
 
 import h5py
 import numpy
 
 from openquake.baselib import hdf5, node
-from openquake.baselib.python3compat import decode
+from openquake.baselib.python3compat import decode, pickle
 from openquake.baselib.general import (
     groupby, group_array, block_splitter, writetmp)
 from openquake.hazardlib import nrml, sourceconverter, InvalidFile
-from openquake.commonlib import logictree
+from openquake.commonlib import logictree, config, datastore
 
 
 MAXWEIGHT = sourceconverter.MAXWEIGHT
@@ -699,7 +705,143 @@ class CompositeSourceModel(collections.Sequence):
         return len(self.source_models)
 
 
+# attributes set by the engine, not affecting the splitting
+ENGINE_ATTRS = ('src_group_id', 'id', 'seed')
+# attributes set when counting and filtering, depending on the sites
+FILTER_ATTRS = ('serial', 'num_ruptures', 'nsites')
+
+
+def get_checksum(src):
+    """
+    :param src: a source object
+    :returns:
+        a checksum of the attributes of the source, excluding the ones
+        set by the engine and by the filtering; the mesh spacing parameters
+        are included
+    """
+    exclude = ENGINE_ATTRS + FILTER_ATTRS
+    items = sorted((k, v) for k, v in vars(src).items() if k not in exclude)
+    pik = pickle.dumps((src.__class__.__name__, items), 2)
+    return hashlib.md5(pik).hexdigest()
+
+
+class SplitCache(object):
+    """
+    A persistent cache of split sources keyed by the checksum of the
+    original source, stored in an HDF5 file. Each entry is a pickled list
+    of pairs (split source, names of the engine attributes inherited from
+    the original source). When the file exceeds `maxbytes` it is rewritten
+    keeping only the most recently used entries. The cache is skipped
+    if the file is locked by another calculation.
+
+    :param path: path to the HDF5 file
+    :param maxbytes: maximum size of the file; 0 disables the cache
+    """
+    def __init__(self, path, maxbytes):
+        self.path = path
+        self.maxbytes = maxbytes
+
+    def _open(self):
+        # returns a pair (lock file, hdf5 file) or None if locked
+        dirname = os.path.dirname(self.path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+        lock = open(self.path + '.lock', 'w')
+        if fcntl:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:  # used by another calculation
+                lock.close()
+                return
+        try:
+            return lock, hdf5.File(self.path, 'a')
+        except (IOError, OSError) as exc:
+            logging.warn('Could not open %s: %s', self.path, exc)
+            lock.close()
+
+    def get(self, src):
+        """
+        :param src: a source to split
+        :returns: the cached list of split sources or None
+        """
+        if not self.maxbytes:
+            return
+        opened = self._open()
+        if opened is None:
+            return
+        lock, h5 = opened
+        try:
+            checksum = get_checksum(src)
+            if checksum not in h5:
+                return
+            dset = h5[checksum]
+            dset.attrs['last_used'] = time.time()
+            splits = []
+            for split, names in pickle.loads(dset.value):
+                for name in names:
+                    setattr(split, name, getattr(src, name))
+                splits.append(split)
+            return splits
+        finally:
+            h5.close()
+            lock.close()
+
+    def set(self, src, splits):
+        """
+        Store the split sources of the given source
+
+        :param src: a source
+        :param splits: the list of split sources generated by it
+        """
+        if not self.maxbytes:
+            return
+        opened = self._open()
+        if opened is None:
+            return
+        pairs = []
+        for split in splits:
+            names = [name for name in ENGINE_ATTRS
+                     if getattr(split, name, None) is getattr(src, name)]
+            split = copy.copy(split)
+            for name in ('serial', 'nsites'):  # set when filtering
+                vars(split).pop(name, None)
+            pairs.append((split, names))
+        lock, h5 = opened
+        try:
+            checksum = get_checksum(src)
+            h5[checksum] = numpy.array(
+                pickle.dumps(pairs, pickle.HIGHEST_PROTOCOL))
+            h5[checksum].attrs['last_used'] = time.time()
+        finally:
+            h5.close()
+        try:
+            if os.path.getsize(self.path) > self.maxbytes:
+                self._evict()
+        finally:
+            lock.close()
+
+    def _evict(self):
+        # rewrite the file with the most recently used entries, up to
+        # half of the maximum size; each entry is a scalar dataset, so
+        # its size in bytes is the size of the stored pickle
+        tmp = self.path + '.tmp'
+        with hdf5.File(self.path, 'r') as h5, hdf5.File(tmp, 'w') as new:
+            keys = sorted(h5, key=lambda k: h5[k].attrs['last_used'],
+                          reverse=True)
+            nbytes = 0
+            for key in keys:
+                nbytes += h5[key].id.get_storage_size()
+                if nbytes > self.maxbytes / 2:
+                    break
+                new[key] = h5[key].value
+                new[key].attrs['last_used'] = h5[key].attrs['last_used']
+        os.rename(tmp, self.path)
+
+
 split_map = {}  # src -> split sources
+split_cache = SplitCache(
+    os.path.join(datastore.DATADIR, 'split_sources.hdf5'),
+    int(config.get('directory', 'split_cache_mb') or 0) * 1024 ** 2)
 
 
 def split_filter_source(src, src_filter):
@@ -714,11 +856,15 @@ def split_filter_source(src, src_filter):
     try:
         splits = split_map[src]  # read from the cache
     except KeyError:  # fill the cache
-        splits = split_map[src] = list(sourceconverter.split_source(src))
-        if len(splits) > 1:
-            logging.info(
-                'Splitting %s "%s" in %d sources', src.__class__.__name__,
-                src.source_id, len(splits))
+        splits = split_cache.get(src)  # read from the persistent cache
+        if splits is None:
+            splits = list(sourceconverter.split_source(src))
+            split_cache.set(src, splits)
+            if len(splits) > 1:
+                logging.info(
+                    'Splitting %s "%s" in %d sources', src.__class__.__name__,
+                    src.source_id, len(splits))
+        split_map[src] = splits
     for split in splits:
         if has_serial:
             nr = split.num_ruptures
@@ -69,6 +69,24 @@ class DataStoreTestCase(unittest.TestCase):
         self.dstore['a/b'] = 42
         self.assertTrue('a/b' in self.dstore)
 
+    def test_buffer(self):
+        dt = numpy.dtype([('rlzi', numpy.uint16), ('sid', numpy.uint32),
+                          ('gmv', numpy.float32)])
+        buf = self.dstore.buffer('data', 40, sortby=('rlzi', 'sid'),
+                                 indexkey='data_idx')
+        buf.append(numpy.array([(1, 0, .1), (0, 1, .2)], dt))
+        self.assertNotIn('data', self.dstore)  # still in the buffer
+        buf.append(numpy.array([(0, 1, .3), (0, 0, .4)], dt))  # 48 bytes
+        numpy.testing.assert_equal(
+            self.dstore['data']['gmv'], numpy.float32([.4, .2, .3, .1]))
+        buf.append(numpy.array([(0, 0, .5)], dt))
+        self.dstore.flush_buffers()
+        self.assertEqual(len(self.dstore['data']), 5)
+        idx = self.dstore['data_idx'].value
+        self.assertEqual([tuple(rec) for rec in idx],
+                         [(0, 0, 0, 1), (0, 1, 1, 3), (1, 0, 3, 4),
+                          (0, 0, 4, 5)])
+
     def test_export_path(self):
         path = self.dstore.export_path('hello.txt', tempfile.mkdtemp())
         mo = re.search('hello_\d+', path)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2017 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import mock
+import logging
+import threading
+import unittest
+
+from openquake.commonlib import logs
+
+
+def make_record(msg, level=logging.INFO):
+    return logging.LogRecord('test', level, __file__, 1, msg, (), None)
+
+
+class LogDatabaseHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sent = []  # pairs (action, args)
+        self.patches = [
+            mock.patch.object(logs, 'connect', mock.Mock),
+            mock.patch.object(logs, 'send', self.send)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def send(self, client, action, *args):
+        self.sent.append((action, args))
+
+    def test_flush_on_close(self):
+        handler = logs.LogDatabaseHandler(42)
+        handler.batch_size = 2
+        for i in range(5):
+            handler.emit(make_record('message %d' % i))
+        handler.emit(make_record('skipped', logging.DEBUG))
+        handler.close()
+        self.assertFalse(handler.thread.is_alive())
+        # two full batches and a batch with the last record
+        self.assertEqual([(action, job_id, len(records))
+                          for action, (job_id, records) in self.sent],
+                         [('log_batch', 42, 2), ('log_batch', 42, 2),
+                          ('log_batch', 42, 1)])
+        messages = [rec[3] for _, (_, records) in self.sent
+                    for rec in records]
+        self.assertEqual(messages, ['message %d' % i for i in range(5)])
+
+    def test_flush_timeout(self):
+        # if the DbServer does not answer the records are dropped
+        # and the handler does not hang
+        unblock = threading.Event()
+        handler = logs.LogDatabaseHandler(42)
+        handler.flush_timeout = .1
+        with mock.patch.object(logs, 'send', lambda *a: unblock.wait()):
+            handler.emit(make_record('message 1'))
+            handler.emit(make_record('message 2'))
+            handler.flush()  # the first batch is blocked
+            handler.emit(make_record('message 3'))
+            with mock.patch('sys.stderr') as stderr:
+                handler.close()
+            unblock.set()
+        stderr.write.assert_called_once_with(
+            'Could not store 1 log record(s) of job 42\n')
@@ -31,7 +31,8 @@ from openquake.hazardlib import valid
 from openquake.risklib.riskinput import ValidationError
 from openquake.commonlib import readinput, writers
 from openquake.qa_tests_data.classical import case_1, case_2
-from openquake.qa_tests_data.event_based_risk import case_caracas
+from openquake.qa_tests_data.event_based_risk import (
+    case_caracas, case_master)
 
 
 TMP = tempfile.gettempdir()
@@ -419,6 +420,45 @@ POLYGON((68.0 31.5, 69.5 31.5, 69.5 25.5, 68.0 25.5, 68.0 31.5))'''
                       "aggregated|per_area|per_asset, line 7",
                       str(ctx.exception))
 
+    def test_exposure_array(self):
+        oqparam = mock.Mock()
+        oqparam.base_path = '/'
+        oqparam.calculation_mode = 'scenario_risk'
+        oqparam.all_cost_types = ['structural']
+        oqparam.insured_losses = False
+        oqparam.inputs = {'exposure': self.exposure}
+        oqparam.region_constraint = '''\
+POLYGON((78.0 31.5, 84.0 31.5, 84.0 25.5, 78.0 25.5, 78.0 31.5))'''
+        oqparam.time_event = None
+        oqparam.ignore_missing_costs = []
+        exp = readinput.get_exposure(oqparam)
+        # the asset a3 is outside the region
+        self.assertEqual(exp.asset_refs, [b'a1', b'a2', b'a3'])
+        self.assertEqual(exp.taxonomies, ['RC', 'RM'])
+        self.assertEqual(exp.assets.dtype.names,
+                         ('idx', 'lon', 'lat', 'taxonomy_id', 'number',
+                          'area', 'value-structural'))
+        assert_allclose(exp.assets['idx'], [0, 1])
+        assert_allclose(exp.assets['taxonomy_id'], [1, 0])
+        assert_allclose(exp.assets['number'], [3000, 1])
+        assert_allclose(exp.assets['value-structural'], [1000, 500])
+
+    def test_assetcol_field_order(self):
+        # the float fields are in the order of the costs of the first
+        # asset, with the occupants first since the number is explicit
+        oqparam = readinput.get_oqparam(
+            os.path.join(os.path.dirname(case_master.__file__), 'job.ini'))
+        exp = readinput.get_exposure(oqparam)
+        _, assetcol = readinput.get_sitecol_assetcol(oqparam, exp)
+        cost_types = ['structural', 'nonstructural', 'contents',
+                      'business_interruption']
+        self.assertEqual(
+            assetcol.array.dtype.names,
+            ('idx', 'lon', 'lat', 'site_id', 'taxonomy_id', 'number', 'area',
+             'occupants') + tuple('value-' + ct for ct in cost_types) +
+            tuple('deductible-' + ct for ct in cost_types) +
+            tuple('insurance_limit-' + ct for ct in cost_types))
+
 
 class ReadCsvTestCase(unittest.TestCase):
     def test_get_mesh_csvdata_ok(self):
@@ -18,6 +18,8 @@
 
 import os
 import mock
+import shutil
+import tempfile
 import unittest
 from io import BytesIO
 
@@ -27,11 +29,13 @@ from numpy.testing import assert_allclose
 from openquake.hazardlib import site, geo, mfd, pmf, scalerel, tests as htests
 from openquake.hazardlib import source, sourceconverter as s
 from openquake.hazardlib.tom import PoissonTOM
-from openquake.hazardlib.calc.filters import context
+from openquake.hazardlib.calc.filters import context, SourceFilter
 from openquake.commonlib import tests, readinput
-from openquake.commonlib.source import CompositionInfo
+from openquake.commonlib.source import (
+    CompositionInfo, SplitCache, get_checksum)
 from openquake.hazardlib import nrml
 from openquake.baselib.general import assert_close
+from openquake.baselib import hdf5
 
 # directory where the example files are
 NRML_DIR = os.path.dirname(htests.__file__)
@@ -647,6 +651,100 @@ class AreaToPointsTestCase(unittest.TestCase):
              6.3627999999999995e-06, 5.292346875e-06])
 
 
+class SplitCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'split_sources.hdf5')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_area(self, source_id):
+        npd = pmf.PMF([(1., geo.NodalPlane(strike=0.0, dip=90.0, rake=0.0))])
+        polygon = geo.Polygon(
+            [geo.Point(-122.5, 37.5), geo.Point(-121.5, 37.5),
+             geo.Point(-121.5, 38.5), geo.Point(-122.5, 38.5)])
+        area = source.AreaSource(
+            source_id=source_id,
+            name="source A",
+            tectonic_region_type="Active Shallow Crust",
+            mfd=mfd.TruncatedGRMFD(a_val=2.1, b_val=4.2, bin_width=0.1,
+                                   min_mag=6.55, max_mag=8.91),
+            rupture_mesh_spacing=1,
+            magnitude_scaling_relationship=scalerel.PeerMSR(),
+            rupture_aspect_ratio=1.0,
+            upper_seismogenic_depth=0.0,
+            lower_seismogenic_depth=10.0,
+            nodal_plane_distribution=npd,
+            hypocenter_distribution=pmf.PMF([(1., 5.0)]),
+            polygon=polygon,
+            area_discretization=10,
+            temporal_occurrence_model=PoissonTOM(50.),
+        )
+        area.src_group_id = 1
+        return area
+
+    def test_get_set(self):
+        cache = SplitCache(self.path, 10 * 1024 ** 2)
+        area = self.make_area('1')
+        self.assertIsNone(cache.get(area))
+        splits = list(s.split_source(area))
+        cache.set(area, splits)
+
+        # the engine attributes are taken from the current source
+        area.src_group_id = 2
+        cached = cache.get(area)
+        self.assertEqual(len(cached), len(splits))
+        self.assertEqual(cached[0].src_group_id, 2)
+        assert_allclose(cached[0].mfd.a_val, splits[0].mfd.a_val)
+
+        # changing the discretization changes the key
+        area.rupture_mesh_spacing = 2
+        self.assertIsNone(cache.get(area))
+
+    def test_different_sites(self):
+        # the same source filtered with different site collections
+        # has the same checksum and hits the same cache entry
+        cache = SplitCache(self.path, 10 * 1024 ** 2)
+        area = self.make_area('1')
+        mod = mock.Mock(
+            reference_vs30_value=760,
+            reference_vs30_type='measured',
+            reference_depth_to_1pt0km_per_sec=100.,
+            reference_depth_to_2pt5km_per_sec=5.0,
+            reference_backarc=False)
+        sites1 = site.SiteCollection.from_points(
+            [-122.0, -122.1], [38.0, 38.1], [0, 1], mod)
+        sites2 = site.SiteCollection.from_points([-122.0], [38.0], [0], mod)
+        SourceFilter(sites1, {'default': 200}).get_close_sites(area)
+        self.assertEqual(area.nsites, 2)
+        checksum = get_checksum(area)
+        cache.set(area, list(s.split_source(area)))
+        SourceFilter(sites2, {'default': 200}).get_close_sites(area)
+        self.assertEqual(area.nsites, 1)
+        self.assertEqual(get_checksum(area), checksum)
+        self.assertIsNotNone(cache.get(area))
+
+    def test_eviction(self):
+        # each entry takes around 20 KB, so the third entry exceeds the
+        # limit and only the most recent one is kept, in half of it
+        maxbytes = 50000
+        cache = SplitCache(self.path, maxbytes)
+        areas = [self.make_area(str(i)) for i in range(4)]
+        for area in areas:
+            cache.set(area, list(s.split_source(area)))
+        self.assertLess(os.path.getsize(self.path), maxbytes)
+        with hdf5.File(self.path, 'r') as h5:
+            keys = set(h5)
+        self.assertEqual(keys, {get_checksum(area) for area in areas[2:]})
+
+    def test_disabled(self):
+        cache = SplitCache(self.path, 0)
+        area = self.make_area('1')
+        cache.set(area, list(s.split_source(area)))
+        self.assertFalse(os.path.exists(self.path))
+
+
 class SourceGroupTestCase(unittest.TestCase):
     SITES = [
         site.Site(geo.Point(-121.0, 37.0), 0.1, True, 3, 4),
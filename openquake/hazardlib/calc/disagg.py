@@ -37,46 +37,52 @@ from openquake.hazardlib.site import SiteCollection
 from openquake.hazardlib.gsim.base import ContextMaker
 
 # a 6-uple containing float 4 arrays mags, dists, lons, lats,
-# 1 int array trts and a list of dictionaries pnes
+# 1 int array trts and a dictionary (rlzi, poe, imt) -> (iml, pnes)
 BinData = collections.namedtuple(
     'BinData', 'mags, dists, lons, lats, trts, pnes')
 
 
-# yield (rlzi, poe, imt), (iml, pne)
-def _disagg(iml, poes, curve_poes, imls, gsim, rupture, rlzi, imt, imt_str,
-            sctx, rctx, dctx, truncation_level, n_epsilons, disagg_poe):
+def _get_imls(iml, poes, curves, sids, rlzi, imt_str, imls):
+    # yield (poe, imls) pairs, with an IML for each site; if the IML is
+    # given by the user, the poe is an array with a value for each site
+    curve_poes = [curves[sid][rlzi, imt_str][::-1] for sid in sids]
     if iml is None:  # compute the IMLs from the given poes
         for poe in poes:
-            iml = numpy.interp(poe, curve_poes, imls)
-            with disagg_poe:
-                [poes_given_rup_eps] = gsim.disaggregate_poe(
-                    sctx, rctx, dctx, imt, iml, truncation_level, n_epsilons)
-            pne = rupture.get_probability_no_exceedance(poes_given_rup_eps)
-            yield (rlzi, poe, imt_str), (iml, pne)
-    else:  # there is a single IML provided by the user; compute the poe
-        poe = numpy.interp(iml, imls, curve_poes)
-        with disagg_poe:
-            [poes_given_rup_eps] = gsim.disaggregate_poe(
-                sctx, rctx, dctx, imt, iml, truncation_level, n_epsilons)
-        pne = rupture.get_probability_no_exceedance(poes_given_rup_eps)
-        yield (rlzi, round(poe, 4), imt_str), (iml, pne)
-
-
-def _collect_bins_data(trt_num, sources, site, curves, src_group_id,
+            yield poe, numpy.array(
+                [numpy.interp(poe, cpoes, imls) for cpoes in curve_poes])
+    else:  # there is a single IML provided by the user; compute the poes
+        yield (numpy.array([round(numpy.interp(iml, imls, cpoes), 4)
+                            for cpoes in curve_poes]),
+               numpy.array([iml] * len(sids), float))
+
+
+def _collect_bins_data(trt_num, sources, sitecol, curves, src_group_id,
                        rlzs_assoc, gsims, imtls, poes, truncation_level,
                        n_epsilons, iml_disagg, mon):
-    # returns a BinData instance
-    sitecol = SiteCollection([site])
+    # returns a dictionary sid -> BinData instance; the ruptures are
+    # generated only once and the contexts are built for all sites together
+    sids = sitecol.sids
     mags = []
-    dists = []
-    lons = []
-    lats = []
+    dists = []  # arrays of N distances
+    lons = []  # arrays of N longitudes
+    lats = []  # arrays of N latitudes
     trts = []
-    pnes = collections.defaultdict(list)
     sitemesh = sitecol.mesh
     make_ctxt = mon('making contexts', measuremem=False)
     disagg_poe = mon('disaggregate_poe', measuremem=False)
     cmaker = ContextMaker(gsims)
+    # (gsim, imt_str, rlzi) -> [(poe(s), imls)]; the IMLs do not depend
+    # on the rupture and are computed only once
+    imls_by_key = {}
+    for gsim in gsims:
+        for imt_str, imls in imtls.items():
+            imls = numpy.array(imls[::-1])
+            iml = iml_disagg.get(imt_str)
+            for rlz in rlzs_assoc[src_group_id, str(gsim)]:
+                imls_by_key[gsim, imt_str, rlz.ordinal] = list(_get_imls(
+                    iml, poes, curves, sids, rlz.ordinal, imt_str, imls))
+    # (gsim, imt_str, rlzi, poe index) -> arrays of shape (N, E)
+    pnes = collections.defaultdict(list)
     for source in sources:
         try:
             tect_reg = trt_num[source.tectonic_region_type]
@@ -89,38 +95,50 @@ def _collect_bins_data(trt_num, sources, site, curves, src_group_id,
                         continue
                 # extract rupture parameters of interest
                 mags.append(rupture.mag)
-                dists.append(dctx.rjb[0])  # single site => single distance
-                [closest_point] = rupture.surface.get_closest_points(sitemesh)
-                lons.append(closest_point.longitude)
-                lats.append(closest_point.latitude)
+                dists.append(dctx.rjb)
+                closest_points = rupture.surface.get_closest_points(sitemesh)
+                lons.append(closest_points.lons)
+                lats.append(closest_points.lats)
                 trts.append(tect_reg)
-                # a dictionary rlz.id, poe, imt_str -> (iml, prob_no_exceed)
-                for gsim in gsims:
-                    gs = str(gsim)
-                    for imt_str, imls in imtls.items():
-                        imt = from_string(imt_str)
-                        imls = numpy.array(imls[::-1])
-                        for rlz in rlzs_assoc[src_group_id, gs]:
-                            rlzi = rlz.ordinal
-                            iml = iml_disagg.get(imt_str)
-                            curve_poes = curves[rlzi, imt_str][::-1]
-                            for k, v in _disagg(
-                                    iml, poes, curve_poes, imls, gsim, rupture,
-                                    rlzi, imt, imt_str, sctx, rctx, dctx,
-                                    truncation_level, n_epsilons, disagg_poe):
-                                pnes[k].append(v)
+                for (gsim, imt_str, rlzi), pairs in imls_by_key.items():
+                    imt = from_string(imt_str)
+                    for p, (poe, iml) in enumerate(pairs):
+                        with disagg_poe:
+                            poes_given_rup_eps = gsim.disaggregate_poe(
+                                sctx, rctx, dctx, imt, iml,
+                                truncation_level, n_epsilons)
+                        pnes[gsim, imt_str, rlzi, p].append(
+                            rupture.get_probability_no_exceedance(
+                                poes_given_rup_eps))
         except Exception as err:
             etype, err, tb = sys.exc_info()
             msg = 'An error occurred with source id=%s. Error: %s'
             msg %= (source.source_id, err)
             raise_(etype, msg, tb)
 
-    return BinData(numpy.array(mags, float),
-                   numpy.array(dists, float),
-                   numpy.array(lons, float),
-                   numpy.array(lats, float),
-                   numpy.array(trts, int),
-                   pnes)
+    if not mags:  # all ruptures are far away
+        return {}
+
+    # scatter the data in per-site bins
+    mags = numpy.array(mags, float)
+    trts = numpy.array(trts, int)
+    shape = (len(mags), len(sids))
+    dists = numpy.array(dists, float).reshape(shape)
+    lons = numpy.array(lons, float).reshape(shape)
+    lats = numpy.array(lats, float).reshape(shape)
+    pnes = {key: numpy.array(arrays) for key, arrays in pnes.items()}
+    bdata = {}
+    for i, sid in enumerate(sids):
+        # a dictionary rlz.id, poe, imt_str -> (iml, probs_no_exceed)
+        pnes_by_key = {}
+        for (gsim, imt_str, rlzi), pairs in imls_by_key.items():
+            for p, (poe, iml) in enumerate(pairs):
+                poe = poe if numpy.isscalar(poe) else poe[i]
+                pnes_by_key[rlzi, poe, imt_str] = (
+                    iml[i], pnes[gsim, imt_str, rlzi, p][:, i])
+        bdata[sid] = BinData(mags, dists[:, i], lons[:, i], lats[:, i],
+                             trts, pnes_by_key)
+    return bdata
 
 
 def disaggregation(
@@ -53,21 +53,16 @@ Module :mod:`openquake.hazardlib.calc.filters` exports one distance-based
 filter function (see :func:`filter_sites_by_distance_to_rupture`) as well as
 a "no operation" filter (`source_site_noop_filter`). There is
 a class `SourceFilter` to determine the sites
-affected by a given source: the second one uses an R-tree index and it is
+affected by a given source: the second one uses a `SiteIndex` and it is
 faster if there are a lot of sources, i.e. if the initial time to prepare
 the index can be compensed. Finally, there is a function
 `filter_sites_by_distance_to_rupture` based on the Joyner-Boore distance.
 """
 import sys
-import logging
 import collections
 from contextlib import contextmanager
 import numpy
 from scipy.interpolate import interp1d
-try:
-    import rtree
-except ImportError:
-    rtree = None
 from openquake.baselib.python3compat import raise_
 from openquake.hazardlib.site import FilteredSiteCollection
 from openquake.hazardlib.geo.utils import fix_lons_idl
@@ -241,22 +236,91 @@ class IntegrationDistance(collections.Mapping):
         return repr(self.dic)
 
 
+class SiteIndex(object):
+    """
+    A pickleable spatial index for points, used to find the points inside
+    a bounding box. The points are grouped in rows of latitude and sorted
+    by longitude inside each row, so that a query requires a binary search
+    for each row intersecting the box. Boxes with longitudes outside
+    the range of the points are also searched shifted by 360 degrees,
+    to manage the International Date Line.
+
+    >>> index = SiteIndex([10., 11., 179.5, 12.], [45., 46., 0., 44.])
+    >>> index.intersection((10.5, 44., 12.5, 46.5))
+    array([1, 3])
+    >>> index.intersection((-181., -1., -180., 1.))
+    array([2])
+
+    :param lons: longitudes of the points
+    :param lats: latitudes of the points
+    :param cellsize: the height of the rows in degrees (default 1)
+    """
+    def __init__(self, lons, lats, cellsize=1.):
+        lons = numpy.array(lons, float)
+        lats = numpy.array(lats, float)
+        self.cellsize = cellsize
+        self.min_lat = lats.min()
+        self.min_lon = lons.min()
+        self.max_lon = lons.max()
+        rows = numpy.floor((lats - self.min_lat) / cellsize).astype(int)
+        self.nrows = rows.max() + 1
+        order = numpy.lexsort((lons, rows))
+        self.idxs = order
+        self.lons = lons[order]
+        self.lats = lats[order]
+        self.start = numpy.searchsorted(rows[order], numpy.arange(
+            self.nrows + 1))
+
+    def _search(self, min_lon, min_lat, max_lon, max_lat):
+        # returns the list of arrays of indices inside the box
+        cs = self.cellsize
+        row1 = max(int((min_lat - self.min_lat) // cs), 0)
+        row2 = min(int((max_lat - self.min_lat) // cs), self.nrows - 1)
+        found = []
+        for row in range(row1, row2 + 1):
+            s, e = self.start[row], self.start[row + 1]
+            lons = self.lons[s:e]
+            i = s + numpy.searchsorted(lons, min_lon)
+            j = s + numpy.searchsorted(lons, max_lon, 'right')
+            if i < j:
+                lats = self.lats[i:j]
+                ok = (lats >= min_lat) & (lats <= max_lat)
+                found.append(self.idxs[i:j][ok])
+        return found
+
+    def intersection(self, box):
+        """
+        :param box: a bounding box (min_lon, min_lat, max_lon, max_lat)
+        :returns: the sorted indices of the points inside the box
+        """
+        min_lon, min_lat, max_lon, max_lat = box
+        found = []
+        for shift in (0, -360, 360):
+            if (min_lon + shift <= self.max_lon and
+                    max_lon + shift >= self.min_lon):
+                found.extend(self._search(min_lon + shift, min_lat,
+                                          max_lon + shift, max_lat))
+        if not found:
+            return numpy.zeros(0, int)
+        return numpy.unique(numpy.concatenate(found))
+
+
 class SourceFilter(object):
     """
-    The SourceFilter uses the rtree library if available. The index is
-    generated at instantiation time and kept in memory. The filter should be
-    instantiated only once per calculation, after the site collection is
-    known. It should be used as follows::
+    The SourceFilter uses a :class:`SiteIndex` to prefilter the sites
+    inside the bounding box of the source, enlarged by the integration
+    distance. The index is generated at instantiation time and kept in
+    memory. The filter should be instantiated only once per calculation,
+    after the site collection is known. It should be used as follows::
 
       ss_filter = SourceFilter(sitecol, integration_distance)
       for src, sites in ss_filter(sources):
          do_something(...)
 
     As a side effect, sets the `.nsites` attribute of the source, i.e. the
-    number of sites within the integration distance. Notice that SourceFilter
-    instances can be pickled, but when unpickled the `use_rtree` flag is set to
-    false and the index is lost: the reason is that libspatialindex indices
-    cannot be properly pickled (https://github.com/Toblerity/rtree/issues/65).
+    number of sites within the integration distance. SourceFilter instances
+    can be pickled together with the index, so that the workers can use
+    the index too.
 
     :param sitecol:
         :class:`openquake.hazardlib.site.SiteCollection` instance (or None)
@@ -264,25 +328,21 @@ class SourceFilter(object):
         Threshold distance in km, this value gets passed straight to
         :meth:`openquake.hazardlib.source.base.BaseSeismicSource.filter_sites_by_distance_to_source`
         which is what is actually used for filtering.
-    :param use_rtree:
-        by default True, i.e. try to use the rtree module if available
+    :param use_index:
+        by default True, i.e. build a :class:`SiteIndex`
     """
-    def __init__(self, sitecol, integration_distance, use_rtree=True):
+    def __init__(self, sitecol, integration_distance, use_index=True):
         self.integration_distance = (
             IntegrationDistance(integration_distance)
             if isinstance(integration_distance, dict)
             else integration_distance)
         self.sitecol = sitecol
-        self.use_rtree = use_rtree and rtree and (
-            integration_distance and sitecol is not None and
-            sitecol.at_sea_level())
-        if self.use_rtree:
+        self.use_index = bool(use_index and integration_distance and
+                              sitecol is not None)
+        self.idl = False
+        if self.use_index:
             fixed_lons, self.idl = fix_lons_idl(sitecol.lons)
-            self.index = rtree.index.Index()
-            for sid, lon, lat in zip(sitecol.sids, fixed_lons, sitecol.lats):
-                self.index.insert(sid, (lon, lat, lon, lat))
-        if rtree is None:
-            logging.info('Using distance filtering [no rtree]')
+            self.index = SiteIndex(fixed_lons, sitecol.lats)
 
     def get_affected_box(self, src):
         """
@@ -301,7 +361,7 @@ class SourceFilter(object):
             elif min_lon > 0 and max_lon > 0:
                 return min_lon, min_lat, max_lon, max_lat
             elif min_lon > 0 and max_lon < 0:
-                return max_lon + 360, min_lat, min_lon, max_lat
+                return min_lon, min_lat, max_lon + 360, max_lat
         else:
             return min_lon, min_lat, max_lon, max_lat
 
@@ -332,19 +392,16 @@ class SourceFilter(object):
         for src in sources:
             if not self.integration_distance:  # do not filter
                 yield src, sites
-            elif self.use_rtree:  # Rtree filtering, used in the controller
-                box = self.get_affected_box(src)
-                sids = numpy.array(sorted(self.index.intersection(box)))
-                if len(set(sids)) < len(sids):
-                    # MS: sanity check against rtree bugs; what happened to me
-                    # is that by following the advice in http://toblerity.org/rtree/performance.html#use-stream-loading
-                    # self.index.intersection(box) started reporting duplicate
-                    # and wrong sids!
-                    raise ValueError('sids=%s' % sids)
-                if len(sids):
-                    src.nsites = len(sids)
-                    yield src, FilteredSiteCollection(sids, sites.complete)
-            else:  # normal filtering, used in the workers
+            elif self.use_index and sites is self.sitecol:  # fast filtering
+                idxs = self.index.intersection(self.get_affected_box(src))
+                if len(idxs) == len(sites):
+                    src.nsites = len(sites)
+                    yield src, sites
+                elif len(idxs):
+                    src.nsites = len(idxs)
+                    yield src, FilteredSiteCollection(
+                        sites.indices[idxs], sites.complete)
+            else:  # normal filtering, used for different site collections
                 maxdist = self.integration_distance(src.tectonic_region_type)
                 with context(src):
                     s_sites = src.filter_sites_by_distance_to_source(
@@ -353,8 +410,4 @@ class SourceFilter(object):
                     src.nsites = len(s_sites)
                     yield src, s_sites
 
-    def __getstate__(self):
-        return dict(integration_distance=self.integration_distance,
-                    sitecol=self.sitecol, use_rtree=False)
-
 source_site_noop_filter = SourceFilter(None, {})
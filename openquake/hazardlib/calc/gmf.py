@@ -180,13 +180,8 @@ class GmfComputer(object):
                 size=(len(self.sites), num_events))
 
             if self.correlation_model is not None:
-                ir = self.correlation_model.apply_correlation(
+                intra_residual = self.correlation_model.apply_correlation(
                     self.sites, imt, intra_residual)
-                # this fixes a mysterious bug: ir[row] is actually
-                # a matrix of shape (E, 1) and not a vector of size E
-                intra_residual = numpy.zeros(ir.shape)
-                for i, val in numpy.ndenumerate(ir):
-                    intra_residual[i] = val
 
             inter_residual = stddev_inter * distribution.rvs(
                 size=num_events)
@@ -61,16 +61,21 @@ import numpy
 
 from openquake.baselib.python3compat import raise_, zip
 from openquake.baselib.performance import Monitor
-from openquake.baselib.general import DictArray, groupby
+from openquake.baselib.general import (
+    DictArray, groupby, block_splitter, deprecated)
 from openquake.baselib.parallel import Sequential
 from openquake.hazardlib.probability_map import ProbabilityMap
 from openquake.hazardlib.gsim.base import ContextMaker
 from openquake.hazardlib.gsim.base import GroundShakingIntensityModel
-from openquake.hazardlib.calc.filters import SourceFilter, FarAwayRupture
+from openquake.hazardlib.calc.filters import SourceFilter
 from openquake.hazardlib.imt import from_string
 from openquake.hazardlib.sourceconverter import SourceGroup
 
 
+# max number of ruptures for which the contexts are built at once
+BLOCKSIZE = 100
+
+
 def zero_curves(num_sites, imtls):
     """
     :param num_sites: the number of sites
@@ -96,6 +101,41 @@ def rupture_weight_pairs(src):
 
 
 # NB: it is important for this to be fast since it is inside an inner loop
+def get_pnes(ruptures, ctxs, block, imtls, gsims, trunclevel, pne_mons):
+    """
+    :param ruptures: a block of ruptures
+    :param ctxs: a list of quartets (rupture index, sctx, rctx, dctx)
+    :param block: the stacked contexts (sctx, rctx, dctx) for ``ctxs``
+    :param imtls: a dictionary-like object providing the intensity levels
+    :param gsims: the list of GSIMs to use
+    :param trunclevel: the truncation level
+    :param pne_mons: monitors for the probability of no exceedance
+    :returns:
+        a list of arrays of shape (num_sites, num_levels, num_gsims),
+        one for each rupture in ``ctxs``
+    """
+    sctx, rctx, dctx = block
+    pnes = []
+    slices = []
+    start = 0
+    for idx, sc, rc, dc in ctxs:
+        stop = start + len(sc.sites)
+        pnes.append(numpy.zeros((stop - start, len(imtls.array), len(gsims))))
+        slices.append(slice(start, stop))
+        start = stop
+    for i, gsim in enumerate(gsims):
+        # count the stacked ruptures, as in the rupture-by-rupture case
+        with pne_mons[i].counting(len(ctxs)):
+            for imt in imtls:
+                poes = gsim.get_poes(
+                    sctx, rctx, dctx, from_string(imt), imtls[imt], trunclevel)
+                for ctx, slc, pne in zip(ctxs, slices, pnes):
+                    pne[:, imtls.slicedic[imt], i] = ruptures[
+                        ctx[0]].get_probability_no_exceedance(poes[slc])
+    return pnes
+
+
+@deprecated('Use get_pnes instead')
 def get_probability_no_exceedance(
         rupture, sctx, rctx, dctx, imtls, gsims, trunclevel, pne_mons):
     """
@@ -109,15 +149,9 @@ def get_probability_no_exceedance(
     :param pne_mons: monitors for the probability of no exceedance
     :returns: an array of shape (num_sites, num_levels, num_gsims)
     """
-    pne_array = numpy.zeros((len(sctx.sites), len(imtls.array), len(gsims)))
-    for i, gsim in enumerate(gsims):
-        with pne_mons[i]:
-            pnos = []  # list of arrays nsites x nlevels
-            for imt in imtls:
-                poes = gsim.get_poes(
-                    sctx, rctx, dctx, from_string(imt), imtls[imt], trunclevel)
-                pnos.append(rupture.get_probability_no_exceedance(poes))
-            pne_array[:, :, i] = numpy.concatenate(pnos, axis=1)
+    [pne_array] = get_pnes([rupture], [(0, sctx, rctx, dctx)],
+                           (sctx, rctx, dctx), imtls, gsims, trunclevel,
+                           pne_mons)
     return pne_array
 
 
@@ -126,39 +160,49 @@ def poe_map(src, s_sites, imtls, cmaker, trunclevel, ctx_mon, pne_mons,
     """
     Compute the ProbabilityMap generated by the given source. Also,
     store some information in the monitors and optionally in the
-    bounding boxes.
+    bounding boxes. The contexts are built for blocks of ruptures, so
+    that the GSIMs are called once per group of ruptures with the same
+    rupture parameters; the ProbabilityMap is updated in the original
+    order of the ruptures, so that the result does not depend on the
+    grouping.
     """
     pmap = ProbabilityMap.build(
         len(imtls.array), len(cmaker.gsims), s_sites.sids, initvalue=rup_indep)
     try:
-        for rup, weight in rupture_weight_pairs(src):
+        for pairs in block_splitter(rupture_weight_pairs(src), BLOCKSIZE):
+            ruptures = [rup for rup, weight in pairs]
             with ctx_mon:  # compute distances
-                try:
-                    sctx, rctx, dctx = cmaker.make_contexts(s_sites, rup)
-                except FarAwayRupture:
-                    continue
-            # compute probabilities and updates the pmap
-            pnes = get_probability_no_exceedance(
-                rup, sctx, rctx, dctx, imtls, cmaker.gsims, trunclevel,
-                pne_mons)
-            for sid, pne in zip(sctx.sites.sids, pnes):
-                if rup_indep:
-                    pmap[sid].array *= pne
-                else:
-                    pmap[sid].array += pne * weight
-            # add optional disaggregation information (bounding boxes)
-            if bbs:
-                with disagg_mon:
-                    sids = set(sctx.sites.sids)
-                    jb_dists = dctx.rjb
-                    closest_points = rup.surface.get_closest_points(
-                        sctx.sites.mesh)
-                    bs = [bb for bb in bbs if bb.site_id in sids]
-                    # NB: the assert below is always true; we are
-                    # protecting against possible refactoring errors
-                    assert len(bs) == len(jb_dists) == len(closest_points)
-                    for bb, dist, p in zip(bs, jb_dists, closest_points):
-                        bb.update([dist], [p.longitude], [p.latitude])
+                blocks = cmaker.make_block_contexts(s_sites, ruptures)
+            # compute probabilities
+            pnes = {}  # rupture index -> (ctx, pne)
+            for ctxs, block in blocks:
+                pnelist = get_pnes(
+                    ruptures, ctxs, block, imtls, cmaker.gsims, trunclevel,
+                    pne_mons)
+                for ctx, pne in zip(ctxs, pnelist):
+                    pnes[ctx[0]] = ctx, pne
+            # update the pmap in the order of the ruptures
+            for idx in sorted(pnes):
+                (_, sctx, rctx, dctx), pne_array = pnes[idx]
+                rup, weight = pairs[idx]
+                for sid, pne in zip(sctx.sites.sids, pne_array):
+                    if rup_indep:
+                        pmap[sid].array *= pne
+                    else:
+                        pmap[sid].array += pne * weight
+                # add optional disaggregation information (bounding boxes)
+                if bbs:
+                    with disagg_mon:
+                        sids = set(sctx.sites.sids)
+                        jb_dists = dctx.rjb
+                        closest_points = rup.surface.get_closest_points(
+                            sctx.sites.mesh)
+                        bs = [bb for bb in bbs if bb.site_id in sids]
+                        # NB: the assert below is always true; we are
+                        # protecting against possible refactoring errors
+                        assert len(bs) == len(jb_dists) == len(closest_points)
+                        for bb, dist, p in zip(bs, jb_dists, closest_points):
+                            bb.update([dist], [p.longitude], [p.latitude])
     except Exception as err:
         etype, err, tb = sys.exc_info()
         msg = '%s (source id=%s)' % (str(err), src.source_id)
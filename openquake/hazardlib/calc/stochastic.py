@@ -18,9 +18,10 @@
 
 """
 :mod:`openquake.hazardlib.calc.stochastic` contains
-:func:`stochastic_event_set`.
+:func:`stochastic_event_set` and :func:`random_numbers`.
 """
 import sys
+import numpy
 from openquake.baselib.python3compat import range
 from openquake.baselib.python3compat import raise_
 from openquake.hazardlib.calc import filters
@@ -82,3 +83,44 @@ def stochastic_event_set(
             msg = 'An error occurred with source id=%s. Error: %s'
             msg %= (source.source_id, str(err))
             raise_(etype, msg, tb)
+
+
+# constants of the SplitMix64 generator
+GOLDEN_GAMMA = numpy.uint64(0x9E3779B97F4A7C15)
+MIX1 = numpy.uint64(0xBF58476D1CE4E5B9)
+MIX2 = numpy.uint64(0x94D049BB133111EB)
+
+
+def _mix64(z):
+    # the SplitMix64 finalizer; the arithmetic is modulo 2 ** 64
+    z = (z ^ (z >> numpy.uint64(30))) * MIX1
+    z = (z ^ (z >> numpy.uint64(27))) * MIX2
+    return z ^ (z >> numpy.uint64(31))
+
+
+def random_numbers(seeds, shape):
+    """
+    Generate a stream of uniform random numbers for each seed with a single
+    vectorized call, by using the counter-based SplitMix64 generator. The
+    numbers of a stream depend only on its seed, so that they do not change
+    when the seeds are generated in different calls or in different order.
+
+    :param seeds: an array of N integer seeds
+    :param shape: the shape of the numbers of each stream
+    :returns: an array of shape (N,) + shape of numbers in the interval (0, 1)
+
+    >>> probs = random_numbers([1, 2], 3)
+    >>> probs.shape
+    (2, 3)
+    >>> bool((probs[1] == random_numbers([2], 3)[0]).all())
+    True
+    """
+    seeds = numpy.asarray(seeds).astype(numpy.uint64)
+    size = int(numpy.prod(shape))
+    counters = numpy.arange(1, size + 1, dtype=numpy.uint64)
+    with numpy.errstate(over='ignore'):
+        states = _mix64(seeds)[:, None] + counters * GOLDEN_GAMMA
+        bits = _mix64(states) >> numpy.uint64(11)  # 53 random bits
+    # add 1/2 to avoid 0, which is not a valid probability
+    probs = (bits + .5) / 2. ** 53
+    return probs.reshape((len(seeds),) + tuple(numpy.atleast_1d(shape)))
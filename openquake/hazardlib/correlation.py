@@ -21,6 +21,7 @@ import abc
 import numpy
 
 from openquake.hazardlib.imt import SA, PGA
+from openquake.hazardlib.site import FilteredSiteCollection
 from openquake.baselib.python3compat import with_metaclass
 
 
@@ -29,6 +30,7 @@ class BaseCorrelationModel(with_metaclass(abc.ABCMeta)):
     Base class for correlation models for spatially-distributed ground-shaking
     intensities.
     """
+    block_size = None  # by default use a single dense correlation matrix
 
     @abc.abstractmethod
     def get_lower_triangle_correlation_matrix(self, sites, imt):
@@ -53,6 +55,45 @@ class BaseCorrelationModel(with_metaclass(abc.ABCMeta)):
             Intensity measure type object, see :mod:`openquake.hazardlib.imt`.
         """
 
+    def get_factors(self, complete, imt):
+        """
+        Return the Cholesky factors of the correlation matrix for the
+        complete site collection, as a list of pairs (indices, matrix).
+        If `.block_size` is None there is a single dense factor; otherwise
+        the sites are split in spatially compact blocks of at most
+        `block_size` sites and the correlation between different blocks
+        is neglected, so that the memory occupation is bounded by
+        `8 * N * block_size` bytes per IMT, N being the number of sites.
+
+        The factors are cached per IMT and recomputed only if the
+        complete site collection changes.
+
+        :param complete:
+            a complete :class:`~openquake.hazardlib.site.SiteCollection`
+        :param imt:
+            Intensity measure type object, see :mod:`openquake.hazardlib.imt`.
+        """
+        if self.cache.get('sitecol') is not complete:
+            self.cache.clear()
+            self.cache['sitecol'] = complete
+        try:
+            return self.cache[imt]
+        except KeyError:
+            pass
+        if self.block_size is None or len(complete) <= self.block_size:
+            blocks = [numpy.arange(len(complete))]
+        else:
+            blocks = split_in_blocks(
+                complete.lons, complete.lats, self.block_size)
+        factors = []
+        for indices in blocks:
+            sites = FilteredSiteCollection(indices, complete)
+            factors.append(
+                (indices, self.get_lower_triangle_correlation_matrix(
+                    sites, imt)))
+        self.cache[imt] = factors
+        return factors
+
     def apply_correlation(self, sites, imt, residuals):
         """
         Apply correlation to randomly sampled residuals.
@@ -70,7 +111,7 @@ class BaseCorrelationModel(with_metaclass(abc.ABCMeta)):
             Array of the same structure and semantics as ``residuals``
             but with correlations applied.
 
-        NB: the correlation matrix is cached. It is computed only once
+        NB: the correlation factors are cached. They are computed only once
         per IMT for the complete site collection and then the portion
         corresponding to the sites is multiplied by the residuals.
         """
@@ -79,20 +120,53 @@ class BaseCorrelationModel(with_metaclass(abc.ABCMeta)):
         # of N random numbers (where N is equal to number of sites).
         # we need to do that multiplication once per realization
         # with the same matrix and different vectors.
-        try:
-            corma = self.cache[imt]
-        except KeyError:
-            corma = self.get_lower_triangle_correlation_matrix(
-                sites.complete, imt)
-            self.cache[imt] = corma
-        if len(sites.complete) == len(sites):
-            return numpy.dot(corma, residuals)
-        # it is important to allocate little memory, this is why I am
-        # accumulating below; if S is the length of the complete sitecollection
-        # the correlation matrix has shape (S, S) and the residuals (N, s),
-        # where s is the number of samples
-        return numpy.sum(corma[sites.sids, sid] * res
-                         for sid, res in zip(sites.sids, residuals))
+        complete = sites.complete
+        sid2row = numpy.zeros(len(complete), int) - 1
+        sid2row[sites.sids] = numpy.arange(len(sites))
+        residuals = numpy.asarray(residuals)
+        corr = numpy.zeros(residuals.shape)
+        for indices, corma in self.get_factors(complete, imt):
+            rows = sid2row[indices]
+            ok = rows >= 0
+            if ok.all():
+                corr[rows] = numpy.dot(corma, residuals[rows])
+            elif ok.any():
+                rows = rows[ok]
+                corr[rows] = numpy.dot(
+                    corma[numpy.ix_(ok, ok)], residuals[rows])
+        return corr
+
+
+def split_in_blocks(lons, lats, block_size):
+    """
+    Split a set of sites in spatially compact blocks by recursive bisection
+    along the widest coordinate, until every block contains at most
+    `block_size` sites.
+
+    :param lons: an array of longitudes
+    :param lats: an array of latitudes
+    :param block_size: the maximum number of sites per block
+    :returns: a list of arrays of indices
+
+    >>> lons = numpy.array([0., 0.1, 5., 5.1, 0.2])
+    >>> lats = numpy.zeros(5)
+    >>> [list(b) for b in split_in_blocks(lons, lats, 3)]
+    [[0, 1], [4, 2, 3]]
+    """
+    blocks = []
+    stack = [numpy.arange(len(lons))]
+    while stack:
+        indices = stack.pop()
+        if len(indices) <= block_size:
+            blocks.append(indices)
+            continue
+        lo, la = lons[indices], lats[indices]
+        coords = lo if lo.ptp() >= la.ptp() else la
+        order = numpy.argsort(coords, kind='mergesort')
+        half = len(indices) // 2
+        stack.append(indices[order[half:]])
+        stack.append(indices[order[:half]])
+    return blocks
 
 
 class JB2009CorrelationModel(BaseCorrelationModel):
@@ -105,10 +179,18 @@ class JB2009CorrelationModel(BaseCorrelationModel):
         Boolean value to indicate whether "Case 1" or "Case 2" from page 1700
         should be applied. ``True`` value means that Vs 30 values show or are
         expected to show clustering ("Case 2"), ``False`` means otherwise.
+    :param block_size:
+        If not None, maximum number of sites in a block; the correlation
+        between sites in different blocks is neglected. This is meant for
+        large site collections, where the dense correlation matrix would
+        not fit in memory, and can be set in the job.ini with
+        ``ground_motion_correlation_params = {'vs30_clustering': False,
+        'block_size': 1000}``.
     """
-    def __init__(self, vs30_clustering):
+    def __init__(self, vs30_clustering, block_size=None):
         self.vs30_clustering = vs30_clustering
-        self.cache = {}  # imt -> correlation model
+        self.block_size = block_size
+        self.cache = {}  # imt -> correlation factors
 
     def _get_correlation_matrix(self, sites, imt):
         """
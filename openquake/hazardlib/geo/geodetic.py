@@ -25,10 +25,6 @@ from __future__ import division
 import operator
 
 import numpy
-try:
-    import rtree
-except ImportError:
-    rtree = None
 
 from openquake.baselib.python3compat import range, round
 
@@ -38,6 +34,10 @@ EARTH_RADIUS = 6371.0
 #: Maximum elevation on Earth in km.
 EARTH_ELEVATION = -8.848
 
+#: Maximum number of (mesh point, site) distances kept in memory at once
+#: by :func:`min_idx_dst`; the sites are processed in blocks to respect it.
+MAX_DISTANCES = 10 ** 7
+
 
 def geodetic_distance(lons1, lats1, lons2, lats2, diameter=2*EARTH_RADIUS):
     """
@@ -252,6 +252,9 @@ def min_idx_dst(mlons, mlats, mdepths, slons, slats, sdepths=0,
         Indices and distances in km of the closest points. The result value is
         a scalar if ``slons``, ``slats`` and ``sdepths`` are scalars and numpy
         array of the same shape of those three otherwise.
+
+    The sites are processed in blocks, so that no more than
+    :data:`MAX_DISTANCES` distances are kept in memory at the same time.
     """
     mlons, mlats, slons, slats = _prepare_coords(mlons, mlats, slons, slats)
     mdepths = numpy.array(mdepths, float)
@@ -263,17 +266,20 @@ def min_idx_dst(mlons, mlats, mdepths, slons, slats, sdepths=0,
 
     mlons = mlons.reshape(-1)
     mlats = mlats.reshape(-1)
-    mdepths = mdepths.reshape(-1)
+    mdepths = mdepths.reshape(-1, 1)
     slons = slons.reshape(-1)
     slats = slats.reshape(-1)
     sdepths = sdepths.reshape(-1)
 
-    dst = pure_distances(mlons, mlats, slons, slats) * diameter
-    delta = numpy.array([[mdepth - sdepth for sdepth in sdepths]
-                         for mdepth in mdepths])
-    dist_squares = dst ** 2 + delta ** 2
-    min_idx = dist_squares.argmin(axis=0)  # (m, s) -> s
-    min_dst = numpy.sqrt(dist_squares.min(axis=0))  # (m, s) -> s
+    min_idx = numpy.zeros(len(slons), int)
+    min_dst = numpy.zeros(len(slons))
+    blocksize = max(MAX_DISTANCES // len(mlons), 1)
+    for start in range(0, len(slons), blocksize):
+        block = slice(start, start + blocksize)
+        dst = pure_distances(mlons, mlats, slons[block], slats[block])
+        dist_squares = (dst * diameter) ** 2 + (mdepths - sdepths[block]) ** 2
+        min_idx[block] = dist_squares.argmin(axis=0)  # (m, s) -> s
+        min_dst[block] = numpy.sqrt(dist_squares.min(axis=0))  # (m, s) -> s
     return _reshape(min_idx, orig_shape), _reshape(min_dst, orig_shape)
 
 
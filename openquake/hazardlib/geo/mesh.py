@@ -431,7 +431,11 @@ class RectangularMesh(Mesh):
         # get the highest slice from the 3D mesh
         distances = geodetic.min_geodetic_distance(
             self.lons, self.lats, mesh.lons, mesh.lats)
-        # here we find the points for which calculated mesh-to-mesh
+        return self._get_jb_distance(mesh, distances)
+
+    def _get_jb_distance(self, mesh, distances):
+        # correct the minimum geodetic distances for the points close to
+        # the mesh; here we find the points for which calculated mesh-to-mesh
         # distance is below a threshold. this threshold is arbitrary:
         # lower values increase the maximum possible error, higher
         # values reduce the efficiency of that filtering. the maximum
@@ -100,6 +100,161 @@ def downsample_trace(mesh, tol=1.0):
         return numpy.column_stack([mesh.lons[0, idx], mesh.lats[0, idx]])
 
 
+def _sliding_min(array, width):
+    """
+    Minima of the windows of the given width along the last axis of
+    the array, computed with a number of passes logarithmic in the width.
+
+    >>> _sliding_min(numpy.array([3, 1, 4, 1, 5, 9, 2, 6]), 3)
+    array([1, 1, 1, 1, 2, 2])
+    """
+    span = 1
+    while span * 2 <= width:
+        array = numpy.minimum(array[..., :-span], array[..., span:])
+        span *= 2
+    if span < width:  # combine two overlapping windows of size span
+        shift = width - span
+        array = numpy.minimum(array[..., :-shift], array[..., shift:])
+    return array
+
+
+class FaultDistanceCache(object):
+    """
+    Cache for the distances between the nodes of the mesh of a whole fault
+    and a set of sites. The floating ruptures of a fault source are
+    windows of the whole mesh, so their distances can be derived from
+    the cache with minimum reductions, without recomputing them for each
+    rupture. The node distances use the same formulas of
+    :func:`openquake.hazardlib.geo.geodetic.min_idx_dst` and
+    :func:`openquake.hazardlib.geo.geodetic.min_geodetic_distance`, so the
+    results are identical. If the cached arrays would take more than
+    `maxbytes`, if the sites are not a subset of the sites seen the
+    first time or if the cache has been cleared, the methods return None
+    and the caller must compute the distances in the usual way.
+
+    The cache is meant to be used as a context manager around the
+    iteration on the ruptures, so that the distances are released at the
+    end, even if the ruptures are kept alive. An unpickled cache is empty
+    and cleared.
+
+    :param mesh: the :class:`RectangularMesh` of the whole fault
+    """
+    maxbytes = 64 * 1024 ** 2  # memory budget for each source
+    # bytes stored per pair (site, node): rjb and rrup distances plus
+    # their sliding minima, all 64 bit floats
+    PAIR_BYTES = 4 * 8
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+        self.cleared = False
+        self.sites = None  # the coordinates of the cached sites
+        self.keys = self.sorter = None  # used to search the sites
+        self.nodedist = {}  # kind -> distances of shape (sites, rows, cols)
+        self.minima = {}  # kind -> (width, sliding minima)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, exc, tb):
+        self.clear()
+
+    def clear(self):
+        """
+        Release the cached distances; after that the cache is not used
+        """
+        self.__init__(self.mesh)
+        self.cleared = True
+
+    def __getstate__(self):
+        # the cached distances are not pickled, they can be huge
+        return dict(mesh=self.mesh)
+
+    def __setstate__(self, state):
+        self.mesh = state['mesh']
+        self.clear()
+
+    def _get_rows(self, mesh):
+        # returns the indices of the points of the mesh in the cached sites
+        # (computing the node distances the first time) or None
+        if self.cleared or mesh.lons.ndim != 1:
+            return
+        lons, lats = mesh.lons, mesh.lats
+        depths = (numpy.zeros_like(lons) if mesh.depths is None
+                  else mesh.depths)
+        if self.sites is None:
+            nrows, ncols = self.mesh.shape
+            nbytes = len(lons) * nrows * ncols * self.PAIR_BYTES
+            if nbytes > self.maxbytes:
+                return
+            self.sites = lons, lats, depths
+            self.keys = lons + 1j * lats
+            self.sorter = numpy.argsort(self.keys)
+            self._set_distances(lons, lats, depths)
+            return slice(None)
+        clons, clats, cdepths = self.sites
+        if (len(lons) == len(clons) and (lons == clons).all() and
+                (lats == clats).all() and (depths == cdepths).all()):
+            return slice(None)
+        idxs = numpy.searchsorted(
+            self.keys, lons + 1j * lats, sorter=self.sorter)
+        rows = self.sorter[numpy.minimum(idxs, len(clons) - 1)]
+        if ((clons[rows] == lons).all() and (clats[rows] == lats).all() and
+                (cdepths[rows] == depths).all()):
+            return rows
+
+    def _set_distances(self, lons, lats, depths):
+        mlons, mlats, slons, slats = geodetic._prepare_coords(
+            self.mesh.lons.reshape(-1), self.mesh.lats.reshape(-1),
+            lons, lats)
+        shape = (len(lons),) + self.mesh.shape  # (sites, rows, cols)
+        pure = geodetic.pure_distances(mlons, mlats, slons, slats)
+        delta = (numpy.array(self.mesh.depths, float).reshape(-1, 1) -
+                 numpy.array(depths, float))
+        dist_squares = (pure * geodetic.EARTH_RADIUS * 2) ** 2 + delta ** 2
+        self.nodedist = dict(
+            rjb=numpy.ascontiguousarray(pure.T).reshape(shape),
+            rrup=numpy.ascontiguousarray(dist_squares.T).reshape(shape))
+
+    def _get_min(self, kind, mesh, window):
+        rows = self._get_rows(mesh)
+        if rows is None:
+            return
+        if isinstance(window, slice):  # only the rows are sliced
+            window = (window, slice(None))
+        nrows, ncols = self.mesh.shape
+        row1, row2, _ = window[0].indices(nrows)
+        col1, col2, _ = window[1].indices(ncols)
+        width = col2 - col1
+        try:
+            cached_width, minima = self.minima[kind]
+        except KeyError:
+            cached_width = None
+        if cached_width != width:
+            minima = _sliding_min(self.nodedist[kind], width)
+            self.minima[kind] = width, minima
+        return minima[:, row1:row2, col1].min(axis=1)[rows]
+
+    def get_min_distance(self, mesh, window):
+        """
+        :param mesh: a mesh of sites
+        :param window: the slices of the whole mesh defining a rupture
+        :returns: the array of rrup distances or None
+        """
+        dist_squares = self._get_min('rrup', mesh, window)
+        if dist_squares is not None:
+            return numpy.sqrt(dist_squares)
+
+    def get_min_geodetic_distance(self, mesh, window):
+        """
+        :param mesh: a mesh of sites
+        :param window: the slices of the whole mesh defining a rupture
+        :returns: the array of minimum geodetic distances or None
+        """
+        pure = self._get_min('rjb', mesh, window)
+        if pure is not None:
+            return pure * (geodetic.EARTH_RADIUS * 2)
+
+
 class BaseSurface(with_metaclass(abc.ABCMeta)):
     """
     Base class for a surface in 3D-space.
@@ -270,6 +425,9 @@ class BaseQuadrilateralSurface(with_metaclass(abc.ABCMeta, BaseSurface)):
     :meth:`get_width() <.base.BaseSurface.get_width>`,
     and can override any others just for the sake of performance
     """
+    #: a pair (FaultDistanceCache, window) for the floating ruptures
+    #: of fault sources, where the window is a slice of the whole mesh
+    dcache = None
 
     def __init__(self):
         self.mesh = None
@@ -288,6 +446,11 @@ class BaseQuadrilateralSurface(with_metaclass(abc.ABCMeta, BaseSurface)):
         of knowledge of a specific surface shape and thus perform
         better.
         """
+        if self.dcache is not None:
+            cache, window = self.dcache
+            dist = cache.get_min_distance(mesh, window)
+            if dist is not None:
+                return dist
         return self.get_mesh().get_min_distance(mesh)
 
     def get_closest_points(self, mesh):
@@ -311,6 +474,11 @@ class BaseQuadrilateralSurface(with_metaclass(abc.ABCMeta, BaseSurface)):
         Base class calls surface mesh's method
         :meth:`~openquake.hazardlib.geo.mesh.RectangularMesh.get_joyner_boore_distance`.
         """
+        if self.dcache is not None:
+            cache, window = self.dcache
+            dist = cache.get_min_geodetic_distance(mesh, window)
+            if dist is not None:
+                return self.get_mesh()._get_jb_distance(mesh, dist)
         return self.get_mesh().get_joyner_boore_distance(mesh)
 
     def get_ry0_distance(self, mesh):
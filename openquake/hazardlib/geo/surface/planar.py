@@ -60,6 +60,10 @@ class PlanarSurface(BaseQuadrilateralSurface):
     bottom edges of the polygon must be parallel to earth surface and to each
     other.
 
+    If ``check`` is false, the corners are not checked against the
+    :attr:`IMPERFECT_RECTANGLE_TOLERANCE`; this is meant for surfaces
+    coming from valid sources, for instance stored in a datastore.
+
     See :class:`~openquake.hazardlib.geo.nodalplane.NodalPlane` for more
     detailed definition of ``strike`` and ``dip``. Note that these parameters
     are supposed to match the factual surface geometry (defined by corner
@@ -94,7 +98,7 @@ class PlanarSurface(BaseQuadrilateralSurface):
         return [node]
 
     def __init__(self, mesh_spacing, strike, dip,
-                 top_left, top_right, bottom_right, bottom_left):
+                 top_left, top_right, bottom_right, bottom_left, check=True):
         super(PlanarSurface, self).__init__()
         if not (top_left.depth == top_right.depth and
                 bottom_left.depth == bottom_right.depth):
@@ -137,11 +141,11 @@ class PlanarSurface(BaseQuadrilateralSurface):
         # relative to surface's area
         tolerance = (self.width * self.length *
                      self.IMPERFECT_RECTANGLE_TOLERANCE)
-        if numpy.max(numpy.abs(dists)) > tolerance:
+        if check and numpy.max(numpy.abs(dists)) > tolerance:
             raise ValueError("corner points do not lie on the same plane")
         if length2 < 0:
             raise ValueError("corners are in the wrong order")
-        if abs(length1 - length2) > tolerance:
+        if check and abs(length1 - length2) > tolerance:
             raise ValueError("top and bottom edges have different lengths")
 
     @classmethod
@@ -177,17 +181,18 @@ class PlanarSurface(BaseQuadrilateralSurface):
                    bottom_right, bottom_left)
 
     @classmethod
-    def from_array(cls, mesh_spacing, array):
+    def from_array(cls, mesh_spacing, array, check=True):
         """
         :param mesh_spacing: mesh spacing parameter
         :param array: a composite array with fields (lon, lat, depth)
+        :param check: if False, skip the check on the imperfect rectangle
         :returns: a :class:`PlanarSurface` instance
         """
         tl, tr, bl, br = _corners(array)
         strike = tl.azimuth(tr)
         dip = numpy.degrees(
             numpy.arcsin((bl.depth - tl.depth) / tl.distance(bl)))
-        return cls(mesh_spacing, strike, dip, tl, tr, br, bl)
+        return cls(mesh_spacing, strike, dip, tl, tr, br, bl, check)
 
     def _init_plane(self):
         """
@@ -21,16 +21,13 @@ Module :mod:`openquake.hazardlib.geo.utils` contains functions that are common
 to several geographical primitives and some other low-level spatial operations.
 """
 import operator
-try:
-    import rtree
-except:
-    rtree = None
 import numpy
 import shapely.geometry
+from scipy.spatial import cKDTree
 
 from openquake.hazardlib.geo import geodetic
 from openquake.hazardlib.geo.geodetic import (
-    EARTH_RADIUS, geodetic_distance, min_idx_dst)
+    EARTH_RADIUS, geodetic_distance)
 from openquake.baselib.slots import with_slots
 
 
@@ -38,25 +35,51 @@ class GeographicObjects(object):
     """
     Store a collection of geographic objects, i.e. objects with longitudes
     and latitudes. By default extracts the coordinates from the attributes
-    .lon and .lat, but you can provide your own getters. It is possible
-    to extract the closest object to a given location by calling the
-    method .get_closest(lon, lat).
+    .lon and .lat, but you can provide your own getters. If the objects
+    are a composite array with fields 'lon' and 'lat' the coordinates are
+    extracted directly from it. It is possible to extract the closest
+    object to a given location by calling the method .get_closest(lon, lat)
+    or the closest objects to many locations at once by calling the method
+    .get_closest_many(lons, lats). The search is performed with a KD-tree
+    on the Cartesian coordinates of the objects, since the chord between
+    two points on the sphere is a monotonic function of their geodetic
+    distance.
     """
     def __init__(self, objects, getlon=operator.attrgetter('lon'),
                  getlat=operator.attrgetter('lat')):
-        self.objects = list(objects)
-        lons, lats = [], []
-        for i, obj in enumerate(self.objects):
-            lon, lat = getlon(obj), getlat(obj)
-            lons.append(lon)
-            lats.append(lat)
-        self.lons, self.lats = numpy.array(lons), numpy.array(lats)
-        if rtree:
-            self.index = rtree.index.Index()
-            self.proj = OrthographicProjection.from_lons_lats(lons, lats)
-            xs, ys = self.proj(self.lons, self.lats)
-            for i, (x, y) in enumerate(zip(xs, ys)):
-                self.index.insert(i, (x, y, x, y))
+        if isinstance(objects, numpy.ndarray) and objects.dtype.names:
+            self.objects = objects
+            self.lons, self.lats = objects['lon'], objects['lat']
+        else:
+            self.objects = list(objects)
+            self.lons = numpy.array([getlon(obj) for obj in self.objects])
+            self.lats = numpy.array([getlat(obj) for obj in self.objects])
+        self.kdtree = cKDTree(
+            spherical_to_cartesian(self.lons, self.lats, None).reshape(-1, 3))
+
+    def get_closest_many(self, lons, lats, max_distance=None):
+        """
+        Get the indices of the closest objects to the given longitudes
+        and latitudes and their distances. If the `max_distance` is given,
+        the indices of the locations farther than the maximum distance from
+        all objects are set to -1.
+
+        :param lons: array of longitudes in degrees
+        :param lats: array of latitudes in degrees
+        :param max_distance: distance in km (or None)
+        :returns: an array of indices and an array of distances in km
+        """
+        lons = numpy.array(lons, float).reshape(-1)
+        lats = numpy.array(lats, float).reshape(-1)
+        if len(lons) == 0:
+            return numpy.zeros(0, int), numpy.zeros(0)
+        _, idxs = self.kdtree.query(
+            spherical_to_cartesian(lons, lats, None).reshape(-1, 3))
+        dists = geodetic_distance(
+            lons, lats, self.lons[idxs], self.lats[idxs])
+        if max_distance is not None:
+            idxs[dists > max_distance] = -1
+        return idxs, dists
 
     def get_closest(self, lon, lat, max_distance=None):
         """
@@ -68,15 +91,8 @@ class GeographicObjects(object):
         :param lat: latitude in degrees
         :param max_distance: distance in km (or None)
         """
-        if rtree:
-            x, y = self.proj(lon, lat)
-            idx = list(self.index.nearest((x, y, x, y), 1))[0]
-            min_dist = geodetic_distance(
-                lon, lat, self.lons[idx], self.lats[idx])
-        else:
-            zeros = numpy.zeros_like(self.lons)
-            idx, min_dist = min_idx_dst(self.lons, self.lats, zeros, lon, lat)
-        if max_distance is not None and min_dist > max_distance:
+        [idx], [min_dist] = self.get_closest_many([lon], [lat], max_distance)
+        if idx == -1:
             return None, None
         return self.objects[idx], min_dist
 
@@ -421,17 +437,95 @@ def point_to_polygon_distance(polygon, pxx, pyy):
         Numpy array of distances in units of coordinate system. Points
         that lie inside the polygon have zero distance.
     """
-    pxx = numpy.array(pxx)
-    pyy = numpy.array(pyy)
+    pxx = numpy.array(pxx, float)
+    pyy = numpy.array(pyy, float)
     assert pxx.shape == pyy.shape
     if pxx.ndim == 0:
         pxx = pxx.reshape((1, ))
         pyy = pyy.reshape((1, ))
-    result = numpy.array([
-        polygon.distance(shapely.geometry.Point(pxx.item(i), pyy.item(i)))
-        for i in range(pxx.size)
-    ])
-    return result.reshape(pxx.shape)
+    dists, inside = _distance_inside(
+        polygon, pxx.reshape(-1), pyy.reshape(-1))
+    dists[inside] = 0
+    return dists.reshape(pxx.shape)
+
+
+def points_within(polygon, pxx, pyy):
+    """
+    Find the points which are strictly inside the polygon, i.e. the
+    vectorized version of `shapely.geometry.Point(x, y).within(polygon)`.
+
+    :param polygon:
+        Shapely "Polygon" or "MultiPolygon" geometry object.
+    :param pxx:
+        List or numpy array of abscissae values of the points.
+    :param pyy:
+        Same structure as ``pxx``, but with ordinate values.
+    :returns:
+        A boolean array, True for the points inside the polygon. The points
+        on the boundary are not considered inside, as in shapely.
+    """
+    pxx = numpy.array(pxx, float)
+    pyy = numpy.array(pyy, float)
+    assert pxx.shape == pyy.shape
+    dists, inside = _distance_inside(
+        polygon, pxx.reshape(-1), pyy.reshape(-1))
+    return (inside & (dists > 0)).reshape(pxx.shape)
+
+
+def _distance_inside(polygon, xs, ys):
+    # returns the distances of the points from the boundary of the polygon
+    # and a boolean array which is True for the points inside it
+    inside = numpy.zeros(len(xs), bool)
+    result = numpy.empty(len(xs))
+    result.fill(numpy.inf)
+    # all the points are processed at once, one polygon edge at the time;
+    # the points inside are found with the even-odd rule, which works also
+    # for polygons with holes and for multipolygons
+    for poly in getattr(polygon, 'geoms', [polygon]):
+        for ring in [poly.exterior] + list(poly.interiors):
+            coords = numpy.array(ring.coords)
+            for (x1, y1), (x2, y2) in zip(coords[:-1], coords[1:]):
+                if y1 != y2:
+                    crossing = (y1 > ys) != (y2 > ys)
+                    xint = (x2 - x1) * (ys - y1) / (y2 - y1) + x1
+                    inside ^= crossing & (xs < xint)
+                numpy.minimum(
+                    result, point_to_segment_distance(x1, y1, x2, y2, xs, ys),
+                    out=result)
+    return result, inside
+
+
+def point_to_segment_distance(x1, y1, x2, y2, pxx, pyy):
+    """
+    Calculate the distance between the segment from (x1, y1) to (x2, y2)
+    and each point of the collection on the 2d Cartesian plane, with the
+    same formulas used by GEOS.
+
+    :param x1, y1, x2, y2:
+        The coordinates of the vertices of the segment.
+    :param pxx:
+        Numpy array of abscissae values of points to calculate
+        the distance from.
+    :param pyy:
+        Numpy array of ordinate values, with the same shape of ``pxx``.
+    :returns:
+        Numpy array of distances in units of coordinate system.
+
+    >>> point_to_segment_distance(0, 0, 4, 0, numpy.array([2, -3, 5]),
+    ...                           numpy.array([1, -4, 0]))
+    array([ 1.,  5.,  1.])
+    """
+    dx1, dy1 = pxx - x1, pyy - y1
+    dist1 = numpy.sqrt(dx1 * dx1 + dy1 * dy1)
+    if x1 == x2 and y1 == y2:  # degenerate segment
+        return dist1
+    dx2, dy2 = pxx - x2, pyy - y2
+    dist2 = numpy.sqrt(dx2 * dx2 + dy2 * dy2)
+    len2 = (x2 - x1) * (x2 - x1) + (y2 - y1) * (y2 - y1)
+    r = (dx1 * (x2 - x1) + dy1 * (y2 - y1)) / len2
+    s = ((y1 - pyy) * (x2 - x1) - (x1 - pxx) * (y2 - y1)) / len2
+    return numpy.where(r <= 0, dist1, numpy.where(
+        r >= 1, dist2, numpy.abs(s) * numpy.sqrt(len2)))
 
 
 def cross_idl(lon1, lon2):
@@ -28,6 +28,7 @@ import math
 import warnings
 import functools
 import contextlib
+import collections
 
 import scipy.stats
 from scipy.special import ndtr
@@ -35,7 +36,8 @@ import numpy
 
 from openquake.hazardlib import const
 from openquake.hazardlib import imt as imt_module
-from openquake.hazardlib.calc.filters import IntegrationDistance, get_distances
+from openquake.hazardlib.calc.filters import (
+    IntegrationDistance, FarAwayRupture, get_distances)
 from openquake.baselib.general import DeprecationWarning
 from openquake.baselib.python3compat import with_metaclass
 
@@ -261,6 +263,51 @@ class ContextMaker(object):
         dctx = self.make_distances_context(sites, rupture, {'rjb': distances})
         return (sctx, rctx, dctx)
 
+    def make_block_contexts(self, site_collection, ruptures):
+        """
+        Build the contexts for a block of ruptures at once. The ruptures
+        sharing the same rupture parameters (for instance the ruptures of
+        a point source differing only by the hypocentral depth, when the
+        GSIMs do not require it) are stacked together, so that the GSIMs
+        can be called once per stack and not once per rupture.
+
+        :param site_collection:
+            Instance of :class:`openquake.hazardlib.site.SiteCollection`.
+        :param ruptures:
+            A sequence of ruptures
+        :returns:
+            A list of pairs (ctxs, block) where ``ctxs`` is a list of
+            quartets (rupture index, sctx, rctx, dctx), one per rupture
+            close to the sites, and ``block`` is a triple (sctx, rctx, dctx)
+            with the site parameters and distances of all the ruptures in
+            ``ctxs`` concatenated together
+        """
+        params = sorted(self.REQUIRES_RUPTURE_PARAMETERS)
+        acc = collections.OrderedDict()
+        for i, rupture in enumerate(ruptures):
+            try:
+                sctx, rctx, dctx = self.make_contexts(site_collection, rupture)
+            except FarAwayRupture:
+                continue
+            key = tuple(getattr(rctx, param) for param in params)
+            acc.setdefault(key, []).append((i, sctx, rctx, dctx))
+        return [(ctxs, self._stack(ctxs)) for ctxs in acc.values()]
+
+    def _stack(self, ctxs):
+        # concatenate the site parameters and the distances of contexts
+        # with the same rupture parameters
+        if len(ctxs) == 1:
+            return ctxs[0][1:]
+        sctx = SitesContext()
+        for param in self.REQUIRES_SITES_PARAMETERS:
+            setattr(sctx, param, numpy.concatenate(
+                [getattr(ctx[1], param) for ctx in ctxs]))
+        dctx = DistancesContext()
+        for param in self.REQUIRES_DISTANCES | set(['rjb']):
+            setattr(dctx, param, numpy.concatenate(
+                [getattr(ctx[3], param) for ctx in ctxs]))
+        return sctx, ctxs[0][2], dctx
+
 
 @functools.total_ordering
 class GroundShakingIntensityModel(with_metaclass(MetaGSIM)):
@@ -320,6 +320,19 @@ def read(source, chatty=True, stop=None):
     return nrml
 
 
+def read_lazy(source, lazytags):
+    """
+    Convert a NRML file into an iterator over validated Node objects with
+    the given tags, without keeping the entire tree in memory.
+
+    :param source:
+        a file name or file object open for reading
+    :param lazytags:
+        the tags of the nodes to yield, for instance ['asset']
+    """
+    return ValidatingXmlParser(validators).parse_lazy(source, lazytags)
+
+
 def write(nodes, output=sys.stdout, fmt='%.7E', gml=True, xmlns=None):
     """
     Convert nodes into a NRML file. output must be a file
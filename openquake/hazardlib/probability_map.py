@@ -317,6 +317,214 @@ class ProbabilityMap(dict):
             self[sid] = ProbabilityCurve(prob)
 
 
+class ArrayProbabilityMap(object):
+    """
+    A ProbabilityMap backed by a single array of shape (N, L, I) and by
+    an ordered array of N site IDs. It has the same semantics of
+    :class:`ProbabilityMap` for the operators `|`, `*`, `~` and for the
+    methods `.convert`, `.filter`, `.extract`, but it does not contain
+    per-site objects, so it can be pickled and transferred between
+    processes efficiently. Here is an example of use:
+
+    >>> pmap = ProbabilityMap.build(3, 1, [2, 5], initvalue=.1)
+    >>> apmap = ArrayProbabilityMap.from_pmap(pmap)
+    >>> apmap |= ArrayProbabilityMap.build(3, 1, [1, 2], initvalue=.1)
+    >>> apmap.sids
+    array([1, 2, 5], dtype=uint32)
+    >>> apmap[2]
+    <ProbabilityCurve
+    [[ 0.19]
+     [ 0.19]
+     [ 0.19]]>
+    """
+    @classmethod
+    def build(cls, shape_y, shape_z, sids, initvalue=0.):
+        """
+        :param shape_y: the total number of intensity measure levels
+        :param shape_z: the number of inner levels
+        :param sids: a set of site indices
+        :param initvalue: the initial value of the probability (default 0)
+        :returns: an ArrayProbabilityMap instance
+        """
+        self = cls(shape_y, shape_z)
+        self.sids = numpy.unique(numpy.array(list(sids), numpy.uint32))
+        self.array = numpy.empty((len(self.sids), shape_y, shape_z), F64)
+        self.array.fill(initvalue)
+        return self
+
+    @classmethod
+    def from_pmap(cls, pmap):
+        """
+        :param pmap: a ProbabilityMap (or ArrayProbabilityMap) instance
+        :returns: an ArrayProbabilityMap with the same curves and attributes
+        """
+        if isinstance(pmap, cls):
+            return pmap
+        self = cls(pmap.shape_y, pmap.shape_z)
+        vars(self).update(vars(pmap))  # like calc_times, grp_id, ...
+        self.sids = pmap.sids
+        if len(self.sids):
+            self.array = pmap.array
+        return self
+
+    def __init__(self, shape_y, shape_z=1):
+        self.shape_y = shape_y
+        self.shape_z = shape_z
+        self.sids = numpy.zeros(0, numpy.uint32)
+        self.array = numpy.zeros((0, shape_y, shape_z), F64)
+
+    def _new(self, sids, array):
+        new = self.__class__(self.shape_y, self.shape_z)
+        new.sids = sids
+        new.array = array
+        return new
+
+    def _idx(self, sid):
+        # index of the given site ID; raise a KeyError if missing
+        idx = numpy.searchsorted(self.sids, sid)
+        if idx == len(self.sids) or self.sids[idx] != sid:
+            raise KeyError(sid)
+        return idx
+
+    def __len__(self):
+        return len(self.sids)
+
+    def __iter__(self):
+        return iter(self.sids)
+
+    def __contains__(self, sid):
+        try:
+            self._idx(sid)
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, sid):
+        return ProbabilityCurve(self.array[self._idx(sid)])
+
+    def get(self, sid, default=None):
+        """
+        :returns: the ProbabilityCurve associated to `sid` or `default`
+        """
+        try:
+            return self[sid]
+        except KeyError:
+            return default
+
+    def items(self):
+        """
+        :yields: pairs (sid, ProbabilityCurve), ordered by site ID
+        """
+        for sid, array in zip(self.sids, self.array):
+            yield sid, ProbabilityCurve(array)
+
+    def __bool__(self):
+        return len(self.sids) > 0
+    __nonzero__ = __bool__
+
+    @property
+    def nbytes(self):
+        """The size of the underlying array"""
+        return self.array.nbytes
+
+    def _extend(self, sids, value):
+        # returns the union of the site IDs and the indices of `sids`;
+        # self is extended with curves filled with `value`
+        allsids = numpy.union1d(self.sids, sids).astype(numpy.uint32)
+        if len(allsids) > len(self.sids):
+            array = numpy.empty((len(allsids),) + self.array.shape[1:], F64)
+            array.fill(value)
+            array[numpy.searchsorted(allsids, self.sids)] = self.array
+            self.sids, self.array = allsids, array
+        return numpy.searchsorted(self.sids, sids)
+
+    # used when exporting to HDF5
+    def convert(self, imtls, nsites, idx=0):
+        """
+        Convert a probability map into a composite array of length `nsites`
+        and dtype `imtls.dt`.
+
+        :param imtls:
+            DictArray instance
+        :param nsites:
+            the total number of sites
+        :param idx:
+            index on the z-axis (default 0)
+        """
+        curves = numpy.zeros(nsites, imtls.dt)
+        for imt in curves.dtype.names:
+            curves[imt][self.sids] = self.array[:, imtls.slicedic[imt], idx]
+        return curves
+
+    def filter(self, sids):
+        """
+        Extracs a submap of self for the given sids.
+        """
+        ok = numpy.in1d(self.sids, sids)
+        return self._new(self.sids[ok], self.array[ok])
+
+    def extract(self, inner_idx):
+        """
+        Extracts a component of the underlying array,
+        specified by the index `inner_idx`.
+        """
+        new = self.__class__(self.shape_y, 1)
+        new.sids = self.sids
+        new.array = self.array[:, :, inner_idx:inner_idx + 1]
+        return new
+
+    def __ior__(self, other):
+        other = self.from_pmap(other)
+        if len(other.sids) == 0:
+            return self
+        elif len(self.sids) == 0:
+            self.sids, self.array = other.sids, other.array.copy()
+            return self
+        missing = ~numpy.in1d(other.sids, self.sids)
+        idx = self._extend(other.sids, 0)
+        common = idx[~missing]
+        self.array[common] = 1. - (1. - self.array[common]) * (
+            1. - other.array[~missing])
+        self.array[idx[missing]] = other.array[missing]
+        return self
+
+    def __or__(self, other):
+        new = self._new(self.sids, self.array.copy())
+        new |= other
+        return new
+
+    __ror__ = __or__
+
+    def __mul__(self, other):
+        if isinstance(other, (ProbabilityMap, ArrayProbabilityMap)):
+            other = self.from_pmap(other)
+            new = self._new(self.sids, self.array.copy())
+            idx = new._extend(other.sids, 1.)
+            new.array[idx] *= other.array
+            return new
+        assert 0. <= other <= 1., other  # must be a probability
+        return self._new(self.sids, self.array * other)
+
+    def __invert__(self):
+        ok = (self.array != 1.).reshape(len(self.sids), -1).any(axis=1)
+        # store only nonzero probabilities
+        return self._new(self.sids[ok], 1. - self.array[ok])
+
+    def __toh5__(self):
+        return self.array, dict(sids=self.sids)
+
+    def __fromh5__(self, array, attrs):
+        self.shape_y = array.shape[1]
+        self.shape_z = array.shape[2]
+        self.sids = numpy.array(attrs['sids'], numpy.uint32)
+        self.array = numpy.array(array, F64)
+
+    def __repr__(self):
+        return '<%s N=%d, L=%d, I=%d>' % (
+            self.__class__.__name__, len(self.sids),
+            self.shape_y, self.shape_z)
+
+
 def get_shape(pmaps):
     """
     :param pmaps: a set of homogenous ProbabilityMaps
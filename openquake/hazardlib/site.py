@@ -184,6 +184,21 @@ class SiteCollection(object):
         self._backarc = sitemodel.reference_backarc
         return self
 
+    @classmethod
+    def from_array(cls, array):
+        """
+        Build the site collection from a composite array
+
+        :param array:
+            an array with the same fields as SiteCollection.dtype
+        """
+        self = cls.__new__(cls)
+        self.__fromh5__(array, dict(total_sites=len(array)))
+        self.sids = self.sids.astype(int)  # as in __init__
+        for slot in self._slots_:  # protect the arrays, as in __init__
+            getattr(self, slot).flags.writeable = False
+        return self
+
     def __init__(self, sites):
         self.complete = self
         self.total_sites = n = len(sites)
@@ -22,6 +22,7 @@ import numpy
 from openquake.baselib.python3compat import range
 from openquake.hazardlib.source.base import ParametricSeismicSource
 from openquake.hazardlib.geo.surface.complex_fault import ComplexFaultSurface
+from openquake.hazardlib.geo.surface.base import FaultDistanceCache
 from openquake.hazardlib.geo.nodalplane import NodalPlane
 from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
 from openquake.baselib.slots import with_slots
@@ -107,34 +108,37 @@ class ComplexFaultSource(ParametricSeismicSource):
         cell_center, cell_length, cell_width, cell_area = (
             whole_fault_mesh.get_cell_dimensions()
         )
+        # the distances of the ruptures are derived from the ones
+        # of the whole fault, computed only once; they are released when
+        # the iteration ends, even if the ruptures are still alive
+        with FaultDistanceCache(whole_fault_mesh) as dcache:
+            for (mag, mag_occ_rate) in self.get_annual_occurrence_rates():
+                msr = self.magnitude_scaling_relationship
+                rupture_area = msr.get_median_area(mag, self.rake)
+                rupture_length = numpy.sqrt(
+                    rupture_area * self.rupture_aspect_ratio)
+                rupture_slices = _float_ruptures(
+                    rupture_area, rupture_length, cell_area, cell_length
+                )
+                occurrence_rate = mag_occ_rate / float(len(rupture_slices))
 
-        for (mag, mag_occ_rate) in self.get_annual_occurrence_rates():
-            rupture_area = self.magnitude_scaling_relationship.get_median_area(
-                mag, self.rake
-            )
-            rupture_length = numpy.sqrt(
-                rupture_area * self.rupture_aspect_ratio)
-            rupture_slices = _float_ruptures(
-                rupture_area, rupture_length, cell_area, cell_length
-            )
-            occurrence_rate = mag_occ_rate / float(len(rupture_slices))
-
-            for rupture_slice in rupture_slices[self.start:self.stop]:
-                mesh = whole_fault_mesh[rupture_slice]
-                # XXX: use surface centroid as rupture's hypocenter
-                # XXX: instead of point with middle index
-                hypocenter = mesh.get_middle_point()
+                for rupture_slice in rupture_slices[self.start:self.stop]:
+                    mesh = whole_fault_mesh[rupture_slice]
+                    # XXX: use surface centroid as rupture's hypocenter
+                    # XXX: instead of point with middle index
+                    hypocenter = mesh.get_middle_point()
 
-                try:
-                    surface = ComplexFaultSurface(mesh)
-                except ValueError as e:
-                    raise ValueError("Invalid source with id=%s. %s" % (
-                        self.source_id, str(e)))
-                yield ParametricProbabilisticRupture(
-                    mag, self.rake, self.tectonic_region_type, hypocenter,
-                    surface, type(self),
-                    occurrence_rate, self.temporal_occurrence_model
-                )
+                    try:
+                        surface = ComplexFaultSurface(mesh)
+                    except ValueError as e:
+                        raise ValueError("Invalid source with id=%s. %s" % (
+                            self.source_id, str(e)))
+                    surface.dcache = dcache, rupture_slice
+                    yield ParametricProbabilisticRupture(
+                        mag, self.rake, self.tectonic_region_type, hypocenter,
+                        surface, type(self),
+                        occurrence_rate, self.temporal_occurrence_model
+                    )
 
     def count_ruptures(self):
         """
@@ -157,6 +157,19 @@ class BaseRupture(with_metaclass(abc.ABCMeta)):
         """
         raise NotImplementedError
 
+    def get_number_of_occurrences(self, probs):
+        """
+        Convert uniform random numbers into numbers of occurrences, by
+        inverting the cumulative distribution function of the temporal
+        occurrence model; this is the vectorized counterpart of
+        :meth:`sample_number_of_occurrences` for externally generated
+        random numbers.
+
+        :param probs: an array of numbers in the interval (0, 1)
+        :returns: an array of integers with the same shape as ``probs``
+        """
+        raise NotImplementedError
+
 
 class NonParametricProbabilisticRupture(BaseRupture):
     """
@@ -232,14 +245,19 @@ class NonParametricProbabilisticRupture(BaseRupture):
 
         Uses 'Inverse Transform Sampling' method.
         """
-        # compute cdf from pmf
-        cdf = numpy.cumsum(self.pmf)
-
-        rn = numpy.random.random()
-        [n_occ] = numpy.digitize([rn], cdf)
-
+        [n_occ] = self.get_number_of_occurrences([numpy.random.random()])
         return n_occ
 
+    def get_number_of_occurrences(self, probs):
+        """
+        See :meth:`superclass method
+        <.rupture.BaseRupture.get_number_of_occurrences>`
+        for spec of input and result values.
+        """
+        # compute cdf from pmf; same as numpy.digitize(probs, cdf)
+        cdf = numpy.array(numpy.cumsum(self.pmf), float)
+        return numpy.searchsorted(cdf, probs, 'right')
+
 
 @with_slots
 class ParametricProbabilisticRupture(BaseRupture):
@@ -308,6 +326,19 @@ class ParametricProbabilisticRupture(BaseRupture):
             self.occurrence_rate
         )
 
+    def get_number_of_occurrences(self, probs):
+        """
+        See :meth:`superclass method
+        <.rupture.BaseRupture.get_number_of_occurrences>`
+        for spec of input and result values.
+
+        Uses :meth:
+        `openquake.hazardlib.tom.PoissonTOM.get_number_of_occurrences`
+        of an assigned temporal occurrence model.
+        """
+        return self.temporal_occurrence_model.get_number_of_occurrences(
+            self.occurrence_rate, probs)
+
     def get_probability_no_exceedance(self, poes):
         """
         See :meth:`superclass method
@@ -22,6 +22,7 @@ import math
 from openquake.baselib.python3compat import range, round
 from openquake.hazardlib.source.base import ParametricSeismicSource
 from openquake.hazardlib.geo.surface.simple_fault import SimpleFaultSurface
+from openquake.hazardlib.geo.surface.base import FaultDistanceCache
 from openquake.hazardlib.geo.nodalplane import NodalPlane
 from openquake.hazardlib.source.rupture import ParametricProbabilisticRupture
 from openquake.baselib.slots import with_slots
@@ -169,51 +170,58 @@ class SimpleFaultSource(ParametricSeismicSource):
         mesh_rows, mesh_cols = whole_fault_mesh.shape
         fault_length = float((mesh_cols - 1) * self.rupture_mesh_spacing)
         fault_width = float((mesh_rows - 1) * self.rupture_mesh_spacing)
-
-        for (mag, mag_occ_rate) in self.get_annual_occurrence_rates():
-            rup_cols, rup_rows = self._get_rupture_dimensions(
-                fault_length, fault_width, mag
-            )
-            num_rup_along_length = mesh_cols - rup_cols + 1
-            num_rup_along_width = mesh_rows - rup_rows + 1
-            num_rup = num_rup_along_length * num_rup_along_width
-
-            occurrence_rate = mag_occ_rate / float(num_rup)
-
-            for first_row in range(num_rup_along_width):
-                for first_col in range(num_rup_along_length):
-                    mesh = whole_fault_mesh[first_row: first_row + rup_rows,
-                                            first_col: first_col + rup_cols]
-
-                    if not len(self.hypo_list) and not len(self.slip_list):
-
-                        hypocenter = mesh.get_middle_point()
-                        occurrence_rate_hypo = occurrence_rate
-                        surface = SimpleFaultSurface(mesh)
-
-                        yield ParametricProbabilisticRupture(
-                            mag, self.rake, self.tectonic_region_type,
-                            hypocenter, surface, type(self),
-                            occurrence_rate_hypo,
-                            self.temporal_occurrence_model
-                        )
-                    else:
-                        for hypo in self.hypo_list:
-                            for slip in self.slip_list:
-                                surface = SimpleFaultSurface(mesh)
-                                hypocenter = surface.get_hypo_location(
-                                    self.rupture_mesh_spacing, hypo[:2])
-                                occurrence_rate_hypo = occurrence_rate * \
-                                    hypo[2] * slip[1]
-                                rupture_slip_direction = slip[0]
-
-                                yield ParametricProbabilisticRupture(
-                                    mag, self.rake, self.tectonic_region_type,
-                                    hypocenter, surface, type(self),
-                                    occurrence_rate_hypo,
-                                    self.temporal_occurrence_model,
-                                    rupture_slip_direction
-                                )
+        # the distances of the ruptures are derived from the ones
+        # of the whole fault, computed only once; they are released when
+        # the iteration ends, even if the ruptures are still alive
+        with FaultDistanceCache(whole_fault_mesh) as dcache:
+            for (mag, mag_occ_rate) in self.get_annual_occurrence_rates():
+                rup_cols, rup_rows = self._get_rupture_dimensions(
+                    fault_length, fault_width, mag
+                )
+                num_rup_along_length = mesh_cols - rup_cols + 1
+                num_rup_along_width = mesh_rows - rup_rows + 1
+                num_rup = num_rup_along_length * num_rup_along_width
+
+                occurrence_rate = mag_occ_rate / float(num_rup)
+
+                for first_row in range(num_rup_along_width):
+                    for first_col in range(num_rup_along_length):
+                        window = (slice(first_row, first_row + rup_rows),
+                                  slice(first_col, first_col + rup_cols))
+                        mesh = whole_fault_mesh[window]
+
+                        if not len(self.hypo_list) and not len(self.slip_list):
+
+                            hypocenter = mesh.get_middle_point()
+                            occurrence_rate_hypo = occurrence_rate
+                            surface = SimpleFaultSurface(mesh)
+                            surface.dcache = dcache, window
+
+                            yield ParametricProbabilisticRupture(
+                                mag, self.rake, self.tectonic_region_type,
+                                hypocenter, surface, type(self),
+                                occurrence_rate_hypo,
+                                self.temporal_occurrence_model
+                            )
+                        else:
+                            for hypo in self.hypo_list:
+                                for slip in self.slip_list:
+                                    surface = SimpleFaultSurface(mesh)
+                                    surface.dcache = dcache, window
+                                    hypocenter = surface.get_hypo_location(
+                                        self.rupture_mesh_spacing, hypo[:2])
+                                    occurrence_rate_hypo = occurrence_rate * \
+                                        hypo[2] * slip[1]
+                                    rupture_slip_direction = slip[0]
+
+                                    yield ParametricProbabilisticRupture(
+                                        mag, self.rake,
+                                        self.tectonic_region_type,
+                                        hypocenter, surface, type(self),
+                                        occurrence_rate_hypo,
+                                        self.temporal_occurrence_model,
+                                        rupture_slip_direction
+                                    )
 
     # TODO: fix the count in the case of hypo_list and slip_list
     def count_ruptures(self):
@@ -20,6 +20,7 @@ Utilities to compute mean and quantile curves
 """
 from __future__ import division
 import numpy
+from openquake.hazardlib.probability_map import ArrayProbabilityMap
 
 
 def mean_curve(values, weights=None):
@@ -89,9 +90,11 @@ def compute_pmap_stats(pmaps, stats, weights):
     :returns:
         a probability map with S internal values
     """
-    sids = set()
     p0 = next(iter(pmaps))
     L = p0.shape_y
+    if all(isinstance(pmap, ArrayProbabilityMap) for pmap in pmaps):
+        return _compute_apmap_stats(pmaps, stats, weights)
+    sids = set()
     for pmap in pmaps:
         sids.update(pmap)
         assert pmap.shape_y == L, (pmap.shape_y, L)
@@ -111,6 +114,22 @@ def compute_pmap_stats(pmaps, stats, weights):
     return out
 
 
+def _compute_apmap_stats(apmaps, stats, weights):
+    # fast version of compute_pmap_stats for ArrayProbabilityMaps
+    sids = numpy.unique(numpy.concatenate([apmap.sids for apmap in apmaps]))
+    if len(sids) == 0:
+        raise ValueError('All empty probability maps!')
+    L = apmaps[0].shape_y
+    curves = numpy.zeros((len(apmaps), len(sids), L), numpy.float64)
+    for i, apmap in enumerate(apmaps):
+        curves[i, numpy.searchsorted(sids, apmap.sids)] = apmap.array[:, :, 0]
+    out = ArrayProbabilityMap(L, len(stats))
+    out.sids = sids.astype(numpy.uint32)
+    # from shape (S, N, L) to shape (N, L, S)
+    out.array = compute_stats(curves, stats, weights).transpose(1, 2, 0)
+    return out
+
+
 # NB: this is a function linear in the array argument
 def compute_stats(array, stats, weights):
     """
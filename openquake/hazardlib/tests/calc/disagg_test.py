@@ -19,12 +19,19 @@ import warnings
 
 import numpy
 
+from openquake.baselib.performance import Monitor
 from openquake.hazardlib.calc import disagg
 from openquake.hazardlib.calc import filters
 from openquake.hazardlib.tom import PoissonTOM
-from openquake.hazardlib.geo import Point, Mesh
-from openquake.hazardlib.site import Site
+from openquake.hazardlib.geo import Point, Mesh, NodalPlane
+from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib.source import PointSource
+from openquake.hazardlib.mfd import TruncatedGRMFD
+from openquake.hazardlib.pmf import PMF
+from openquake.hazardlib.scalerel import WC1994
+from openquake.hazardlib.imt import PGA
 from openquake.hazardlib.gsim.base import ContextMaker
+from openquake.hazardlib.gsim.sadigh_1997 import SadighEtAl1997
 
 
 class _BaseDisaggTestCase(unittest.TestCase):
@@ -181,6 +188,65 @@ class CollectBinsDataTestCase(_BaseDisaggTestCase):
         self.assertEqual(trt_bins, ['trt1', 'trt2'])
 
 
+class CollectBinsDataMultiSiteTestCase(unittest.TestCase):
+    # the data of all the sites are collected in a single pass; the
+    # matrices must be the same as the ones computed site by site
+    def make_source(self, source_id, lon, lat):
+        return PointSource(
+            source_id=source_id, name=source_id,
+            tectonic_region_type='Active Shallow Crust',
+            mfd=TruncatedGRMFD(a_val=3, b_val=1, min_mag=5, max_mag=7,
+                               bin_width=0.5),
+            rupture_mesh_spacing=5, magnitude_scaling_relationship=WC1994(),
+            rupture_aspect_ratio=1.5, temporal_occurrence_model=PoissonTOM(50),
+            upper_seismogenic_depth=0, lower_seismogenic_depth=20,
+            location=Point(lon, lat),
+            nodal_plane_distribution=PMF([(1, NodalPlane(45, 90, 0))]),
+            hypocenter_distribution=PMF([(0.5, 5), (0.5, 10)]))
+
+    def test_same_as_single_site(self):
+        # the first source is close to both sites, the second one only
+        # to the second site: for the first site the per-site calculation
+        # filters away the ruptures of the second source, while the
+        # multi-site calculation keeps them with a zero contribution
+        sources = [self.make_source('1', 0, 0),
+                   self.make_source('2', 3, 0)]
+        sitecol = SiteCollection([Site(Point(0.1, 0.05), 760, True, 100, 5),
+                                  Site(Point(1.5, 0.05), 760, True, 100, 5)])
+        srcfilter = filters.SourceFilter(sitecol, {'default': 200})
+        gsim = SadighEtAl1997()
+        iml, trunc, n_eps = 0.02, 3, 4
+        trt_num = {'Active Shallow Crust': 0}
+        imtls = {'PGA': [0.01, 0.1, 1.]}
+        curves = {sid: {(0, 'PGA'): numpy.array([0.5, 0.1, 0.01])}
+                  for sid in sitecol.sids}
+        rlzs_assoc = {(0, str(gsim)): [mock.Mock(ordinal=0)]}
+        bdata = disagg._collect_bins_data(
+            trt_num, sources, sitecol, curves, 0, rlzs_assoc, [gsim],
+            imtls, [], trunc, n_eps, {'PGA': iml}, Monitor())
+        self.assertEqual(sorted(bdata), [0, 1])
+        num_rups = [len(list(src.iter_ruptures())) for src in sources]
+        for sid, site in zip(sitecol.sids, sitecol):
+            # old computation, site by site
+            edges, expected = disagg.disaggregation(
+                sources, site, PGA(), iml, {'Active Shallow Crust': gsim},
+                trunc, n_eps, mag_bin_width=0.5, dist_bin_width=10,
+                coord_bin_width=0.1, source_site_filter=srcfilter)
+            bd = bdata[sid]
+            [(iml_, probs)] = bd.pnes.values()
+            self.assertEqual(iml_, iml)
+            self.assertEqual(len(probs), sum(num_rups))
+            bins = [bd.mags, bd.dists, bd.lons, bd.lats, bd.trts, None, probs]
+            matrix = disagg._arrange_data_in_bins(bins, edges)
+            numpy.testing.assert_allclose(matrix, expected)
+        # the ruptures of the second source do not contribute to the
+        # first site, since they are filtered in the per-site calculation
+        [(_, probs)] = bdata[0].pnes.values()
+        numpy.testing.assert_equal(probs[num_rups[0]:], 1)
+        [(_, probs)] = bdata[1].pnes.values()
+        self.assertLess(probs[num_rups[0]:].min(), 1)
+
+
 class DigitizeLonsTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -0,0 +1,80 @@
+# The Hazard Library
+# Copyright (C) 2017 GEM Foundation
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import pickle
+import unittest
+import numpy
+from openquake.hazardlib.calc.filters import SiteIndex, SourceFilter
+from openquake.hazardlib.site import Site, SiteCollection
+from openquake.hazardlib import const
+from openquake.hazardlib.geo import Point, NodalPlane
+from openquake.hazardlib.mfd import EvenlyDiscretizedMFD
+from openquake.hazardlib.pmf import PMF
+from openquake.hazardlib.scalerel import PeerMSR
+from openquake.hazardlib.source import PointSource
+from openquake.hazardlib.tom import PoissonTOM
+
+
+def make_sitecol(lons, lats):
+    return SiteCollection([Site(Point(lon, lat), 760., True, 100., 5.)
+                           for lon, lat in zip(lons, lats)])
+
+
+class SiteIndexTestCase(unittest.TestCase):
+    def test_against_brute_force(self):
+        rng = numpy.random.RandomState(42)
+        lons = rng.uniform(-10, 10, 1000)
+        lats = rng.uniform(30, 50, 1000)
+        index = SiteIndex(lons, lats, cellsize=.5)
+        for _ in range(50):
+            min_lon, max_lon = sorted(rng.uniform(-12, 12, 2))
+            min_lat, max_lat = sorted(rng.uniform(28, 52, 2))
+            ok = ((lons >= min_lon) & (lons <= max_lon) &
+                  (lats >= min_lat) & (lats <= max_lat))
+            numpy.testing.assert_equal(
+                index.intersection((min_lon, min_lat, max_lon, max_lat)),
+                ok.nonzero()[0])
+
+    def test_idl(self):
+        # sites across the International Date Line
+        sites = make_sitecol([179.9, -179.9], [0., 0.])
+        sf = SourceFilter(sites, {'default': 50})
+        self.assertTrue(sf.idl)
+        numpy.testing.assert_equal(
+            sf.index.intersection((179.5, -1, 180.5, 1)), [0, 1])
+
+
+class SourceFilterTestCase(unittest.TestCase):
+    def test_pickle(self):
+        sites = make_sitecol([10., 11., 30.], [45., 45., 45.])
+        sf = pickle.loads(pickle.dumps(SourceFilter(sites, {'default': 200})))
+        self.assertTrue(sf.use_index)
+        src = PointSource(
+            source_id='point', name='point',
+            tectonic_region_type=const.TRT.ACTIVE_SHALLOW_CRUST,
+            mfd=EvenlyDiscretizedMFD(
+                min_mag=4, bin_width=1, occurrence_rates=[5]),
+            nodal_plane_distribution=PMF([(1, NodalPlane(0., 90., 0.))]),
+            hypocenter_distribution=PMF([(1, 10)]),
+            upper_seismogenic_depth=0.0,
+            lower_seismogenic_depth=10.0,
+            magnitude_scaling_relationship=PeerMSR(),
+            rupture_aspect_ratio=2,
+            temporal_occurrence_model=PoissonTOM(1.),
+            rupture_mesh_spacing=1.0,
+            location=Point(10, 45))
+        [(s, close)] = sf([src])
+        numpy.testing.assert_equal(close.indices, [0, 1])
+        self.assertEqual(src.nsites, 2)
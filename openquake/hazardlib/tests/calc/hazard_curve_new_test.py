@@ -16,10 +16,12 @@
 
 import os
 import unittest
+import warnings
 import numpy
 import numpy.testing as npt
 
 from openquake.baselib.general import DictArray
+from openquake.baselib.performance import Monitor
 from openquake.hazardlib.source import NonParametricSeismicSource
 from openquake.hazardlib.source.rupture import BaseRupture
 from openquake.hazardlib.sourceconverter import SourceConverter
@@ -30,6 +32,9 @@ from openquake.hazardlib.geo.geodetic import point_at
 from openquake.hazardlib.calc.filters import SourceFilter
 from openquake.hazardlib.calc.hazard_curve import calc_hazard_curves
 from openquake.hazardlib.calc.hazard_curve import pmap_from_grp
+from openquake.hazardlib.calc.hazard_curve import (
+    get_probability_no_exceedance)
+from openquake.hazardlib.gsim.base import ContextMaker
 from openquake.hazardlib.gsim.sadigh_1997 import SadighEtAl1997
 from openquake.hazardlib.gsim.si_midorikawa_1999 import SiMidorikawa1999SInter
 from openquake.hazardlib.gsim.campbell_2003 import Campbell2003
@@ -133,6 +138,21 @@ class HazardCurvesTestCase01(unittest.TestCase):
         npt.assert_almost_equal(numpy.array([0.30000, 0.27855, 0.08912]),
                                 curves[0][0], decimal=4)
 
+    def test_get_probability_no_exceedance(self):
+        # the deprecated function is still working
+        gsim = SadighEtAl1997()
+        [rup] = self.src2.iter_ruptures()
+        sctx, rctx, dctx = ContextMaker([gsim]).make_contexts(
+            self.sites.sitecol, rup)
+        mon = Monitor()
+        with warnings.catch_warnings(record=True):
+            pne = get_probability_no_exceedance(
+                rup, sctx, rctx, dctx, self.imtls, [gsim], None, [mon])
+        self.assertEqual(pne.shape, (1, 3, 1))
+        npt.assert_almost_equal(1. - pne[0, :, 0], [0.3, 0.27855, 0.08912],
+                                decimal=4)
+        self.assertEqual(mon.counts, 1)
+
 
 class HazardCurvePerGroupTest(HazardCurvesTestCase01):
 
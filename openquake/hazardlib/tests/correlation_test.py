@@ -134,3 +134,33 @@ class JB2009ApplyCorrelationTestCase(unittest.TestCase):
         actual_corrcoef = cormo._get_correlation_matrix(self.SITECOL, PGA())
         numpy.testing.assert_almost_equal(inferred_corrcoef, actual_corrcoef,
                                           decimal=2)
+
+
+class JB2009BlockCorrelationTestCase(unittest.TestCase):
+    SITECOL = SiteCollection([Site(Point(2, -40), 1, True, 1, 1),
+                              Site(Point(2, -40.1), 1, True, 1, 1),
+                              Site(Point(20, -39.9), 1, True, 1, 1),
+                              Site(Point(20, -40), 1, True, 1, 1)])
+
+    def test_blocks(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False, block_size=2)
+        factors = cormo.get_factors(self.SITECOL, PGA())
+        self.assertEqual([list(idx) for idx, _ in factors], [[0, 1], [2, 3]])
+        # the factors are cached
+        self.assertIs(cormo.get_factors(self.SITECOL, PGA()), factors)
+
+        # far away sites are uncorrelated, so the blocks give the
+        # same result as the dense matrix
+        dense = JB2009CorrelationModel(vs30_clustering=False)
+        residuals = numpy.random.RandomState(42).normal(size=(4, 10))
+        aaae(cormo.apply_correlation(self.SITECOL, PGA(), residuals),
+             dense.apply_correlation(self.SITECOL, PGA(), residuals))
+
+    def test_filtered(self):
+        cormo = JB2009CorrelationModel(vs30_clustering=False, block_size=2)
+        sites = self.SITECOL.filter(numpy.array([1, 0, 1, 1], bool))
+        residuals = numpy.random.RandomState(42).normal(size=(3, 10))
+        corr = cormo.apply_correlation(sites, PGA(), residuals)
+        self.assertEqual(corr.shape, (3, 10))
+        # the first site has no correlated neighbours in its block
+        aaae(corr[0], residuals[0])
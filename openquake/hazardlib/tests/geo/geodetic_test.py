@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
 import collections
+import mock
 
 import numpy
 
@@ -198,6 +199,21 @@ class MinDistanceTest(unittest.TestCase):
                    slons=[9., 9.], slats=[-39, -45], sdepths=[0.1, 0.2],
                    expected_mpoint_indices=[0, 1])
 
+    def test_blocks(self):
+        numpy.random.seed(42)
+        mlons, mlats = numpy.random.uniform(0, 1, (2, 10, 15))
+        mdepths = numpy.random.uniform(0, 20, (10, 15))
+        slons, slats = numpy.random.uniform(-1, 2, (2, 100))
+        sdepths = numpy.zeros(100)
+        idx, dst = geodetic.min_idx_dst(
+            mlons, mlats, mdepths, slons, slats, sdepths)
+        # 7 sites per block, the last block is incomplete
+        with mock.patch.object(geodetic, 'MAX_DISTANCES', 1000):
+            bidx, bdst = geodetic.min_idx_dst(
+                mlons, mlats, mdepths, slons, slats, sdepths)
+        numpy.testing.assert_equal(bidx, idx)
+        numpy.testing.assert_equal(bdst, dst)
+
 
 class MinDistanceToSegmentTest(unittest.TestCase):
 
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import unittest
+import mock
 
 import numpy
 
@@ -21,7 +22,8 @@ from openquake.hazardlib.geo.point import Point
 from openquake.hazardlib.geo.line import Line
 from openquake.hazardlib.geo.mesh import Mesh, RectangularMesh
 from openquake.hazardlib.geo.surface.simple_fault import SimpleFaultSurface
-from openquake.hazardlib.geo.surface.base import BaseQuadrilateralSurface
+from openquake.hazardlib.geo.surface.base import (
+    BaseQuadrilateralSurface, FaultDistanceCache)
 
 from openquake.hazardlib.tests.geo.surface import _planar_test_data
 
@@ -404,3 +406,55 @@ class GetAzimuthTestCase(unittest.TestCase):
         azimuths = surface.get_azimuth(mesh)
         expected = numpy.array([270., 90., 225.])
         numpy.testing.assert_almost_equal(expected, azimuths, 2)
+
+
+class FaultDistanceCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        trace = Line([Point(0., 0.), Point(0.3, 0.1), Point(0.5, 0.1)])
+        surface = SimpleFaultSurface.from_fault_data(
+            trace, 0., 15., 60., 2.)
+        self.whole = surface.get_mesh()
+        self.cache = FaultDistanceCache(self.whole)
+        numpy.random.seed(42)
+        lons = numpy.random.uniform(-0.5, 1.0, 50)
+        lats = numpy.random.uniform(-0.5, 0.6, 50)
+        self.sites = Mesh(lons, lats, numpy.zeros(50))
+        self.subset = Mesh(lons[::3], lats[::3], numpy.zeros(17))
+
+    def check_window(self, window, mesh):
+        surface = SimpleFaultSurface(self.whole[window])
+        rrup = surface.get_min_distance(mesh)
+        rjb = surface.get_joyner_boore_distance(mesh)
+        surface.dcache = self.cache, window
+        numpy.testing.assert_equal(surface.get_min_distance(mesh), rrup)
+        numpy.testing.assert_equal(
+            surface.get_joyner_boore_distance(mesh), rjb)
+
+    def test_windows(self):
+        nrows, ncols = self.whole.shape
+        for width in (2, 3, 5, ncols):
+            for col in range(0, ncols - width + 1, 3):
+                window = (slice(1, nrows), slice(col, col + width))
+                self.check_window(window, self.sites)
+                self.check_window(window, self.subset)
+        self.check_window(slice(None), self.sites)
+
+    def test_unknown_sites(self):
+        window = (slice(0, 3), slice(0, 4))
+        self.assertIsNotNone(self.cache.get_min_distance(self.sites, window))
+        other = Mesh(numpy.array([0.1]), numpy.array([0.2]), None)
+        self.assertIsNone(self.cache.get_min_distance(other, window))
+
+    def test_too_many_sites(self):
+        with mock.patch.object(FaultDistanceCache, 'maxbytes', 10):
+            window = (slice(0, 3), slice(0, 4))
+            self.assertIsNone(self.cache.get_min_distance(self.sites, window))
+
+    def test_clear(self):
+        window = (slice(0, 3), slice(0, 4))
+        with self.cache:
+            self.check_window(window, self.sites)
+            self.assertTrue(self.cache.nodedist)
+        self.assertEqual(self.cache.nodedist, {})
+        self.assertIsNone(self.cache.get_min_distance(self.sites, window))
+        self.check_window(window, self.sites)  # computed in the usual way
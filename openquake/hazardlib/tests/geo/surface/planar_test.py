@@ -66,6 +66,21 @@ class PlanarSurfaceCreationTestCase(unittest.TestCase):
         msg = 'top and bottom edges have different lengths'
         self.assert_failed_creation(1, 0, 90, corners, ValueError, msg)
 
+    def test_no_check(self):
+        # the check on the imperfect rectangle can be skipped
+        corners = [Point(0, -1, 1), Point(0, 1, 1),
+                   Point(0, 1.2, 2), Point(0, -1.2, 2)]
+        surface = PlanarSurface(1, 0, 90, *corners, check=False)
+        self.assertEqual(surface.strike, 0)
+        array = numpy.array(
+            [(p.longitude, p.latitude, p.depth) for p in corners],
+            [('lon', float), ('lat', float), ('depth', float)])
+        tl, tr, br, bl = array
+        with self.assertRaises(ValueError):
+            PlanarSurface.from_array(1, [tl, tr, bl, br])
+        surface = PlanarSurface.from_array(1, [tl, tr, bl, br], check=False)
+        numpy.testing.assert_equal(surface.corner_depths, [1, 1, 2, 2])
+
     def test_non_positive_mesh_spacing(self):
         corners = [Point(0, -1, 1), Point(0, 1, 1),
                    Point(0, 1, 2), Point(0, -1, 2)]
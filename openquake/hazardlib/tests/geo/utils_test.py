@@ -375,6 +375,40 @@ class ConvexToPointDistanceTestCase(unittest.TestCase):
             dist = utils.point_to_polygon_distance(polygon, pxx, pyy)
             numpy.testing.assert_almost_equal(dist, [0.5, 1, 2])
 
+    def test_polygon_with_hole(self):
+        polygon = shapely.geometry.Polygon(
+            [(0, 0), (4, 0), (4, 4), (0, 4)],
+            [[(1, 1), (3, 1), (3, 3), (1, 3)]])
+        pxx = numpy.array([0.5, 2.0, 2.0, 5.0, 1.0])
+        pyy = numpy.array([0.5, 2.0, 2.5, 2.0, 2.0])
+        dist = utils.point_to_polygon_distance(polygon, pxx, pyy)
+        numpy.testing.assert_almost_equal(dist, [0, 1, 0.5, 1, 0])
+
+    def test_same_as_shapely(self):
+        numpy.random.seed(42)
+        pxx, pyy = numpy.random.uniform(-2, 3, (2, 100))
+        polygon = shapely.geometry.LineString([(0, 0), (1, 1)]).buffer(.1)
+        dist = utils.point_to_polygon_distance(polygon, pxx, pyy)
+        expected = [polygon.distance(shapely.geometry.Point(x, y))
+                    for x, y in zip(pxx, pyy)]
+        numpy.testing.assert_equal(dist, expected)
+
+    def test_points_within(self):
+        numpy.random.seed(42)
+        polygon = shapely.geometry.Polygon(
+            [(0, 0), (4, 0), (4, 4), (0, 4)],
+            [[(1, 1), (3, 1), (3, 3), (1, 3)]])
+        # random points plus some points on the boundary
+        pxx = numpy.concatenate([numpy.random.uniform(-1, 5, 1000),
+                                 [0, 2, 4, 1, 3]])
+        pyy = numpy.concatenate([numpy.random.uniform(-1, 5, 1000),
+                                 [2, 0, 4, 2, 3]])
+        within = utils.points_within(polygon, pxx, pyy)
+        expected = [shapely.geometry.Point(x, y).within(polygon)
+                    for x, y in zip(pxx, pyy)]
+        numpy.testing.assert_equal(within, expected)
+        self.assertFalse(within[-5:].any())
+
 
 class PlaneFit(unittest.TestCase):
     """
@@ -448,3 +482,24 @@ class GeographicObjectsTest(unittest.TestCase):
             0.0, 0.21, max_distance=0.1)  # far
         self.assertIsNone(point)
 
+    def test_closest_many(self):
+        idxs, dists = self.points.get_closest_many(
+            [0.0, 0.0, 0.0, 1.0], [0.21, 0.29, 0.1, 0.1], max_distance=100)
+        numpy.testing.assert_equal(idxs, [1, 2, 0, -1])
+        numpy.testing.assert_allclose(dists[:3], [1.111949, 1.111949, 0],
+                                      atol=1E-6)
+
+    def test_same_as_brute_force(self):
+        numpy.random.seed(42)
+        lons = numpy.random.uniform(-180, 180, 1000)
+        lats = numpy.random.uniform(-90, 90, 1000)
+        array = numpy.zeros(100, [('lon', float), ('lat', float)])
+        array['lon'] = lons[:100]
+        array['lat'] = lats[:100]
+        idxs, dists = utils.GeographicObjects(array).get_closest_many(
+            lons, lats)
+        for lon, lat, idx, dist in zip(lons, lats, idxs, dists):
+            alldists = geo.geodetic.geodetic_distance(
+                lon, lat, array['lon'], array['lat'])
+            self.assertAlmostEqual(dist, alldists.min())
+            self.assertEqual(idx, alldists.argmin())
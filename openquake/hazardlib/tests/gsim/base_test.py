@@ -531,6 +531,30 @@ class MakeContextsTestCase(_FakeGSIMTestCase):
                           'get_joyner_boore_distance': 1,
                           'get_strike': 1})
 
+    def test_block_contexts(self):
+        self.gsim_class.REQUIRES_DISTANCES = set('rjb rx'.split())
+        self.gsim_class.REQUIRES_RUPTURE_PARAMETERS = set(['mag'])
+        self.gsim_class.REQUIRES_SITES_PARAMETERS = set(['vs30'])
+        rup2 = BaseRupture(
+            mag=5.5, rake=123.56, tectonic_region_type=const.TRT.VOLCANIC,
+            hypocenter=self.rupture_hypocenter,
+            surface=self.rupture.surface, source_typology=object())
+        ruptures = [self.rupture, rup2, self.rupture]
+        sites = SiteCollection([self.site1, self.site2])
+        [(ctxs1, block1), (ctxs2, block2)] = ContextMaker(
+            [self.gsim_class]).make_block_contexts(sites, ruptures)
+        # the first and the third rupture have the same magnitude
+        self.assertEqual([ctx[0] for ctx in ctxs1], [0, 2])
+        self.assertEqual([ctx[0] for ctx in ctxs2], [1])
+        sctx, rctx, dctx = block1
+        self.assertEqual(rctx.mag, 123.45)
+        self.assertTrue((sctx.vs30 == [456, 1456, 456, 1456]).all())
+        self.assertTrue((dctx.rjb == [6, 7, 6, 7]).all())
+        self.assertTrue((dctx.rx == [4, 5, 4, 5]).all())
+        sctx, rctx, dctx = block2
+        self.assertEqual(rctx.mag, 5.5)
+        self.assertTrue((sctx.vs30 == [456, 1456]).all())
+
 
 class ContextTestCase(unittest.TestCase):
     def test_equality(self):
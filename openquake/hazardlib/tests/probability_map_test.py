@@ -0,0 +1,76 @@
+#  -*- coding: utf-8 -*-
+#  vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#  Copyright (c) 2017 GEM Foundation
+
+#  OpenQuake is free software: you can redistribute it and/or modify it
+#  under the terms of the GNU Affero General Public License as published
+#  by the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  OpenQuake is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU Affero General Public License
+#  along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+import pickle
+import unittest
+import numpy
+from openquake.baselib.general import DictArray
+from openquake.hazardlib.probability_map import (
+    ProbabilityMap, ArrayProbabilityMap)
+
+aae = numpy.testing.assert_array_equal
+
+
+def make_pmap(sids, seed):
+    numpy.random.seed(seed)
+    return ProbabilityMap.from_array(
+        numpy.random.random((len(sids), 4, 2)), sids)
+
+
+class ArrayProbabilityMapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pmap1 = make_pmap([1, 3, 4], 42)
+        self.pmap2 = make_pmap([0, 3, 7], 43)
+        self.apmap1 = ArrayProbabilityMap.from_pmap(self.pmap1)
+        self.apmap2 = ArrayProbabilityMap.from_pmap(self.pmap2)
+
+    def assert_same(self, apmap, pmap):
+        aae(apmap.sids, pmap.sids)
+        aae(apmap.array, pmap.array)
+
+    def test_or(self):
+        self.assert_same(self.apmap1 | self.apmap2, self.pmap1 | self.pmap2)
+        self.apmap1 |= self.pmap2
+        self.pmap1 |= self.pmap2
+        self.assert_same(self.apmap1, self.pmap1)
+
+    def test_mul(self):
+        self.assert_same(self.apmap1 * self.apmap2, self.pmap1 * self.pmap2)
+        self.assert_same(self.apmap1 * .5, self.pmap1 * .5)
+
+    def test_invert(self):
+        self.pmap1[4].array[:] = 1.
+        apmap = ArrayProbabilityMap.from_pmap(self.pmap1)
+        self.assert_same(~apmap, ~self.pmap1)
+        self.assertNotIn(4, ~apmap)
+
+    def test_filter_extract(self):
+        self.assert_same(self.apmap1.filter([3, 4, 5]),
+                         self.pmap1.filter([3, 4, 5]))
+        self.assert_same(self.apmap1.extract(1), self.pmap1.extract(1))
+
+    def test_convert(self):
+        imtls = DictArray({'PGA': [.1, .2], 'PGV': [.1, .2]})
+        aae(self.apmap1.convert(imtls, 5, 1),
+            self.pmap1.convert(imtls, 5, 1))
+
+    def test_toh5_and_pickle(self):
+        array, attrs = self.apmap1.__toh5__()
+        apmap = ArrayProbabilityMap(4, 2)
+        apmap.__fromh5__(array, attrs)
+        self.assert_same(apmap, self.pmap1)
+        self.assert_same(pickle.loads(pickle.dumps(self.apmap1)), self.pmap1)
@@ -114,6 +114,21 @@ class SiteCollectionCreationTestCase(unittest.TestCase):
             self.assertEqual(list(f['folder/b']), [2, 3])
         os.remove(fpath)
 
+    def test_from_array(self):
+        s1 = Site(location=Point(10, 20, 30),
+                  vs30=1.2, vs30measured=True,
+                  z1pt0=3.4, z2pt5=5.6, backarc=True)
+        s2 = Site(location=Point(-1.2, -3.4, -5.6),
+                  vs30=55.4, vs30measured=False,
+                  z1pt0=66.7, z2pt5=88.9, backarc=False)
+        cll = SiteCollection([s1, s2])
+        array, attrs = cll.__toh5__()
+        newcll = SiteCollection.from_array(array)
+        self.assertEqual(newcll, cll)
+        self.assertEqual(newcll.sids.dtype, cll.sids.dtype)
+        for slot in SiteCollection._slots_:
+            self.assertEqual(getattr(newcll, slot).flags.writeable, False)
+
     def test_from_points(self):
         lons = [10, -1.2]
         lats = [20, -3.4]
@@ -26,7 +26,7 @@ import openquake.hazardlib.mfd.evenly_discretized as mfdeven
 import openquake.hazardlib.scalerel.base as msr
 import openquake.hazardlib.tom as tom
 from openquake.hazardlib.scalerel import PeerMSR, WC1994
-from openquake.hazardlib.geo import Point, Line
+from openquake.hazardlib.geo import Point, Line, Mesh
 from openquake.hazardlib.tom import PoissonTOM
 
 
@@ -151,6 +151,23 @@ class SimpleFaultIterRupturesTestCase(_BaseFaultSourceTestCase):
 
         self.assertEqual(len(list(fault.iter_ruptures())), 1)
 
+    def test_distance_cache_released(self):
+        # the distances of the whole fault are not kept alive by the
+        # ruptures after the end of the iteration
+        mfd = TruncatedGRMFD(a_val=0.5, b_val=1.0, min_mag=3.0, max_mag=4.0,
+                             bin_width=1.0)
+        source = self._make_source(mfd=mfd, aspect_ratio=1.0)
+        sites = Mesh(numpy.array([0.1, 0.2]), numpy.array([0.1, 0.]), None)
+        dists = []
+        for rup in source.iter_ruptures():
+            dists.append(rup.surface.get_min_distance(sites))
+            dcache = rup.surface.dcache[0]
+            self.assertTrue(dcache.nodedist)
+        self.assertEqual(dcache.nodedist, {})
+        # the distances are still right, computed without the cache
+        numpy.testing.assert_equal(rup.surface.get_min_distance(sites),
+                                   dists[-1])
+
 
 class SimpleFaultParametersChecksTestCase(_BaseFaultSourceTestCase):
 
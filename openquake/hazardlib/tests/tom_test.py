@@ -16,6 +16,7 @@
 import unittest
 
 import numpy
+import scipy.stats
 
 from openquake.hazardlib.tom import PoissonTOM
 
@@ -55,6 +56,17 @@ class PoissonTOMTestCase(unittest.TestCase):
                    for i in range(num_samples)) / float(num_samples)
         self.assertAlmostEqual(mean, rate * time_span, delta=1e-3)
 
+    def test_get_number_of_occurrences(self):
+        # inverse transform sampling, as in scipy.stats.poisson.ppf
+        tom = PoissonTOM(time_span=10)
+        rates = numpy.array([1E-6, .01, .1, 1, 20])
+        probs = numpy.random.RandomState(42).random_sample((5, 4, 100))
+        occ = tom.get_number_of_occurrences(rates, probs)
+        self.assertEqual(occ.shape, (5, 4, 100))
+        expected = scipy.stats.poisson.ppf(
+            probs, rates[:, None, None] * 10).astype(int)
+        numpy.testing.assert_equal(occ, expected)
+
     def test_get_probability_no_exceedance(self):
         time_span = 50.
         rate = 0.01
@@ -24,6 +24,7 @@ import math
 
 import numpy
 import scipy.stats
+from scipy.special import gammaln
 
 from openquake.baselib.slots import with_slots
 
@@ -98,6 +99,45 @@ class PoissonTOM(object):
             numpy.random.seed(seeds)
         return numpy.random.poisson(occurrence_rate * self.time_span)
 
+    def get_number_of_occurrences(self, occurrence_rate, probs):
+        """
+        Convert uniform random numbers into numbers of events to occur,
+        by inverting the cumulative distribution function (inverse
+        transform sampling). Since the rates are usually small, most of
+        the numbers are converted into zero by comparing them with the
+        probability of no occurrence and the other ones are converted by
+        summing the probability mass function term by term.
+
+        :param occurrence_rate:
+            An array of N average numbers of events per year.
+        :param probs:
+            An array of shape (N, ...) of numbers in the interval (0, 1).
+        :return:
+            An array of integers with the same shape as ``probs``.
+        """
+        probs = numpy.asarray(probs)
+        rates = numpy.asarray(occurrence_rate, float) * self.time_span
+        rates = rates.reshape(rates.shape + (1,) * (probs.ndim - rates.ndim))
+        occ = numpy.zeros(probs.shape, int)
+        # indices of the numbers exceeding the probability of no events
+        idx = numpy.nonzero((probs > numpy.exp(-rates)).ravel())[0]
+        if len(idx) == 0:
+            return occ
+        rate = numpy.broadcast_arrays(rates, probs)[0].ravel()[idx]
+        prob = probs.ravel()[idx]
+        cdf = numpy.exp(-rate)
+        k = 0
+        while len(idx):
+            k += 1
+            # the pmf is computed in log space to avoid underflows
+            pmf = numpy.exp(k * numpy.log(rate) - rate - gammaln(k + 1))
+            cdf += pmf
+            occ.flat[idx] = k
+            # stop also when the tail is exhausted, due to rounding
+            ok = (prob > cdf) & ((pmf > 0) | (k < rate))
+            idx, rate, prob, cdf = idx[ok], rate[ok], prob[ok], cdf[ok]
+        return occ
+
     def get_probability_no_exceedance(self, occurrence_rate, poes):
         """
         Compute and return, for a number of ground motion levels and sites,
@@ -100,138 +100,83 @@ class Afteran(BaseCatalogueDecluster):
         flagvector = np.zeros(neq, dtype=int)
         # Rank magnitudes into descending order
         id0 = np.flipud(np.argsort(mag, kind='heapsort'))
+        # Sort the events by time: the catalogue is assumed to be in
+        # chronological order, so that the sequences of aftershocks and
+        # foreshocks can be followed window by window with a binary search
+        torder = np.argsort(year_dec, kind='mergesort')
+        tsorted = year_dec[torder]
 
         clust_index = 0
         for imarker in id0:
             # Earthquake not allocated to cluster - perform calculation
             if vcl[imarker] == 0:
-                # Perform distance calculation
-                mdist = haversine(
-                    catalogue.data['longitude'],
-                    catalogue.data['latitude'],
-                    catalogue.data['longitude'][imarker],
-                    catalogue.data['latitude'][imarker]).flatten()
-
-                # Select earthquakes inside distance window, later than
-                # mainshock and not already assigned to a cluster
-                vsel1 = np.where(
-                    np.logical_and(vcl == 0,
-                                   np.logical_and(
-                                       mdist <= sw_space[imarker],
-                                       year_dec > year_dec[imarker])))[0]
-                has_aftershocks = False
-                if len(vsel1) > 0:
-                    # Earthquakes after event inside distance window
-                    temp_vsel1, has_aftershocks = self._find_aftershocks(
-                        vsel1,
-                        year_dec,
-                        time_window,
-                        imarker,
-                        neq)
-                    if has_aftershocks:
-                        flagvector[temp_vsel1] = 1
-                        vcl[temp_vsel1] = clust_index + 1
-
-                # Select earthquakes inside distance window, earlier than
-                # mainshock and not already assigned to a cluster
-                has_foreshocks = False
-                vsel2 = np.where(
-                    np.logical_and(
-                        vcl == 0,
-                        np.logical_and(mdist <= sw_space[imarker],
-                                       year_dec < year_dec[imarker])))[0]
-                if len(vsel2) > 0:
-                    # Earthquakes before event inside distance window
-                    temp_vsel2, has_foreshocks = self._find_foreshocks(
-                        vsel2,
-                        year_dec,
-                        time_window,
-                        imarker,
-                        neq)
-                    if has_foreshocks:
-                        flagvector[temp_vsel2] = -1
-                        vcl[temp_vsel2] = clust_index + 1
-
-                if has_aftershocks or has_foreshocks:
+                # Earthquakes after event inside distance window
+                temp_vsel1 = self._follow_sequence(
+                    catalogue, vcl, sw_space, year_dec, torder, tsorted,
+                    time_window, imarker, forward=True)
+                if len(temp_vsel1):
+                    flagvector[temp_vsel1] = 1
+                    vcl[temp_vsel1] = clust_index + 1
+
+                # Earthquakes before event inside distance window
+                temp_vsel2 = self._follow_sequence(
+                    catalogue, vcl, sw_space, year_dec, torder, tsorted,
+                    time_window, imarker, forward=False)
+                if len(temp_vsel2):
+                    flagvector[temp_vsel2] = -1
+                    vcl[temp_vsel2] = clust_index + 1
+
+                if len(temp_vsel1) or len(temp_vsel2):
                     # Assign mainshock to cluster
                     vcl[imarker] = clust_index + 1
                     clust_index += 1
 
         return vcl, flagvector
 
-    def _find_aftershocks(self, vsel, year_dec, time_window, imarker, neq):
-        '''
-        Function to identify aftershocks from a set of potential
-        events inside the distance window of an earthquake.
-        :param vsel: Pointer vector to the location of the events in distance
-                     window
-        :type vsel: numpy.ndarray
-        :param year_dec: Vector of decimal catalogue event times
-        :type year_dec: numpy.ndarray
-        :param time_window: Moving time window for selection of time clusters
-        :type time_window: float
-        :param imarker: Index of the mainshock in the catalogue vector
-        :type imarker: Integer
-        :param neq: Number of events in distance window of mainshock
-        :type neq: Integer
-        '''
-        temp_vsel1 = np.zeros(neq, dtype=bool)
-        has_aftershocks = False
-
-        # Finds the time difference between events
-        delta_time = np.diff(
-            np.hstack([year_dec[imarker], year_dec[vsel]]))
-        for iloc in range(0, len(vsel)):
-            # If time difference between event is smaller than
-            # time window - is an aftershock -> continue
-
-            if delta_time[iloc] < time_window:
-                temp_vsel1[vsel[iloc]] = True
-                has_aftershocks = True
-            else:
-                # Time difference between events is larger than
-                # window -> no more aftershocks -> return
-                return temp_vsel1, has_aftershocks
-
-        return temp_vsel1, has_aftershocks
-
-    def _find_foreshocks(self, vsel, year_dec, time_window, imarker, neq):
-        '''
-        Finds foreshocks from a set of potential events within
-        the distance window of a mainshock.
-        :param vsel: Pointer vector to the location of the events in distance
-                     window
-        :type vsel: numpy.ndarray
-        :param year_dec: Vector of decimal catalogue event times
-        :type year_dec: numpy.ndarray
-        :param time_window: Moving time window for selection of time clusters
-        :type time_window: float
-        :param imarker: Index of the mainshock in the catalogue vector
-        :type imarker: Integer
-        :param neq: Number of events in distance window of mainshock
-        :type neq: Integer
-        '''
-
-        temp_vsel2 = np.zeros(neq, dtype=bool)
-        has_foreshocks = False
-
-        # The initial time is the time of the mainshock
-        initial_time = year_dec[imarker]
-        year_dec = year_dec[vsel]
-        for jloc in range(len(vsel) - 1, -1, -1):
-            # If the time between the mainshock and the preceeding
-            # event is smaller than the time_window then event
-            # is a foreshock
-
-            if (initial_time - year_dec[jloc]) < time_window:
-                temp_vsel2[vsel[jloc]] = True
-                has_foreshocks = True
-                # Update target time to consider current foreshock
-                # Then continue
-                initial_time = year_dec[jloc]
+    def _follow_sequence(self, catalogue, vcl, sw_space, year_dec, torder,
+                         tsorted, time_window, imarker, forward):
+        """
+        Find the aftershocks (or the foreshocks, if `forward` is False) of an
+        earthquake, i.e. the sequence of events not already assigned to a
+        cluster, inside the distance window of the mainshock and separated
+        by less than `time_window` from the previous (following) event of
+        the sequence. Only the events inside the moving time window are
+        considered, so that the cost does not depend on the size of the
+        catalogue.
+
+        :returns: the indices of the events in the sequence
+        """
+        margin = 1E-6  # in decimal years, to be safe with the rounding
+        lons = catalogue.data['longitude']
+        lats = catalogue.data['latitude']
+        found = []
+        time = year_dec[imarker]
+        if forward:  # start after the events at the time of the mainshock
+            pos = np.searchsorted(tsorted, time, side='right')
+        else:  # start before the events at the time of the mainshock
+            pos = np.searchsorted(tsorted, time)
+        while True:
+            # events inside the time window of the last event found
+            if forward:
+                end = np.searchsorted(
+                    tsorted, time + time_window + margin, side='right')
+                window = torder[pos:end]
             else:
-                # No events inside time window
-                # end of foreshock sequence - return
-                return temp_vsel2, has_foreshocks
-
-        return temp_vsel2, has_foreshocks
+                end = np.searchsorted(tsorted, time - time_window - margin)
+                window = torder[end:pos][::-1]
+            window = window[vcl[window] == 0]
+            mdist = haversine(lons[window], lats[window],
+                              lons[imarker], lats[imarker])[:, 0]
+            window = window[mdist <= sw_space[imarker]]
+            if len(window) == 0:  # end of the sequence
+                return np.array(found, int)
+            # time differences between consecutive events
+            times = np.hstack([time, year_dec[window]])
+            delta_time = np.abs(np.diff(times))
+            breaks = np.nonzero(delta_time >= time_window)[0]
+            nok = breaks[0] if len(breaks) else len(window)
+            found.extend(window[:nok])
+            if nok < len(window):  # the sequence is interrupted
+                return np.array(found, int)
+            time = year_dec[window[-1]]
+            pos = end
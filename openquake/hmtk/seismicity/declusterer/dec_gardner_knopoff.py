@@ -117,34 +117,43 @@ class GardnerKnopoffType1(BaseCatalogueDecluster):
         year_dec = year_dec[id0]
         eqid = eqid[id0]
         flagvector = np.zeros(neq, dtype=int)
+        # Sort the events by time, so that the events inside the time
+        # window of an event can be found with a binary search; the window
+        # is enlarged by a small margin and then the exact test is applied
+        torder = np.argsort(year_dec, kind='mergesort')
+        tsorted = year_dec[torder]
+        margin = 1E-6  # in decimal years, i.e. ~30 seconds
         # Begin cluster identification
         clust_index = 0
         for i in range(0, neq - 1):
             if vcl[i] == 0:
                 # Find Events inside both fore- and aftershock time windows
-                dt = year_dec - year_dec[i]
-                vsel = np.logical_and(
-                    vcl == 0,
-                    np.logical_and(
-                        dt >= (-sw_time[i] * config['fs_time_prop']),
-                        dt <= sw_time[i]))
+                tmin = year_dec[i] - sw_time[i] * config['fs_time_prop']
+                tmax = year_dec[i] + sw_time[i]
+                vsel = torder[np.searchsorted(tsorted, tmin - margin):
+                              np.searchsorted(tsorted, tmax + margin,
+                                              side='right')]
+                vsel = vsel[vcl[vsel] == 0]
+                dt = year_dec[vsel] - year_dec[i]
+                ok = np.logical_and(
+                    dt >= (-sw_time[i] * config['fs_time_prop']),
+                    dt <= sw_time[i])
+                vsel, dt = vsel[ok], dt[ok]
                 # Of those events inside time window,
                 # find those inside distance window
-                vsel1 = haversine(longitude[vsel],
-                                  latitude[vsel],
-                                  longitude[i],
-                                  latitude[i]) <= sw_space[i]
-                vsel[vsel] = vsel1
-                temp_vsel = np.copy(vsel)
-                temp_vsel[i] = False
-                if any(temp_vsel):
+                ok = haversine(longitude[vsel],
+                               latitude[vsel],
+                               longitude[i],
+                               latitude[i])[:, 0] <= sw_space[i]
+                vsel, dt = vsel[ok], dt[ok]
+                others = vsel != i
+                if others.any():
                     # Allocate a cluster number
                     vcl[vsel] = clust_index + 1
                     flagvector[vsel] = 1
                     # For those events in the cluster before the main event,
                     # flagvector is equal to -1
-                    temp_vsel[dt >= 0.0] = False
-                    flagvector[temp_vsel] = -1
+                    flagvector[vsel[np.logical_and(others, dt < 0.0)]] = -1
                     flagvector[i] = 0
                     clust_index += 1
 
@@ -52,10 +52,38 @@ States. Seismological Research Letters. 66(4) 8 - 21
 '''
 
 import numpy as np
-from openquake.hmtk.seismicity.utils import haversine
+from scipy.spatial import cKDTree
 from openquake.hmtk.seismicity.smoothing.kernels.base import (
     BaseSmoothingKernel)
 
+EARTH_RADIUS = 6371.227  # km, as in openquake.hmtk.seismicity.utils.haversine
+
+
+def _haversine_pairs(lon1, lat1, lon2, lat2):
+    """
+    Element by element version of
+    :func:`openquake.hmtk.seismicity.utils.haversine`, performing the same
+    operations, for arrays of pairs of points in decimal degrees
+    """
+    cfact = np.pi / 180.
+    lon1, lat1, lon2, lat2 = (cfact * lon1, cfact * lat1,
+                              cfact * lon2, cfact * lat2)
+    dlat = lat1 - lat2
+    dlon = lon1 - lon2
+    aval = (np.sin(dlat / 2.) ** 2.) + (np.cos(lat1) * np.cos(lat2) *
+                                        (np.sin(dlon / 2.) ** 2.))
+    return 2. * EARTH_RADIUS * np.arctan2(np.sqrt(aval), np.sqrt(1 - aval))
+
+
+def _to_cartesian(lons, lats):
+    """
+    :returns: an array (N, 3) of points on the sphere with the Earth radius
+    """
+    lons, lats = np.radians(lons), np.radians(lats)
+    return EARTH_RADIUS * np.column_stack([np.cos(lats) * np.cos(lons),
+                                           np.cos(lats) * np.sin(lons),
+                                           np.sin(lats)])
+
 
 class IsotropicGaussian(BaseSmoothingKernel):
     '''
@@ -63,9 +91,13 @@ class IsotropicGaussian(BaseSmoothingKernel):
     Kernel - taken from Frankel (1995) approach
     '''
 
-    def smooth_data(self, data, config, is_3d=False):
+    def smooth_data(self, data, config, is_3d=False, block_size=10000):
         '''
-        Applies the smoothing kernel to the data
+        Applies the smoothing kernel to the data. The cells within the
+        cut-off distance of each cell are found with a KD-tree on the
+        cartesian coordinates of the cells, processing `block_size` cells
+        at the time, so that the cost is proportional to the number of
+        neighbours and not to the square of the number of cells.
 
         :param np.ndarray data:
             Raw earthquake count in the form [Longitude, Latitude, Depth,
@@ -74,6 +106,10 @@ class IsotropicGaussian(BaseSmoothingKernel):
             Configuration parameters must contain:
             * BandWidth: The bandwidth of the kernel (in km) (float)
             * Length_Limit: Maximum number of standard deviations
+        :param bool is_3d:
+            If True the depth is included in the distance
+        :param int block_size:
+            Number of cells processed at once
 
         :returns:
             * smoothed_value: np.ndarray vector of smoothed values
@@ -82,15 +118,27 @@ class IsotropicGaussian(BaseSmoothingKernel):
         '''
         max_dist = config['Length_Limit'] * config['BandWidth']
         smoothed_value = np.zeros(len(data), dtype=float)
-        for iloc in range(0, len(data)):
-            dist_val = haversine(data[:, 0], data[:, 1],
-                                 data[iloc, 0], data[iloc, 1])
-
+        # the chord is shorter than the arc, so the tree returns all the
+        # cells within max_dist, plus a few which are discarded below
+        tree = cKDTree(_to_cartesian(data[:, 0], data[:, 1]))
+        for start in range(0, len(data), block_size):
+            block = np.arange(start, min(start + block_size, len(data)))
+            neighbours = tree.query_ball_point(
+                tree.data[block], max_dist * (1. + 1E-9))
+            nums = [len(idxs) for idxs in neighbours]
+            iloc = np.repeat(np.arange(len(block)), nums)
+            jloc = np.concatenate([sorted(idxs) for idxs in neighbours])
+            dist_val = _haversine_pairs(data[jloc, 0], data[jloc, 1],
+                                        data[block[iloc], 0],
+                                        data[block[iloc], 1])
             if is_3d:
-                dist_val = np.sqrt(dist_val.flatten() ** 2.0 +
-                                   (data[:, 2] - data[iloc, 2]) ** 2.0)
-            id0 = np.where(dist_val <= max_dist)[0]
-            w_val = (np.exp(-(dist_val[id0] ** 2.0) /
-                            (config['BandWidth'] ** 2.))).flatten()
-            smoothed_value[iloc] = np.sum(w_val * data[id0, 3]) / np.sum(w_val)
+                dz = data[jloc, 2] - data[block[iloc], 2]
+                dist_val = np.sqrt(dist_val ** 2.0 + dz ** 2.0)
+            ok = dist_val <= max_dist
+            iloc, jloc = iloc[ok], jloc[ok]
+            w_val = np.exp(-(dist_val[ok] ** 2.0) /
+                           (config['BandWidth'] ** 2.))
+            smoothed_value[block] = (
+                np.bincount(iloc, w_val * data[jloc, 3], len(block)) /
+                np.bincount(iloc, w_val, len(block)))
         return smoothed_value, np.sum(data[:, -1]), np.sum(smoothed_value)
@@ -57,6 +57,8 @@ import numpy as np
 from openquake.hmtk.seismicity.declusterer.dec_afteran import Afteran
 from openquake.hmtk.seismicity.declusterer.distance_time_windows import GardnerKnopoffWindow
 from openquake.hmtk.parsers.catalogue import CsvCatalogueParser
+from openquake.hmtk.seismicity.catalogue import Catalogue
+from openquake.hmtk.seismicity.utils import decimal_year, haversine
 
 class AfteranTestCase(unittest.TestCase):
     """
@@ -90,42 +92,65 @@ class AfteranTestCase(unittest.TestCase):
         print('flagvector:', flagvector, self.cat.data['flag'])
         self.assertTrue(np.allclose(flagvector, self.cat.data['flag']))
 
-    def test_find_aftershocks(self):
-        '''
-        Tests the find aftershocks function
-        '''
-        # Test when aftershocks are in array
-        year_dec = np.array([0.10, 0.20, 0.5, 0.60, 0.80, 1.2])
-        vsel = np.array([3, 4, 5])
-        expected_result = (np.array([False, False, False, True, True, False]),
-                           True)
-        model_result = self.dec._find_aftershocks(vsel, year_dec, 0.25, 2, 6)
-        self.assertTrue(np.all(expected_result[0] == model_result[0]))
-        self.assertTrue(model_result[1])
-
-        # Test when no aftershocks are found - reduce window to < 0.1
-        expected_result = (
-            np.array([False, False, False, False, False, False]), False)
-        model_result = self.dec._find_aftershocks(vsel, year_dec, 0.09, 2, 6)
-        self.assertTrue(np.all(expected_result[0] == model_result[0]))
-        self.assertFalse(model_result[1])
+    def test_same_as_brute_force(self):
+        # a larger catalogue sorted by time, with sequences of events
+        # in the same place, compared with the search on all the events
+        config = {
+            'time_distance_window': GardnerKnopoffWindow(),
+            'time_window': 60.}
+        rng = np.random.RandomState(42)
+        neq = 1000
+        # 12 months of 28 days, so that the dates are always valid
+        days = np.sort(rng.randint(0, 20 * 336, neq))
+        lons = rng.choice([10., 10.2, 11., 13.], neq) + rng.normal(0, .05, neq)
+        lats = rng.choice([44., 44.1, 45.], neq) + rng.normal(0, .05, neq)
+        cat = Catalogue.make_from_dict({
+            'eventID': np.arange(neq),
+            'year': 1990 + days // 336,
+            'month': days % 336 // 28 + 1,
+            'day': days % 28 + 1,
+            'magnitude': np.round(rng.exponential(.5, neq) + 3, 1),
+            'longitude': lons,
+            'latitude': lats})
+        vcl, flagvector = self.dec.decluster(cat, config)
+        expected_vcl, expected_flags = decluster_brute_force(cat, config)
+        self.assertGreater(vcl.max(), 10)  # there are several clusters
+        np.testing.assert_equal(vcl, expected_vcl)
+        np.testing.assert_equal(flagvector, expected_flags)
 
-    def test_find_foreshocks(self):
-        '''
-        Tests the find_foreshocks function
-        '''
-        # Test when aftershocks are in array
-        year_dec = np.array([0.10, 0.40, 0.5, 0.60, 0.80, 1.2])
-        vsel = np.array([0, 1])
-        expected_result = (
-            np.array([False, True, False, False, False, False]), True)
-        model_result = self.dec._find_foreshocks(vsel, year_dec, 0.25, 2, 6)
-        self.assertTrue(np.all(expected_result[0] == model_result[0]))
-        self.assertTrue(model_result[1])
 
-        # Test when no aftershocks are found - reduce window to < 0.1
-        expected_result = (
-            np.array([False, False, False, False, False, False]), False)
-        model_result = self.dec._find_foreshocks(vsel, year_dec, 0.09, 2, 6)
-        self.assertTrue(np.all(expected_result[0] == model_result[0]))
-        self.assertFalse(model_result[1])
+def decluster_brute_force(catalogue, config):
+    # the Afteran algorithm considering all the events of the catalogue
+    # for each mainshock
+    time_window = config['time_window'] / 365.
+    mag = catalogue.data['magnitude']
+    lons = catalogue.data['longitude']
+    lats = catalogue.data['latitude']
+    neq = len(mag)
+    year_dec = decimal_year(catalogue.data['year'], catalogue.data['month'],
+                            catalogue.data['day'])
+    sw_space, _ = config['time_distance_window'].calc(mag)
+    vcl = np.zeros(neq, dtype=int)
+    flagvector = np.zeros(neq, dtype=int)
+    clust_index = 0
+    for imarker in np.flipud(np.argsort(mag, kind='heapsort')):
+        if vcl[imarker]:
+            continue
+        mdist = haversine(lons, lats, lons[imarker], lats[imarker]).flatten()
+        close = (vcl == 0) & (mdist <= sw_space[imarker])
+        found = False
+        for flag, vsel in [
+                (1, np.where(close & (year_dec > year_dec[imarker]))[0]),
+                (-1, np.where(close & (year_dec < year_dec[imarker]))[0])]:
+            time = year_dec[imarker]
+            for i in (vsel if flag == 1 else vsel[::-1]):
+                if abs(year_dec[i] - time) >= time_window:
+                    break
+                flagvector[i] = flag
+                vcl[i] = clust_index + 1
+                time = year_dec[i]
+                found = True
+        if found:
+            vcl[imarker] = clust_index + 1
+            clust_index += 1
+    return vcl, flagvector
@@ -81,6 +81,50 @@ class AssetCollection(object):
         self.tot_sites = len(assets_by_site)
         self.array, self.taxonomies = self.build_asset_collection(
             assets_by_site, time_event)
+        self._set_fields()
+
+    @classmethod
+    def from_array(cls, array, site_ids, taxonomies, cost_calculator,
+                   time_event, time_events=''):
+        """
+        Build the collection directly from a composite array of assets,
+        without instantiating :class:`openquake.risklib.riskmodels.Asset`
+        objects.
+
+        :param array:
+            an array with fields idx, lon, lat, taxonomy_id, number, area
+            and the float fields value-XXX, occupants, deductible-XXX,
+            insurance_limit-XXX, retrofitted-XXX
+        :param site_ids:
+            an array of site indices, one per asset
+        :param taxonomies:
+            the sorted taxonomies, referenced by the field taxonomy_id
+        :param cost_calculator:
+            a :class:`openquake.risklib.riskmodels.CostCalculator` instance
+        :param time_event:
+            a time event string (or None)
+        :param time_events:
+            the time events in the exposure
+        """
+        self = cls.__new__(cls)
+        self.cc = cost_calculator
+        self.time_event = time_event
+        self.time_events = time_events
+        self.tot_sites = site_ids.max() + 1 if len(site_ids) else 0
+        float_fields = [name for name in array.dtype.names if name not in
+                        ('idx', 'lon', 'lat', 'taxonomy_id', 'number', 'area')]
+        self.array = numpy.zeros(len(array), get_asset_dt(float_fields))
+        # the assets are ordered by site and then by index, as in
+        # build_asset_collection
+        order = numpy.lexsort((array['idx'], site_ids))
+        self.array['site_id'] = site_ids[order]
+        for name in array.dtype.names:
+            self.array[name] = array[name][order]
+        self.taxonomies = numpy.array(taxonomies, hdf5.vstr)
+        self._set_fields()
+        return self
+
+    def _set_fields(self):
         fields = self.array.dtype.names
         self.loss_types = [f[6:] for f in fields if f.startswith('value-')]
         if 'occupants' in fields:
@@ -203,10 +247,7 @@ class AssetCollection(object):
             for asset in assets:
                 taxonomies.add(asset.taxonomy)
         sorted_taxonomies = sorted(taxonomies)
-        asset_dt = numpy.dtype(
-            [('idx', U32), ('lon', F32), ('lat', F32), ('site_id', U32),
-             ('taxonomy_id', U32), ('number', F32), ('area', F32)] + [
-                 (str(name), float) for name in float_fields])
+        asset_dt = get_asset_dt(float_fields)
         num_assets = sum(len(assets) for assets in assets_by_site)
         assetcol = numpy.zeros(num_assets, asset_dt)
         asset_ordinal = 0
@@ -245,6 +286,17 @@ class AssetCollection(object):
         return assetcol, numpy.array(sorted_taxonomies, hdf5.vstr)
 
 
+def get_asset_dt(float_fields):
+    """
+    :param float_fields: names of the fields value-XXX, occupants, ...
+    :returns: the dtype of the array of an :class:`AssetCollection`
+    """
+    return numpy.dtype(
+        [('idx', U32), ('lon', F32), ('lat', F32), ('site_id', U32),
+         ('taxonomy_id', U32), ('number', F32), ('area', F32)] + [
+             (str(name), float) for name in float_fields])
+
+
 def read_composite_risk_model(dstore):
     """
     :param dstore: a DataStore instance
@@ -543,7 +595,7 @@ class HazardGetter(object):
 
 class GmfGetter(object):
     """
-    An hazard getter with methods .gen_gmv and .get_hazard returning
+    An hazard getter with methods .get_gmfdata and .get_hazard returning
     ground motion values.
     """
     kind = 'gmf'
@@ -591,10 +643,11 @@ class GmfGetter(object):
         # dictionary eid -> index
         self.eid2idx = dict(zip(self.eids, range(len(self.eids))))
 
-    def gen_gmv(self):
+    def gen_gmfdata(self):
         """
         Compute the GMFs for the given realization and populate the .gmdata
-        array. Yields tuples of the form (sid, eid, imti, gmv).
+        array. Yields arrays of dtype gmf_data_dt, one for each rupture
+        and GSIM, ordered by realization, event and site.
         """
         itemsize = self.gmf_data_dt.itemsize
         sample = 0  # in case of sampling the realizations have a corresponding
@@ -609,7 +662,6 @@ class GmfGetter(object):
                                 for s in range(sample, sample + len(rlzs))]
                 else:
                     all_eids = [rup.events['eid']] * len(rlzs)
-                size = itemsize * len(sids)
                 num_events = sum(len(eids) for eids in all_eids)
                 # NB: the trick for performance is to keep the call to
                 # compute.compute outside of the loop over the realizations
@@ -621,69 +673,171 @@ class GmfGetter(object):
                     arr[arr < miniml] = 0
                 n = 0
                 for r, rlzi in enumerate(rlzs):
-                    e = len(all_eids[r])
+                    eids = all_eids[r]
+                    e = len(eids)
+                    gmfs = array[:, :, n:n + e]  # shape (N, I, e)
+                    n += e
                     gmdata = self.gmdata[rlzi]
                     gmdata[EVENTS] += e
-                    for ei, eid in enumerate(all_eids[r]):
-                        gmf = array[:, :, n + ei]  # shape (N, I)
-                        tot = gmf.sum(axis=0)  # shape (I,)
-                        if not tot.sum():
-                            continue
-                        for i, val in enumerate(tot):
-                            gmdata[i] += val
-                        gmdata[NBYTES] += size
-                        for sid, gmv in zip(sids, gmf):
-                            if gmv.sum():
-                                yield rlzi, sid, eid, gmv
-                    n += e
+                    tot = gmfs.sum(axis=0).T  # shape (e, I)
+                    ok = tot.sum(axis=1) != 0  # events with nonzero gmvs
+                    if not ok.any():
+                        continue
+                    # cumsum adds the events sequentially, in 32 bit
+                    gmdata[:-2] = numpy.cumsum(
+                        numpy.vstack([gmdata[:-2], tot[ok]]), axis=0,
+                        dtype=F32)[-1]
+                    gmdata[NBYTES] += itemsize * len(sids) * ok.sum()
+                    gmfs = gmfs.transpose(2, 0, 1)  # shape (e, N, I)
+                    eidx, sidx = ((gmfs.sum(axis=2) != 0) &
+                                  ok[:, None]).nonzero()
+                    data = numpy.zeros(len(eidx), self.gmf_data_dt)
+                    data['rlzi'] = rlzi
+                    data['sid'] = sids[sidx]
+                    data['eid'] = eids[eidx]
+                    data['gmv'] = gmfs[eidx, sidx]
+                    yield data
             sample += len(rlzs)
 
+    def get_gmfdata(self):
+        """
+        :returns: an array of dtype gmf_data_dt
+        """
+        arrays = list(self.gen_gmfdata())
+        if not arrays:
+            return numpy.zeros(0, self.gmf_data_dt)
+        return numpy.concatenate(arrays)
+
     def get_hazard(self, data=None):
         """
-        :param data: if given, an iterator of records of dtype gmf_data_dt
+        :param data: if given, an array of records of dtype gmf_data_dt
         :returns: an array (rlzi, sid, imti) -> array(gmv, eid)
         """
         if data is None:
-            data = list(self.gen_gmv())
+            data = self.get_gmfdata()
         rlzs = get_rlzs(self)
         hazard = {rlzi: collections.defaultdict(list) for rlzi in rlzs}
-        for rlzi, sid, eid, gmv in data:
-            hazard[rlzi][sid].append((gmv, eid))
-        for haz in hazard.values():
-            for sid in haz:
-                haz[sid] = numpy.array(haz[sid], self.gmv_eid_dt)
+        # stable sort by (rlzi, sid), preserving the order of the events
+        data = data[numpy.lexsort((data['sid'], data['rlzi']))]
+        rlzis, sids = data['rlzi'], data['sid']
+        changes = (rlzis[1:] != rlzis[:-1]) | (sids[1:] != sids[:-1])
+        idxs = numpy.concatenate(
+            [[0], changes.nonzero()[0] + 1, [len(data)]])
+        for start, stop in zip(idxs[:-1], idxs[1:]):
+            if start == stop:  # no data
+                continue
+            recs = data[start:stop]
+            array = numpy.zeros(len(recs), self.gmv_eid_dt)
+            array['gmv'] = recs['gmv']
+            array['eid'] = recs['eid']
+            hazard[recs[0]['rlzi']][recs[0]['sid']] = array
         return hazard
 
 
 class GmfDataGetter(GmfGetter):
     """
-    Extracts a dictionary of GMVs from the datastore
+    Extracts a dictionary of GMVs from the datastore. If the indices
+    `gmf_data_idx` are given, the records of given events, sites and
+    realizations are read without scanning the full datasets.
+
+    :param gmf_data: the HDF5 group `gmf_data`
+    :param grp_id: source group ID
+    :param rlzs_by_gsim: a dictionary gsim -> realizations
+    :param start: the first record to consider
+    :param stop: the last record to consider (None means until the end)
+    :param gmf_idx: the HDF5 group `gmf_data_idx`, or None
     """
-    def __init__(self, gmf_data, grp_id, rlzs_by_gsim, start=0, stop=None):
+    def __init__(self, gmf_data, grp_id, rlzs_by_gsim, start=0, stop=None,
+                 gmf_idx=None):
         self.gmf_data = gmf_data
         self.grp_id = grp_id
         self.rlzs_by_gsim = rlzs_by_gsim
         self.start = start
         self.stop = stop
+        self.gmf_idx = gmf_idx
         self.gmf_data_dt = gmf_data[next(iter(gmf_data))].dtype
 
     def init(self):
         pass
 
-    def gen_gmv(self):
+    def get_rows(self, eid):
+        """
+        :param eid: an event ID
+        :returns:
+            the sorted array of rows containing the given event, or None
+            if the index is missing
+        """
+        key = 'grp-%02d' % self.grp_id
+        try:
+            idx = self.gmf_idx[key]
+        except (TypeError, KeyError):  # no index
+            return
+        eidx = idx['eid'].value
+        i, j = numpy.searchsorted(eidx['eid'], [eid, eid + 1])
+        rows = idx['rows']
+        if i == j:
+            return numpy.zeros(0, int)
+        # there is a record per block of the index, usually a single one
+        return numpy.sort(numpy.concatenate(
+            [rows[rec['start']:rec['stop']] for rec in eidx[i:j]])).astype(int)
+
+    def get_ranges(self, sid=None, rlzi=None):
         """
-        Yield gmv records from the datastore, if present
+        :param sid: a site ID or None
+        :param rlzi: a realization index or None
+        :returns:
+            an array of row ranges containing the given site and
+            realization, or None if the index is missing
+        """
+        key = 'grp-%02d' % self.grp_id
+        try:
+            idx = self.gmf_idx[key]
+        except (TypeError, KeyError):  # no index
+            return
+        index = idx['rlzi_sid'].value
+        ok = numpy.ones(len(index), bool)
+        if sid is not None:
+            ok &= index['sid'] == sid
+        if rlzi is not None:
+            ok &= index['rlzi'] == rlzi
+        return numpy.array([index[ok]['start'], index[ok]['stop']], int).T
+
+    def get_gmfdata(self, eid=None, sid=None, rlzi=None):
+        """
+        :param eid: if given, read only the records of the given event
+        :param sid: if given, read only the records of the given site
+        :param rlzi: if given, read only the records of the realization
+        :returns: the gmv records in the datastore, if present
         """
         key = 'grp-%02d' % self.grp_id
         try:
             dset = self.gmf_data[key]
         except KeyError:
-            return
-        for rec in dset[self.start:self.stop]:
-            yield rec
+            return numpy.zeros(0, self.gmf_data_dt)
+        if eid is None and sid is None and rlzi is None:
+            return dset[self.start:self.stop]
+        stop = len(dset) if self.stop is None else self.stop
+        index = (self.get_rows(eid) if eid is not None
+                 else self.get_ranges(sid, rlzi))
+        if index is None:  # no index, scan the records
+            data = dset[self.start:self.stop]
+        elif eid is not None:  # read the rows inside start:stop at once
+            rows = index[(index >= self.start) & (index < stop)]
+            data = (hdf5.read_rows(dset, rows) if len(rows)
+                    else numpy.zeros(0, self.gmf_data_dt))
+        else:  # read the hyperslabs inside start:stop
+            arrays = [dset[max(s, self.start):min(e, stop)]
+                      for s, e in index if s < stop and e > self.start]
+            data = (numpy.concatenate(arrays) if arrays
+                    else numpy.zeros(0, self.gmf_data_dt))
+        ok = numpy.ones(len(data), bool)
+        for name, value in (('eid', eid), ('sid', sid), ('rlzi', rlzi)):
+            if value is not None:
+                ok &= data[name] == value
+        return data[ok]
 
     @classmethod
-    def gen_gmfs(cls, gmf_data, rlzs_assoc, eid=None):
+    def gen_gmfs(cls, gmf_data, rlzs_assoc, eid=None, gmf_idx=None):
         """
         Returns a gmf_data_dt array
         """
@@ -691,14 +845,12 @@ class GmfDataGetter(GmfGetter):
             grp_ids = [eid // TWO48]  # see event_based.set_eids
         else:
             grp_ids = rlzs_assoc.gsims_by_grp_id
-        records = []
+        arrays = []
         for grp_id in grp_ids:
             rlzs_by_gsim = rlzs_assoc.get_rlzs_by_gsim(grp_id)
-            getter = cls(gmf_data, grp_id, rlzs_by_gsim)
-            for rec in getter.gen_gmv():
-                if eid is None or eid == rec['eid']:
-                    records.append(rec)
-        return numpy.array(records, getter.gmf_data_dt)
+            getter = cls(gmf_data, grp_id, rlzs_by_gsim, gmf_idx=gmf_idx)
+            arrays.append(getter.get_gmfdata(eid))
+        return numpy.concatenate(arrays)
 
 
 def get_rlzs(hazard_getter):
@@ -907,26 +907,19 @@ class LossTypeCurveBuilder(object):
         :returns:
            two arrays, `aids` of size A, and `all_poes` of shape (A, I, C)
         """
-        aids = []
-        all_poes = []
-        for asset in assets:
-            aid = asset.ordinal
-            try:
-                loss_ratios = ratios_by_aid[aid]
-            except KeyError:   # no loss ratios
-                continue
-            # loss_ratios has shape (E, L, I)
-            lrs = loss_ratios[:, self.index]
-            counts = numpy.array([(lrs >= ratio).sum(axis=0)
-                                  for ratio in self.ratios])
-            poes = build_poes(counts, 1. / self.ses_ratio)
-            if len(poes.shape) == 1:
-                poes = poes[:, None]
-            # for instance the ratios can have shape (21,), the loss_ratios
-            # (3, 2), the counts (21, 2) and the transposed poes (2, 21)
-            all_poes.append(poes.T)
-            aids.append(aid)
-        return numpy.array(aids), numpy.array(all_poes)
+        aids = [asset.ordinal for asset in assets
+                if asset.ordinal in ratios_by_aid]
+        if not aids:
+            return numpy.array(aids), numpy.array([])
+        # loss_ratios have shape (E, L, I), the counts shape (A, C, I)
+        counts = count_group_exceedances(
+            [ratios_by_aid[aid][:, self.index] for aid in aids], self.ratios)
+        poes = build_poes(counts, 1. / self.ses_ratio)
+        if len(poes.shape) == 2:
+            poes = poes[:, :, None]
+        # for instance the ratios can have shape (21,), the loss_ratios
+        # (3, 2), the counts (A, 21, 2) and the transposed poes (A, 2, 21)
+        return numpy.array(aids), poes.transpose(0, 2, 1)
 
     def calc_agg_curve(self, losses):
         """
@@ -936,9 +929,7 @@ class LossTypeCurveBuilder(object):
         reference_losses = numpy.linspace(
             0, numpy.max(losses), self.curve_resolution)
         # counts how many loss_values are bigger than the reference loss
-        counts = [(losses > loss).sum() for loss in reference_losses]
-        # NB: (loss_values > loss).sum() is MUCH more efficient than
-        # sum(loss_values > loss). Incredibly more efficient in memory.
+        counts = count_exceedances(losses, reference_losses, strict=True)
         curve = numpy.zeros(1, self.agg_curve_dt)
         curve['losses'][0] = reference_losses
         curve['poes'][0] = poes = build_poes(counts, 1. / self.ses_ratio)
@@ -989,24 +980,26 @@ class CurveBuilder(object):
         curves = numpy.zeros(len(assets), self.loss_curve_dt)
         L = len(self.cbs)
         LI = L * self.I
-        for a, asset in enumerate(assets):
-            try:
-                data = numpy.concatenate(loss_ratios[a])
-            except KeyError:  # no ratios for the given realization
-                continue
-            ratios = data.reshape(-1, LI)
-            for cb in self.cbs:
-                lt = cb.loss_type
-                losses = asset.value(lt) * cb.ratios
-                for i in range(self.I):
-                    arr = curves[a][lt + '_ins' * i]
-                    lrs = ratios[:, cb.index + L * i]
-                    counts = numpy.array([(lrs >= ratio).sum()
-                                          for ratio in cb.ratios], F32)
-                    poes = 1. - numpy.exp(- counts * cb.ses_ratio)
-                    arr['poes'] = poes
-                    arr['losses'] = losses
-                    arr['avg'] = average_loss([losses, poes])
+        idxs = [a for a in range(len(assets)) if loss_ratios.get(a)]
+        if not idxs:  # no ratios for the given realization
+            return curves
+        # A arrays of shape (E_a, LI)
+        ratios = [numpy.concatenate(loss_ratios[a]).reshape(-1, LI)
+                  for a in idxs]
+        for cb in self.cbs:
+            lt = cb.loss_type
+            values = numpy.array([assets[a].value(lt) for a in idxs], F32)
+            losses = values[:, None] * cb.ratios  # shape (A, C)
+            cols = [cb.index + L * i for i in range(self.I)]
+            counts = count_group_exceedances(  # shape (A, C, I)
+                [r[:, cols] for r in ratios], cb.ratios)
+            for i in range(self.I):
+                arr = curves[lt + '_ins' * i]
+                poes = 1. - numpy.exp(- counts[:, :, i].astype(F32) *
+                                      cb.ses_ratio)
+                arr['poes'][idxs] = poes
+                arr['losses'][idxs] = losses
+                arr['avg'][idxs] = average_losses(losses, poes)
         return curves
 
     def build_maps(self, assets, getter, rlzs, stats, mon):
@@ -1073,24 +1066,90 @@ class CurveBuilder(object):
         L = len(self.cbs)
         LI = L * self.I
         poes = numpy.zeros((len(aids), len(rlzs)), self.dt)
-        for a, aid in enumerate(aids):
-            dic = group_array(loss_ratios[a], 'rlzi')
-            for rlz in rlzs:
-                r = rlz.ordinal
-                try:
-                    ratios = dic[r]['ratios'].reshape(-1, LI)
-                except KeyError:
-                    continue  # no ratios for the given realization
-                for cb in self.cbs:
-                    for i in range(self.I):
-                        lt = cb.index + L * i
-                        lrs = ratios[:, lt]
-                        counts = numpy.array([(lrs >= ratio).sum()
-                                              for ratio in cb.ratios], F32)
-                        poes[a, r][lt] = 1. - numpy.exp(-counts * cb.ses_ratio)
+        ordinals = [rlz.ordinal for rlz in rlzs]
+        # group the ratios by (asset, realization)
+        groups = []
+        for a, data in enumerate(loss_ratios):
+            dic = group_array(data, 'rlzi')
+            for r in ordinals:
+                if r in dic:
+                    groups.append((a, r, dic[r]['ratios'].reshape(-1, LI)))
+        if not groups:
+            return poes
+        idx_a, idx_r, arrays = zip(*groups)  # G arrays of shape (E_g, LI)
+        for cb in self.cbs:
+            for i in range(self.I):
+                lt = cb.index + L * i
+                counts = count_group_exceedances(  # shape (G, C)
+                    [arr[:, lt] for arr in arrays], cb.ratios)
+                poes[self.dt.names[lt]][idx_a, idx_r] = 1. - numpy.exp(
+                    -counts.astype(F32) * cb.ses_ratio)
         return poes
 
 
+def count_exceedances(values, thresholds, strict=False):
+    """
+    Count how many values are above each threshold. NaN values are not
+    counted (see :func:`count_group_exceedances`).
+
+    :param values: an array of shape (E, ...)
+    :param thresholds: an array of C thresholds
+    :param strict: if True count the values > threshold, otherwise >=
+    :returns: an array of integers of shape (C, ...)
+
+    >>> count_exceedances([.1, .2, .2, numpy.nan, .5], [0, .2, .3, .6])
+    array([4, 3, 1, 0])
+    >>> count_exceedances([.1, .2, .2, numpy.nan, .5], [0, .2, .3, .6], True)
+    array([4, 1, 1, 0])
+    """
+    return count_group_exceedances([values], thresholds, strict)[0]
+
+
+def count_group_exceedances(arrays, thresholds, strict=False):
+    """
+    Count how many values of each array are above each threshold, for all
+    the arrays and all the columns in a single pass. Each value is
+    replaced by the number of thresholds below it, so that the pairs
+    (group, rank) become exact integer keys with an offset per group;
+    the keys are sorted once and all the counts are found with a single
+    binary search, so that the cost is O(N log N) with N the total number
+    of values and not O(N x C). NaN values are not counted.
+
+    :param arrays: a list of G arrays of shape (E_g, ...)
+    :param thresholds: an array of C thresholds
+    :param strict: if True count the values > threshold, otherwise >=
+    :returns: an array of integers of shape (G, C, ...)
+
+    >>> count_group_exceedances([[.1, .3], [.2, .4, .5]], [.2, .4])
+    array([[1, 0],
+           [3, 2]])
+    """
+    arrays = [numpy.asarray(arr) for arr in arrays]
+    thresholds = numpy.asarray(thresholds)
+    G, C = len(arrays), len(thresholds)
+    shape = arrays[0].shape[1:]
+    K = int(numpy.prod(shape))
+    values = numpy.concatenate(arrays).reshape(-1, K)
+    # there is a group for each column of each array
+    groups = numpy.repeat(numpy.arange(G) * K, [len(a) for a in arrays])
+    groups = groups[:, None] + numpy.arange(K)
+    order = numpy.argsort(thresholds)
+    # a value exceeds the c-th sorted threshold if its rank is > c
+    ranks = numpy.searchsorted(
+        thresholds[order], values, 'left' if strict else 'right')
+    ranks[numpy.isnan(values)] = 0  # never counted
+    keys = numpy.sort((groups * (C + 1) + ranks).ravel())
+    # the values of the group h with rank > c are the keys in the range
+    # [h * (C + 1) + c + 1, (h + 1) * (C + 1)); the upper bound of the
+    # group h is the query for c = C
+    bounds = numpy.arange(1, G * K * (C + 1) + 1)
+    pos = numpy.searchsorted(keys, bounds).reshape(G * K, C + 1)
+    counts = numpy.empty((G * K, C), int)
+    counts[:, order] = pos[:, C:] - pos[:, :C]
+    return counts.reshape(G, K, C).transpose(0, 2, 1).reshape(
+        (G, C) + shape)
+
+
 # should I use the ses_ratio here?
 def build_poes(counts, nses):
     """
@@ -1399,6 +1458,20 @@ def average_loss(losses_poes):
     return numpy.dot(-pairwise_diff(losses), pairwise_mean(poes))
 
 
+def average_losses(losses, poes):
+    """
+    Vectorized version of :func:`average_loss` for arrays of loss curves.
+
+    :param losses: an array of shape (A, C)
+    :param poes: an array of shape (A, C)
+    :returns: an array of shape A
+    """
+    diff = losses[:, :-1] - losses[:, 1:]
+    mean = (poes[:, :-1] + poes[:, 1:]) / 2
+    # the row-by-row dot gives exactly the same numbers as average_loss
+    return numpy.array([numpy.dot(-d, m) for d, m in zip(diff, mean)])
+
+
 def normalize_curves_eb(curves):
     """
     A more sophisticated version of normalize_curves, used in the event
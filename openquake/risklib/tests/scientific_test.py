@@ -530,6 +530,40 @@ class FragilityFunctionTestCase(unittest.TestCase):
         self.assertTrue(ffd1 != ffd2)
 
 
+class CountExceedancesTestCase(unittest.TestCase):
+    def test_same_as_comparisons(self):
+        rs = numpy.random.RandomState(42)
+        values = rs.randint(0, 20, size=(100, 5, 2)) / 20.
+        ratios = numpy.array([0, .1, .25, .5, .5, .95, 1.])
+        counts = scientific.count_exceedances(values, ratios)
+        expected = [(values >= ratio).sum(axis=0) for ratio in ratios]
+        numpy.testing.assert_equal(counts, expected)
+        counts = scientific.count_exceedances(values, ratios, strict=True)
+        expected = [(values > ratio).sum(axis=0) for ratio in ratios]
+        numpy.testing.assert_equal(counts, expected)
+
+    def test_nan(self):
+        values = numpy.array([[.1, .4], [.3, numpy.nan], [.5, numpy.nan]])
+        counts = scientific.count_exceedances(values, [.2, .4])
+        numpy.testing.assert_equal(counts, [[2, 1], [1, 1]])
+
+    def test_groups_same_as_comparisons(self):
+        # several assets with a different number of events, two columns
+        rs = numpy.random.RandomState(42)
+        arrays = [rs.randint(0, 20, size=(E, 2)) / 20.
+                  for E in (10, 0, 1, 37, 100)]
+        ratios = numpy.array([.5, 0, .1, .25, .5, .95, 1.])
+        counts = scientific.count_group_exceedances(arrays, ratios)
+        self.assertEqual(counts.shape, (5, 7, 2))
+        for lrs, cnt in zip(arrays, counts):
+            expected = [(lrs >= r).sum(axis=0) for r in ratios]
+            numpy.testing.assert_equal(cnt, expected)
+        counts = scientific.count_group_exceedances(arrays, ratios, True)
+        for lrs, cnt in zip(arrays, counts):
+            expected = [(lrs > r).sum(axis=0) for r in ratios]
+            numpy.testing.assert_equal(cnt, expected)
+
+
 class InsuredLossesTestCase(unittest.TestCase):
     def test_below_deductible(self):
         numpy.testing.assert_allclose(
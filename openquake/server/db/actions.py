@@ -316,6 +316,24 @@ def log(db, job_id, timestamp, level, process, message):
        'VALUES (?X)', (job_id, timestamp, level, process, message))
 
 
+def log_batch(db, job_id, records):
+    """
+    Write several log records in the database in a single transaction.
+
+    :param db:
+        a :class:`openquake.server.dbapi.Db` instance
+    :param job_id:
+        a job ID
+    :param records:
+        a list of tuples (timestamp, level, process, message)
+    """
+    rows = [(job_id,) + tuple(rec) for rec in records]
+    with db:  # commit at the end
+        db('BEGIN')
+        db.insert('log', 'job_id timestamp level process message'.split(),
+                  rows)
+
+
 def get_log(db, job_id):
     """
     Extract the logs as a big string
@@ -352,8 +370,10 @@ def save_performance(db, job_id, records):
     # into an int in Ubuntu 12.04, so we convert it manually below
     rows = [(job_id, rec['operation'], rec['time_sec'], rec['memory_mb'],
              int(rec['counts'])) for rec in records]
-    db.insert('performance',
-              'job_id operation time_sec memory_mb counts'.split(), rows)
+    with db:  # commit at the end
+        db('BEGIN')
+        db.insert('performance',
+                  'job_id operation time_sec memory_mb counts'.split(), rows)
 
 
 # used in make_report
@@ -511,7 +531,10 @@ def update_parent_child(db, parent_child):
 
 def get_log_slice(db, job_id, start, stop):
     """
-    Get a slice of the calculation log as a JSON list of rows
+    Get a slice of the calculation log as a JSON list of rows, in order of
+    insertion, so that the log can be read incrementally. Since the
+    records are sent in batches by each process, the records of different
+    processes can be interleaved by batch, i.e. not in timestamp order.
 
     :param db:
         a :class:`openquake.server.dbapi.Db` instance
@@ -22,6 +22,7 @@ import socket
 import sqlite3
 import os.path
 import logging
+import threading
 import subprocess
 from multiprocessing.connection import Listener
 from concurrent.futures import ThreadPoolExecutor
@@ -64,26 +65,45 @@ class DbServer(object):
                     # scanner such as the one in manage.py
                     continue
                 cmd_ = conn.recv()  # a tuple (name, arg1, ... argN)
-                cmd, args = cmd_[0], cmd_[1:]
-                logging.debug('Got ' + str(cmd_))
-                if cmd == 'stop':
+                if cmd_[0] == 'stop':
                     conn.send((None, None))
                     conn.close()
                     break
-                func = getattr(actions, cmd)
-                fut = executor.submit(safely_call, func, (self.db,) + args)
-
-                def sendback(fut, conn=conn):
-                    res, etype, _mon = fut.result()
-                    if etype:
-                        logging.error(res)
-                    # send back the result and the exception class
-                    conn.send((res, etype))
-                    conn.close()
-                fut.add_done_callback(sendback)
+                thread = threading.Thread(target=self.serve, args=(conn, cmd_))
+                thread.daemon = True
+                thread.start()
         finally:
             listener.close()
 
+    def serve(self, conn, cmd_):
+        """
+        Execute the commands received on a connection, in order, until the
+        client closes it. Clients like :func:`openquake.commonlib.logs.dbcmd`
+        send a single command, while the log handler keeps the connection
+        open and sends batches of records on it.
+
+        :param conn: a connection accepted by the listener
+        :param cmd_: the first command received on the connection
+        """
+        try:
+            while True:
+                cmd, args = cmd_[0], cmd_[1:]
+                logging.debug('Got ' + str(cmd_))
+                func = getattr(actions, cmd)
+                # all the commands are executed in the same thread
+                res, etype, _mon = executor.submit(
+                    safely_call, func, (self.db,) + args).result()
+                if etype:
+                    logging.error(res)
+                # send back the result and the exception class
+                conn.send((res, etype))
+                try:
+                    cmd_ = conn.recv()
+                except EOFError:  # the client closed the connection
+                    break
+        finally:
+            conn.close()
+
 
 def different_paths(path1, path2):
     path1 = os.path.realpath(path1)  # expand symlinks
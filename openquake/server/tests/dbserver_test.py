@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+# Copyright (C) 2017 GEM Foundation
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake. If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from datetime import datetime
+from multiprocessing import Pipe
+
+from openquake.commonlib import logs
+from openquake.server import dbapi
+from openquake.server.db import actions
+from openquake.server.dbserver import DbServer
+
+
+def make_records(n):
+    return [(datetime(2017, 1, 1, 0, 0, i), 'INFO', 'MainProcess/1',
+             'message %d' % i) for i in range(n)]
+
+
+class DbServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = dbapi.Db(
+            sqlite3.connect, os.path.join(self.tmpdir, 'db.sqlite3'),
+            isolation_level=None, detect_types=sqlite3.PARSE_DECLTYPES)
+        actions.upgrade_db(self.db)
+        self.job_id = actions.create_job(
+            self.db, 'classical', 'test', 'user', self.tmpdir)
+
+    def tearDown(self):
+        self.db.conn.close()
+        shutil.rmtree(self.tmpdir)
+
+    def get_messages(self):
+        rows = actions.get_log_slice(self.db, self.job_id, 0, 0)
+        return [row[3] for row in rows]
+
+    def test_log_batch(self):
+        actions.log_batch(self.db, self.job_id, make_records(3))
+        self.assertEqual(self.get_messages(),
+                         ['message 0', 'message 1', 'message 2'])
+
+        # a bad record rolls back the whole batch
+        records = make_records(2) + [(datetime.now(), 'INFO', 'p', None)]
+        with self.assertRaises(sqlite3.IntegrityError):
+            actions.log_batch(self.db, self.job_id, records)
+        self.assertEqual(len(self.get_messages()), 3)
+
+    def test_persistent_connection(self):
+        # several commands are served on the same connection, in order,
+        # until the client closes it
+        server = DbServer(self.db, None, None)
+        client, conn = Pipe()
+        first = ('log_batch', self.job_id, make_records(2))
+        thread = threading.Thread(target=server.serve, args=(conn, first))
+        thread.start()
+        self.assertEqual(client.recv(), (None, None))
+        logs.send(client, 'log', self.job_id, *make_records(3)[2])
+        self.assertEqual(logs.send(client, 'get_log_size', self.job_id), 3)
+        with self.assertRaises(ValueError):  # the error is sent back
+            logs.send(client, 'get_log_slice', self.job_id, 'x', 0)
+        self.assertEqual(logs.send(client, 'get_log_size', self.job_id), 3)
+        client.close()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(self.get_messages(),
+                         ['message 0', 'message 1', 'message 2'])
@@ -74,7 +74,6 @@ if sys.version < '3':
 
 extras_require = {
     'prctl': ["python-prctl ==1.6.1"],
-    'rtree':  ["Rtree >=0.8.2, <0.8.4"],
     'celery':  ["celery >=3.1, <4.0"],
     'pam': ["python-pam", "django-pam"],
     'plotting':  [